@@ -0,0 +1,312 @@
+from __future__ import annotations
+import ast
+import gc
+import random
+import sys
+import tracemalloc
+import types
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+import numpy as np
+import pandas as pd
+from loguru import logger
+from battle import Battle
+
+if TYPE_CHECKING:
+    from battle_orchestrator import BattleOrchestrator
+
+PACKAGE_DIRECTORY = Path(__file__).resolve().parent
+TRACEBACK_FRAMES = 25
+
+class AllocationBudgetExceeded(AssertionError):
+    pass
+
+@dataclass
+class AllocationBudget:
+    """Per battle limits in bytes; None leaves a measure unchecked."""
+    peak_bytes_per_battle: float | None = None
+    live_bytes_per_battle: float | None = None
+    live_blocks_per_battle: float | None = None
+    retained_bytes_per_battle: float | None = None
+
+@dataclass
+class AllocationReport:
+    battles: int
+    sampled_battles: int
+    peak_bytes_per_battle: float
+    max_peak_bytes: int
+    live_bytes_per_battle: float
+    live_blocks_per_battle: float
+    allocated_blocks_per_battle: float
+    retained_bytes_per_battle: float
+    max_rss_bytes: int | None
+    by_source: pd.DataFrame
+
+    def __str__(self) -> str:
+        return (f"{self.battles} battles: peak {self.peak_bytes_per_battle:.0f} B/battle (max {self.max_peak_bytes} B), "
+                f"live at battle end {self.live_bytes_per_battle:.0f} B in {self.live_blocks_per_battle:.0f} blocks, "
+                f"{self.allocated_blocks_per_battle:.0f} blocks allocated, "
+                f"retained {self.retained_bytes_per_battle:.1f} B/battle, max RSS {self.max_rss_bytes} B\n"
+                f"{self.by_source.head(15).to_string(index=False)}")
+
+    def check(self, budget: AllocationBudget) -> None:
+        """Raises AllocationBudgetExceeded for every measure above its budget, so tests can enforce a budget."""
+        exceeded = [f"{name} is {getattr(self, name):.1f}, budget {limit}"
+                    for name, limit in vars(budget).items() if limit is not None and getattr(self, name) > limit]
+        if exceeded:
+            raise AllocationBudgetExceeded("Allocation budget exceeded: " + "; ".join(exceeded))
+
+@cache
+def function_ranges(filename: str) -> list[tuple[int, int, str]]:
+    """(first line, last line, qualified name) of every function in a source file, innermost last."""
+    ranges = []
+
+    def visit(node: ast.AST, prefix: str) -> None:
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                name = f"{prefix}{child.name}"
+                if not isinstance(child, ast.ClassDef):
+                    ranges.append((child.lineno, child.end_lineno, name))
+                visit(child, f"{name}.")
+    visit(ast.parse(Path(filename).read_text(encoding="utf-8")), "")
+    return sorted(ranges, key=lambda function_range: function_range[1] - function_range[0], reverse=True)
+
+@cache
+def package_module(filename: str) -> str | None:
+    """Module name of a source file of this package, or None for any other file."""
+    path = Path(filename)
+    return path.stem if path.parent == PACKAGE_DIRECTORY else None
+
+def allocation_source(traceback: tracemalloc.Traceback) -> tuple[str, str]:
+    """(module, function) of the innermost frame of the traceback that lies in this package."""
+    for frame in reversed(traceback):
+        module = package_module(frame.filename)
+        if module is not None:
+            function = "<module>"
+            for first_line, last_line, name in function_ranges(frame.filename):
+                if first_line <= frame.lineno <= last_line:
+                    function = name
+            return module, function
+    return "<other>", "<other>"
+
+def reset_peak_rss() -> bool:
+    """Resets the peak resident set size of the process where the kernel allows it (Linux), so max_rss_bytes reads the
+    peak of what runs afterwards. Returns False where it cannot be reset."""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+    return True
+
+def max_rss_bytes() -> int | None:
+    """Peak resident set size since reset_peak_rss, or over the whole life of the process where it cannot be reset."""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+def play_battle(orchestrator: BattleOrchestrator, seed: int) -> Battle:
+    player_army, enemy_army, battle_modifiers = orchestrator.battle_setup()
+    battle = Battle(player_army, enemy_army, orchestrator.terrain, battle_modifiers, random.Random(seed))
+    battle.perform_battle()
+    return battle
+
+class CallAllocations:
+    """Attributes the traced memory allocated between two interpreter events, calls and returns, to the innermost
+    running function of this package through sys.monitoring, so allocations freed again before the battle ends are
+    counted too.
+
+    Per source it sums the bytes allocated, as the peak of traced memory above its level after the previous event, and
+    the pymalloc blocks allocated, as the growth of sys.getallocatedblocks between events. Memory freed and allocated
+    again between two events is counted once, so both are lower bounds."""
+    EVENTS = (sys.monitoring.events.PY_START | sys.monitoring.events.PY_RESUME | sys.monitoring.events.PY_RETURN
+              | sys.monitoring.events.PY_YIELD | sys.monitoring.events.PY_UNWIND | sys.monitoring.events.CALL
+              | sys.monitoring.events.C_RETURN | sys.monitoring.events.C_RAISE)
+
+    def __init__(self) -> None:
+        self.tool_id = sys.monitoring.PROFILER_ID
+        self.allocated: dict[tuple[str, str], list[int]] = {}
+        self.stack: list[tuple[str, str]] = []
+        self.baseline_bytes = 0
+        self.baseline_blocks = 0
+        self.overhead_bytes = 0
+        self.overhead_blocks = 0
+
+    @staticmethod
+    def free_tool_id() -> int:
+        """The profiler tool id, or another free one when a profiler such as cProfile already holds it."""
+        monitoring = sys.monitoring
+        for tool_id in (monitoring.PROFILER_ID, *range(monitoring.OPTIMIZER_ID + 1)):
+            if monitoring.get_tool(tool_id) is None:
+                return tool_id
+        raise ValueError("Every sys.monitoring tool id is in use, stop another profiler to profile allocations")
+
+    def __enter__(self) -> "CallAllocations":
+        monitoring = sys.monitoring
+        self.tool_id = self.free_tool_id()
+        monitoring.use_tool_id(self.tool_id, "allocation_profile")
+        for event, callback in ((monitoring.events.PY_START, self.on_start), (monitoring.events.PY_RESUME, self.on_start),
+                                (monitoring.events.PY_RETURN, self.on_return), (monitoring.events.PY_YIELD, self.on_return),
+                                (monitoring.events.PY_UNWIND, self.on_return), (monitoring.events.CALL, self.on_call),
+                                (monitoring.events.C_RETURN, self.on_c_return), (monitoring.events.C_RAISE, self.on_c_return)):
+            monitoring.register_callback(self.tool_id, event, callback)
+        self.stack = []
+        self.calibrate()
+        self.reset()
+        monitoring.set_events(self.tool_id, self.EVENTS)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        sys.monitoring.set_events(self.tool_id, 0)
+        sys.monitoring.restart_events()
+        sys.monitoring.free_tool_id(self.tool_id)
+
+    def reset(self) -> None:
+        tracemalloc.reset_peak()
+        self.baseline_bytes = tracemalloc.get_traced_memory()[0]
+        self.baseline_blocks = sys.getallocatedblocks()
+
+    def calibrate(self) -> None:
+        """Measures what reading the baselines allocates by itself, so it is not counted for every event."""
+        overheads = []
+        for _ in range(5):
+            self.reset()
+            overheads.append((tracemalloc.get_traced_memory()[1] - self.baseline_bytes,
+                              sys.getallocatedblocks() - self.baseline_blocks))
+        self.overhead_bytes, self.overhead_blocks = min(overheads)
+
+    def count(self) -> None:
+        """Adds what was allocated since the previous event to the function running in between."""
+        allocated_bytes = tracemalloc.get_traced_memory()[1] - self.baseline_bytes - self.overhead_bytes
+        allocated_blocks = sys.getallocatedblocks() - self.baseline_blocks - self.overhead_blocks
+        if self.stack and (allocated_bytes > 0 or allocated_blocks > 0):
+            totals = self.allocated.setdefault(self.stack[-1], [0, 0])
+            totals[0] += max(allocated_bytes, 0)
+            totals[1] += max(allocated_blocks, 0)
+
+    def on_start(self, code: types.CodeType, _) -> object:
+        module = package_module(code.co_filename)
+        if module is None:
+            return sys.monitoring.DISABLE
+        self.count()
+        self.stack.append((module, code.co_qualname.replace(".<locals>", "")))
+        self.reset()
+        return None
+
+    def on_return(self, code: types.CodeType, _, __) -> object:
+        if package_module(code.co_filename) is None:
+            return None
+        self.count()
+        if self.stack:
+            self.stack.pop()
+        self.reset()
+        return None
+
+    def on_call(self, code: types.CodeType, _, __, ___) -> object:
+        if package_module(code.co_filename) is None:
+            return sys.monitoring.DISABLE
+        self.count()
+        self.reset()
+        return None
+
+    def on_c_return(self, code: types.CodeType, _, __, ___) -> None:
+        # Unlike calls, returns from C functions cannot be disabled per location.
+        if package_module(code.co_filename) is not None:
+            self.count()
+            self.reset()
+
+def attribute_allocations(orchestrator: BattleOrchestrator, battle_count: int, seed: int) -> tuple[pd.DataFrame, float, float]:
+    """Allocations of each battle by the innermost module and function of this package that made them, averaged over
+    battle_count battles, and the average numbers of blocks allocated during a battle and still live at its end.
+
+    One pass per battle compares snapshots before and after it for the memory still live when it ends, another counts
+    every allocation on the way with CallAllocations, short-lived rolls, results and log messages included."""
+    from battle_orchestrator import battle_seed
+    live: dict[tuple[str, str], list[int]] = {}
+    total_live_blocks = 0
+    ignore_tracemalloc = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    calls = CallAllocations()
+    for battle_index in range(battle_count):
+        before = tracemalloc.take_snapshot().filter_traces(ignore_tracemalloc)
+        battle = play_battle(orchestrator, battle_seed(seed, battle_index))
+        after = tracemalloc.take_snapshot().filter_traces(ignore_tracemalloc)
+        for statistic in after.compare_to(before, "traceback"):
+            if statistic.size_diff <= 0 and statistic.count_diff <= 0:
+                continue
+            totals = live.setdefault(allocation_source(statistic.traceback), [0, 0])
+            totals[0] += statistic.size_diff
+            totals[1] += statistic.count_diff
+            total_live_blocks += statistic.count_diff
+        del battle, before, after
+        gc.collect()
+        with calls:
+            battle = play_battle(orchestrator, battle_seed(seed, battle_index))
+        del battle
+    battle_count = max(battle_count, 1)
+    sources = dict.fromkeys([*calls.allocated, *live])
+    by_source = pd.DataFrame([{"module": module, "function": function,
+                               "allocated_bytes_per_battle": calls.allocated.get((module, function), [0, 0])[0] / battle_count,
+                               "allocated_blocks_per_battle": calls.allocated.get((module, function), [0, 0])[1] / battle_count,
+                               "bytes_per_battle": live.get((module, function), [0, 0])[0] / battle_count,
+                               "blocks_per_battle": live.get((module, function), [0, 0])[1] / battle_count}
+                              for module, function in sources],
+                             columns=["module", "function", "allocated_bytes_per_battle", "allocated_blocks_per_battle",
+                                      "bytes_per_battle", "blocks_per_battle"])
+    allocated_blocks = sum(blocks for _, blocks in calls.allocated.values()) / battle_count
+    return (by_source.sort_values("allocated_bytes_per_battle", ascending=False, ignore_index=True), allocated_blocks,
+            total_live_blocks / battle_count)
+
+def profile_allocations(orchestrator: BattleOrchestrator, number_of_iterations: int = 1000, seed: int = 0,
+                        sampled_battles: int = 50) -> AllocationReport:
+    """Plays battles one by one under tracemalloc.
+
+    For every battle it measures the peak of traced memory above the level before the battle (transient pressure from
+    rolls, results and log messages included) and the memory still live when the battle ends while its objects are
+    alive. The allocations of the first sampled_battles battles, short-lived ones included, are attributed to the
+    innermost module and function of this package that made them, see attribute_allocations. Retained bytes are what
+    is still allocated once all battles are released, i.e. leaks and caches. The max RSS is the peak of this run where
+    the peak can be reset, see reset_peak_rss, and otherwise the peak of the process so far."""
+    from battle_orchestrator import battle_seed
+    reset_peak_rss()
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start(TRACEBACK_FRAMES)
+    try:
+        by_source, allocated_blocks, live_blocks = attribute_allocations(orchestrator, min(sampled_battles, number_of_iterations), seed)
+        peaks = np.zeros(number_of_iterations, dtype=np.int64)
+        live_bytes = np.zeros(number_of_iterations, dtype=np.int64)
+        gc.collect()
+        start_bytes, _ = tracemalloc.get_traced_memory()
+        for battle_index in range(number_of_iterations):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            battle = play_battle(orchestrator, battle_seed(seed, battle_index))
+            current, peak = tracemalloc.get_traced_memory()
+            peaks[battle_index] = peak - baseline
+            live_bytes[battle_index] = current - baseline
+            del battle
+        gc.collect()
+        end_bytes, _ = tracemalloc.get_traced_memory()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    report = AllocationReport(number_of_iterations, min(sampled_battles, number_of_iterations),
+                              float(peaks.mean()) if number_of_iterations else 0.0, int(peaks.max(initial=0)),
+                              float(live_bytes.mean()) if number_of_iterations else 0.0, live_blocks, allocated_blocks,
+                              (end_bytes - start_bytes) / max(number_of_iterations, 1), max_rss_bytes(), by_source)
+    logger.info(f"Allocation profile of {number_of_iterations} battles: peak {report.peak_bytes_per_battle:.0f} B/battle, "
+                f"retained {report.retained_bytes_per_battle:.1f} B/battle")
+    return report
@@ -1,11 +1,14 @@
 from __future__ import annotations
 from abc import abstractmethod
-from typing import override
+from typing import TYPE_CHECKING, override
 from loguru import logger
 import uprising_units
 import dice
 from dice import STANDARD_LOSS_PRIORITY
 
+if TYPE_CHECKING:
+    import exact_rolls
+
 class Army:
     def __init__(self) -> None:
         self.current_dice_pool: dice.DicePool
@@ -67,6 +70,15 @@ class UnitsArmy(Army):
         logger.debug(f"Army with units {self.units} has the following clash dice: {pool.dice_count}")
         return pool
     
+    def archery_distribution(self) -> exact_rolls.PoolDistribution:
+        """Exact distribution of the archery roll of the current units, without collecting the dice pool."""
+        from exact_rolls import distribution_of_dice
+        return distribution_of_dice(die for unit in self.units for die in unit.archery_dice)
+
+    def clash_distribution(self) -> exact_rolls.PoolDistribution:
+        from exact_rolls import distribution_of_dice
+        return distribution_of_dice(die for unit in self.units for die in unit.clash_dice)
+
     def remove_worst_unit(self) -> None:
         for dice_type in self.loss_priority:
             for index, unit in enumerate(self.units):
@@ -163,4 +175,5 @@ def main():
 
     tua_army.take_loses(5)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
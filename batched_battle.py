@@ -0,0 +1,474 @@
+from __future__ import annotations
+from collections import Counter
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Sequence
+import numpy as np
+import pandas as pd
+from loguru import logger
+import army
+import dice
+import effects
+import uprising_units
+from battle import take_loses_with_mercy
+from battle_state import BattleResult, BattleStage, BattleState, OverallBattleResult, OUTCOME_CODES, Terrain, TerrainType
+from roll_modifier import RollModifier
+from result_rules import damage_needed_to_kill_enemy
+
+if TYPE_CHECKING:
+    from battle_orchestrator import ArmyConfig, BattleConfig
+
+# Columns of a die face / roll total vector
+SKULLS, SHIELDS, BOLTS, STARS, BLANKS = range(5)
+RESULT_FIELDS = ("skulls", "shields", "bolts", "stars", "blanks")
+
+DIE_NAMES: list[str] = list(dice.DIE_TYPES)
+FACE_TABLE: np.ndarray = np.array([[[getattr(face, field) for field in RESULT_FIELDS]
+                                    for face in die_class().die_outcome_distribution.distribution]
+                                   for die_class in dice.DIE_TYPES.values()], dtype=np.int16)
+REROLL_PRIORITY_RANK: np.ndarray = np.array([dice.STANDARD_DICE_PRIORITY.index(name) for name in DIE_NAMES])
+
+STAGES = (BattleStage.ARHCERY, BattleStage.CLASH)
+MAX_CLASH_ROUNDS = 1000
+SIDE_TABLES_CACHE_SIZE = 4096
+
+@dataclass
+class BatchedBattleResults:
+    outcome: np.ndarray
+    net_resources: np.ndarray
+    rounds: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.outcome)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        victor = pd.Series(np.array(list(OverallBattleResult), dtype=object)[self.outcome])
+        return pd.DataFrame({"overall_result": victor.str.cat(pd.Series(self.net_resources).astype(str), sep=", "),
+                             "victor": victor,
+                             "net_resources": self.net_resources})
+
+    def outcome_frequencies(self) -> dict[OverallBattleResult, float]:
+        counts = np.bincount(self.outcome, minlength=len(OUTCOME_CODES))
+        return {result: counts[code] / len(self) for result, code in OUTCOME_CODES.items()}
+
+@dataclass
+class SideTables:
+    """Everything the batched engine needs to know about one side, indexed by a compact army code.
+
+    Units armies are encoded as a bitmask of the configured units still alive, imperial armies as their
+    garrison level. The tables are filled in by running the reference army objects once per code."""
+    imperial: bool
+    unit_classes: list[type[uprising_units.Unit]]
+    initial_code: int
+    dice_counts: np.ndarray
+    slot_types: list[np.ndarray]
+    slot_ordinals: list[np.ndarray]
+    next_code: np.ndarray
+    next_code_mercy: np.ndarray
+    value: np.ndarray
+    hit_points: np.ndarray
+    unit_count: np.ndarray
+    kill_hit_points: np.ndarray
+    harpooneer_mask: int
+
+    @property
+    def max_losses(self) -> int:
+        return self.next_code.shape[1] - 1
+
+@dataclass
+class SideRoll:
+    types: np.ndarray
+    active: np.ndarray
+    faces: np.ndarray
+    reroll_faces: np.ndarray
+    totals: np.ndarray
+
+    def face_results(self) -> np.ndarray:
+        return FACE_TABLE[self.types[None, :], self.faces] * self.active[..., None]
+
+@dataclass
+class RoundRolls:
+    rows: np.ndarray
+    stage: BattleStage
+    player: SideRoll
+    enemy: SideRoll
+
+    def side(self, target: str) -> SideRoll:
+        return self.player if target == effects.PLAYER else self.enemy
+
+def build_army(army_config: ArmyConfig, code: int | None = None) -> army.Army:
+    new_army: army.Army = army_config.army_type()
+    for index, unit in enumerate(army_config.units):
+        if code is None or code >> index & 1:
+            new_army.add_unit(unit)
+    return new_army
+
+def imperial_army_code(imperial_army: army.Army) -> int:
+    if len(imperial_army.units) == 0:
+        return 0
+    return int(imperial_army.units[0].name[-1])
+
+def build_side_tables(army_config: ArmyConfig, terrain: Terrain, roll_modifications: list, player_side: bool) -> SideTables:
+    """Tables of one side, shared by every engine with the same army, terrain and roll modifications."""
+    return cached_side_tables(army_config.army_type, tuple(army_config.units), terrain.terrain_type,
+                              tuple(roll_modifications), player_side)
+
+@lru_cache(maxsize=SIDE_TABLES_CACHE_SIZE)
+def cached_side_tables(army_type: type[army.Army], units: tuple[type[uprising_units.Unit], ...], terrain_type: TerrainType,
+                       roll_modifications: tuple, player_side: bool) -> SideTables:
+    imperial = issubclass(army_type, army.ImperialArmy)
+    unit_classes = list(units)
+    terrain = Terrain(terrain_type)
+    if imperial:
+        if len(unit_classes) != 1 or not unit_classes[0].name.startswith("Garrison"):
+            raise ValueError("Batched engine expects an imperial army with exactly one garrison unit")
+        if player_side:
+            raise ValueError("Batched engine only supports a units army on the player side")
+        initial_code = int(unit_classes[0].name[-1])
+        codes = range(initial_code + 1)
+        max_losses = initial_code
+    else:
+        if len(unit_classes) > 5:
+            logger.warning(f"Army config has {len(unit_classes)} units, only the first 5 fit in an army")
+            unit_classes = unit_classes[:5]
+        initial_code = (1 << len(unit_classes)) - 1
+        codes = range(initial_code + 1)
+        max_losses = len(unit_classes)
+
+    def army_for_code(code: int) -> tuple[army.Army, dict[int, int]]:
+        if imperial:
+            garrisons = [uprising_units.Garrison1, uprising_units.Garrison2, uprising_units.Garrison3]
+            new_army = army_type()
+            if code > 0:
+                new_army.add_unit(garrisons[code - 1])
+            return new_army, {}
+        new_army = army_type()
+        unit_index = {}
+        for index, unit in enumerate(unit_classes):
+            if code >> index & 1:
+                new_army.add_unit(unit)
+                unit_index[id(new_army.units[-1])] = index
+        return new_army, unit_index
+
+    def code_of(side_army: army.Army, unit_index: dict[int, int]) -> int:
+        if imperial:
+            return imperial_army_code(side_army)
+        return sum(1 << unit_index[id(unit)] for unit in side_army.units)
+
+    dice_counts = np.zeros((len(STAGES), len(codes), len(DIE_NAMES)), dtype=np.int16)
+    next_code = np.zeros((len(codes), max_losses + 1), dtype=np.int16)
+    next_code_mercy = np.zeros_like(next_code)
+    value = np.zeros(len(codes), dtype=np.int32)
+    hit_points = np.zeros(len(codes), dtype=np.int16)
+    unit_count = np.zeros(len(codes), dtype=np.int16)
+    kill_hit_points = np.zeros(len(codes), dtype=np.int16)
+    for code in codes:
+        for stage_index, stage in enumerate(STAGES):
+            side_army, _ = army_for_code(code)
+            other_army = army.UnitsArmy()
+            if stage == BattleStage.ARHCERY:
+                side_army.collect_army_dice_archery()
+                other_army.collect_army_dice_archery()
+            else:
+                side_army.collect_army_dice_clash()
+                other_army.collect_army_dice_clash()
+            armies = (side_army, other_army) if player_side else (other_army, side_army)
+            state = BattleState(armies[0], armies[1], terrain, BattleResult(), battle_stage=stage)
+            RollModifier().add_modifications(roll_modifications).apply_modifications(state)
+            for die_name, count in Counter(die.name for die in side_army.current_dice_pool.dice).items():
+                dice_counts[stage_index, code, DIE_NAMES.index(die_name)] = count
+
+        side_army, _ = army_for_code(code)
+        value[code] = side_army.get_army_value()
+        hit_points[code] = int(side_army.get_hit_points())
+        unit_count[code] = len(side_army.units)
+        other_army = army.UnitsArmy()
+        state = BattleState(other_army, side_army, terrain, BattleResult())
+        kill_hit_points[code] = damage_needed_to_kill_enemy(state)
+        for loss_count in range(max_losses + 1):
+            side_army, unit_index = army_for_code(code)
+            side_army.take_loses(loss_count)
+            next_code[code, loss_count] = code_of(side_army, unit_index)
+            side_army, unit_index = army_for_code(code)
+            if len(side_army.units) > 0:
+                take_loses_with_mercy(side_army, loss_count)
+            next_code_mercy[code, loss_count] = code_of(side_army, unit_index)
+
+    slot_types = []
+    slot_ordinals = []
+    for stage_index in range(len(STAGES)):
+        widths = dice_counts[stage_index].max(axis=0)
+        slot_types.append(np.repeat(np.arange(len(DIE_NAMES)), widths))
+        slot_ordinals.append(np.concatenate([np.arange(width) for width in widths]))
+
+    harpooneer_mask = 0
+    if not imperial:
+        harpooneer_mask = sum(1 << index for index, unit in enumerate(unit_classes) if unit is uprising_units.Harpooneers)
+
+    return SideTables(imperial, unit_classes, initial_code, dice_counts, slot_types, slot_ordinals, next_code,
+                      next_code_mercy, value, hit_points, unit_count, kill_hit_points, harpooneer_mask)
+
+@dataclass
+class BattleBatch:
+    """Per battle state of a batch, one array entry per battle."""
+    player_code: np.ndarray
+    enemy_code: np.ndarray
+    harpooneers_flagged: np.ndarray
+    harpooners_use_count: np.ndarray
+    mercy: np.ndarray
+    net_resources: np.ndarray
+    rounds: np.ndarray
+    outcome: np.ndarray
+
+    @classmethod
+    def fresh(cls, battle_count: int, player_code: int, enemy_code: int) -> "BattleBatch":
+        return cls(np.full(battle_count, player_code, dtype=np.int16),
+                   np.full(battle_count, enemy_code, dtype=np.int16),
+                   np.zeros(battle_count, dtype=np.int16),
+                   np.zeros(battle_count, dtype=np.int16),
+                   np.zeros(battle_count, dtype=bool),
+                   np.zeros(battle_count, dtype=np.int32),
+                   np.zeros(battle_count, dtype=np.int16),
+                   np.full(battle_count, OUTCOME_CODES[OverallBattleResult.undecided], dtype=np.int8))
+
+    def __len__(self) -> int:
+        return len(self.player_code)
+
+    def columns(self) -> list[np.ndarray]:
+        return [getattr(self, field.name) for field in fields(self)]
+
+    def take(self, indices: np.ndarray) -> "BattleBatch":
+        return BattleBatch(*(column[indices] for column in self.columns()))
+
+    def results(self) -> BatchedBattleResults:
+        return BatchedBattleResults(self.outcome, self.net_resources, self.rounds)
+
+class BatchedBattleEngine:
+    """Runs many independent battles of one BattleConfig as NumPy arrays.
+
+    Every unfinished battle advances one round at a time: dice are rolled as face indices into FACE_TABLE,
+    result modifications are compiled from their effects into array operations applied in configuration order, and losses
+    are resolved through per-side transition tables that were filled in by the reference army objects.
+    A sequence of ints as seed, e.g. [base seed, index], gives one of many independent generators of a run."""
+    def __init__(self, battle_config: BattleConfig, seed: int | Sequence[int] | None = None) -> None:
+        self.battle_config = battle_config
+        self.rng = np.random.default_rng(seed)
+        self.terrain = battle_config.terrain
+        self.player_tables = build_side_tables(battle_config.player_army_config, self.terrain,
+                                               battle_config.battle_roll_modifications, player_side=True)
+        self.enemy_tables = build_side_tables(battle_config.enemy_army_config, self.terrain,
+                                              battle_config.battle_roll_modifications, player_side=False)
+        # Reroll face columns per stage and side, handed out to the reroll effects in configuration order.
+        self.reroll_columns = {stage: {effects.PLAYER: 0, effects.ENEMY: 0} for stage in STAGES}
+        self.trades_bolts = False
+        self.result_handlers: list[Callable[[RoundRolls], None]] = [
+            self.compile_modification(modification) for modification in battle_config.battle_result_modifications]
+        self.batch = BattleBatch.fresh(0, self.player_tables.initial_code, self.enemy_tables.initial_code)
+
+    def reroll_count(self, stage: BattleStage) -> int:
+        return max(self.reroll_columns[stage].values())
+
+    def compile_modification(self, modification) -> Callable[[RoundRolls], None]:
+        """Array version of a result modification, built from the effects that describe it."""
+        modification_effects = getattr(modification, "effects", None)
+        if modification_effects is None:
+            raise ValueError(f"Result modification {modification} is not supported by the batched engine, "
+                             f"describe it with effects to compile it")
+        # The effects must describe the modify_result the reference engine runs, so a subclass overriding modify_result
+        # below the class that sets its effects would silently play differently here.
+        effects_owner = next(cls for cls in modification.__mro__ if "effects" in vars(cls))
+        modify_result_owner = next(cls for cls in modification.__mro__ if "modify_result" in vars(cls))
+        if modify_result_owner is not effects_owner and issubclass(modify_result_owner, effects_owner):
+            raise ValueError(f"Result modification {modification.__name__} overrides modify_result in "
+                             f"{modify_result_owner.__name__} but inherits its effects from {effects_owner.__name__}, "
+                             f"set effects matching the override to compile it")
+        handlers = [(effect.stages, self.compile_effect(effect)) for effect in modification_effects
+                    if effect.applies_on(self.terrain.terrain_type)]
+
+        def apply(rolls: RoundRolls) -> None:
+            for stages, handler in handlers:
+                if rolls.stage in stages:
+                    handler(rolls)
+        return apply
+
+    def compile_effect(self, effect: effects.ResultEffect) -> Callable[[RoundRolls], None]:
+        if isinstance(effect, effects.AddBoltIfBlanks):
+            return lambda rolls: self.add_bolt_if_blanks(rolls.side(effect.target), effect.bolts)
+        if isinstance(effect, effects.RerollBlanks):
+            first_columns = {}
+            for stage in effect.stages:
+                first_columns[stage] = dict(self.reroll_columns[stage])
+                for target in effect.targets:
+                    self.reroll_columns[stage][target] += effect.count
+            # Dice missing from the priority are never rerolled, as in RerollModification.
+            rank = np.array([effect.priority.index(name) if name in effect.priority else -1 for name in DIE_NAMES])
+
+            def reroll(rolls: RoundRolls) -> None:
+                for target in effect.targets:
+                    self.reroll_blanks(rolls.side(target), effect.count, first_columns[rolls.stage][target], rank)
+            return reroll
+        if isinstance(effect, effects.IgnoreHighestSkullDie):
+            return lambda rolls: self.ignore_highest_skull_die(rolls, effect.bolt_cost, effect.max_skulls)
+        if isinstance(effect, effects.TradeBoltForResource):
+            if self.trades_bolts:
+                raise ValueError("The batched engine supports a single TradeBoltForResource effect per battle")
+            self.trades_bolts = True
+            unit_mask = sum(1 << index for index, unit in enumerate(self.player_tables.unit_classes) if unit is effect.unit)
+            return lambda rolls: self.trade_bolt_for_resource(rolls, effect, unit_mask)
+        raise ValueError(f"Effect {effect} cannot be compiled by the batched engine")
+
+    def draw_faces(self, rows: np.ndarray, tables: SideTables, stage: BattleStage, width: int) -> np.ndarray:
+        """All faces one side needs for a round: one column per dice slot followed by one per possible reroll."""
+        return self.rng.integers(0, 6, size=(len(rows), width), dtype=np.int8)
+
+    def active_slots(self, rows: np.ndarray, tables: SideTables, stage: BattleStage) -> np.ndarray:
+        stage_index = STAGES.index(stage)
+        codes = (self.batch.player_code if tables is self.player_tables else self.batch.enemy_code)[rows]
+        return tables.dice_counts[stage_index][codes][:, tables.slot_types[stage_index]] > tables.slot_ordinals[stage_index][None, :]
+
+    def roll_side(self, tables: SideTables, stage: BattleStage, rows: np.ndarray) -> SideRoll:
+        types = tables.slot_types[STAGES.index(stage)]
+        active = self.active_slots(rows, tables, stage)
+        faces = self.draw_faces(rows, tables, stage, len(types) + self.reroll_count(stage))
+        side_roll = SideRoll(types, active, faces[:, :len(types)], faces[:, len(types):],
+                             np.zeros((len(rows), len(RESULT_FIELDS)), dtype=np.int32))
+        side_roll.totals += side_roll.face_results().sum(axis=1)
+        return side_roll
+
+    def add_bolt_if_blanks(self, side_roll: SideRoll, bolts: int) -> None:
+        side_roll.totals[:, BOLTS] += (side_roll.totals[:, BLANKS] > 0) * bolts
+
+    def reroll_blanks(self, side_roll: SideRoll, reroll_count: int, first_column: int = 0,
+                      priority_rank: np.ndarray = REROLL_PRIORITY_RANK) -> None:
+        if side_roll.faces.shape[1] == 0:
+            return
+        wants_reroll = side_roll.totals[:, BLANKS] > 0
+        rerolled = np.zeros_like(side_roll.active)
+        slot_rank = priority_rank[side_roll.types] * len(side_roll.types) + np.arange(len(side_roll.types))
+        rerollable = priority_rank[side_roll.types] >= 0
+        for attempt in range(reroll_count):
+            blanks = side_roll.face_results()[..., BLANKS] == 1
+            candidates = wants_reroll[:, None] & blanks & rerollable[None, :] & ~rerolled
+            rows = np.flatnonzero(candidates.any(axis=1))
+            if len(rows) == 0:
+                return
+            slots = np.where(candidates[rows], slot_rank[None, :], np.iinfo(np.int64).max).argmin(axis=1)
+            old_faces = FACE_TABLE[side_roll.types[slots], side_roll.faces[rows, slots]]
+            new_faces = side_roll.reroll_faces[rows, first_column + attempt]
+            side_roll.faces[rows, slots] = new_faces
+            rerolled[rows, slots] = True
+            side_roll.totals[rows] += FACE_TABLE[side_roll.types[slots], new_faces] - old_faces
+
+    def ignore_highest_skull_die(self, rolls: RoundRolls, bolt_cost: int, max_skulls: int) -> None:
+        player, enemy = rolls.player.totals, rolls.enemy.totals
+        will_take_damage = (player[:, SHIELDS] - enemy[:, BOLTS]) < enemy[:, SKULLS]
+        if rolls.enemy.faces.shape[1] == 0:
+            return
+        die_skulls = rolls.enemy.face_results()[..., SKULLS]
+        highest_skulls = np.where(die_skulls <= max_skulls, die_skulls, 0).max(axis=1)
+        ignore = (player[:, BOLTS] >= bolt_cost) & will_take_damage & (highest_skulls >= 1)
+        enemy[:, SKULLS] -= np.where(ignore, highest_skulls, 0)
+        player[:, BOLTS] -= ignore * bolt_cost
+
+    def trade_bolt_for_resource(self, rolls: RoundRolls, effect: effects.TradeBoltForResource, unit_mask: int) -> None:
+        rows, batch = rolls.rows, self.batch
+        player, enemy = rolls.player.totals, rolls.enemy.totals
+        player_code = batch.player_code[rows]
+        use_count = batch.harpooners_use_count[rows]
+        available = use_count < effect.per_combat_limit
+        player_losses = enemy[:, SKULLS] - (player[:, SHIELDS] - enemy[:, BOLTS])
+        if effect.mercy_units_left is None:
+            batch.mercy[rows] = False
+        else:
+            batch.mercy[rows] = available & (self.player_tables.unit_count[player_code] - player_losses >= effect.mercy_units_left)
+
+        damage_needed_for_weakening = (self.enemy_tables.kill_hit_points[batch.enemy_code[rows]]
+                                       + enemy[:, SHIELDS] - player[:, SKULLS] - 1)
+        damage_that_can_be_unblocked = np.minimum(player[:, SKULLS], enemy[:, SHIELDS])
+        unblocked_shields = np.maximum(enemy[:, SHIELDS] - player[:, SKULLS], 0)
+        bolts_needed = np.where(damage_needed_for_weakening >= damage_that_can_be_unblocked,
+                                damage_that_can_be_unblocked, damage_needed_for_weakening) + unblocked_shields
+        bolt_surplus = np.where(available & (player[:, BOLTS] > 0), player[:, BOLTS] - np.maximum(bolts_needed, 0), 0)
+
+        flagged = batch.harpooneers_flagged[rows]
+        for attempt in range(effect.per_combat_limit):
+            candidates = player_code & unit_mask & ~flagged
+            generate = (bolt_surplus > attempt) & (use_count < effect.per_combat_limit) & (candidates != 0)
+            flagged |= np.where(generate, candidates & -candidates, 0).astype(flagged.dtype)
+            use_count += generate
+            player[:, BOLTS] -= generate
+            batch.net_resources[rows] += generate * effect.resource
+        batch.harpooneers_flagged[rows] = flagged
+        batch.harpooners_use_count[rows] = use_count
+
+    def resolve_roll_result_effects(self, rolls: RoundRolls) -> None:
+        rows, batch = rolls.rows, self.batch
+        player, enemy = rolls.player.totals, rolls.enemy.totals
+        player_losses = np.clip(enemy[:, SKULLS] - (player[:, SHIELDS] - enemy[:, BOLTS]), 0, self.player_tables.max_losses)
+        enemy_losses = np.clip(player[:, SKULLS] - (enemy[:, SHIELDS] - player[:, BOLTS]), 0, self.enemy_tables.max_losses)
+        player_code = batch.player_code[rows]
+        enemy_code = batch.enemy_code[rows]
+        new_player_code = self.player_tables.next_code[player_code, player_losses]
+        new_enemy_code = np.where(batch.mercy[rows], self.enemy_tables.next_code_mercy[enemy_code, enemy_losses],
+                                  self.enemy_tables.next_code[enemy_code, enemy_losses])
+        batch.net_resources[rows] -= self.player_tables.value[player_code] - self.player_tables.value[new_player_code]
+        batch.player_code[rows] = new_player_code
+        batch.enemy_code[rows] = new_enemy_code
+
+    def update_outcomes(self, rows: np.ndarray) -> np.ndarray:
+        player_down = self.player_tables.hit_points[self.batch.player_code[rows]] == 0
+        enemy_down = self.enemy_tables.hit_points[self.batch.enemy_code[rows]] == 0
+        outcome = np.select([player_down & enemy_down, player_down, enemy_down],
+                            [OUTCOME_CODES[OverallBattleResult.draw], OUTCOME_CODES[OverallBattleResult.player_defeat],
+                             OUTCOME_CODES[OverallBattleResult.player_victory]],
+                            OUTCOME_CODES[OverallBattleResult.undecided])
+        self.batch.outcome[rows] = outcome
+        return rows[outcome == OUTCOME_CODES[OverallBattleResult.undecided]]
+
+    def play_round(self, rows: np.ndarray, stage: BattleStage) -> np.ndarray:
+        rolls = RoundRolls(rows, stage, self.roll_side(self.player_tables, stage, rows),
+                           self.roll_side(self.enemy_tables, stage, rows))
+        for handler in self.result_handlers:
+            handler(rolls)
+        self.resolve_roll_result_effects(rolls)
+        self.batch.rounds[rows] += 1
+        return self.update_outcomes(rows)
+
+    def play_clash_rounds(self, rows: np.ndarray) -> BatchedBattleResults:
+        clash_round_number = 1
+        while len(rows) > 0 and clash_round_number <= MAX_CLASH_ROUNDS:
+            rows = self.play_round(rows, BattleStage.CLASH)
+            clash_round_number += 1
+        if len(rows) > 0:
+            logger.warning(f"{len(rows)} battles were still undecided after {MAX_CLASH_ROUNDS} clash rounds")
+        return self.batch.results()
+
+    def run_chunk(self, battle_count: int) -> BatchedBattleResults:
+        self.batch = BattleBatch.fresh(battle_count, self.player_tables.initial_code, self.enemy_tables.initial_code)
+        rows = self.play_round(np.arange(battle_count), BattleStage.ARHCERY)
+        return self.play_clash_rounds(rows)
+
+    def resume_clash(self, batch: BattleBatch) -> BatchedBattleResults:
+        """Continues battles that already finished their archery round, starting at the next clash round."""
+        self.batch = batch
+        return self.play_clash_rounds(np.flatnonzero(batch.outcome == OUTCOME_CODES[OverallBattleResult.undecided]))
+
+    def run_batch(self, batch: BattleBatch, stage: BattleStage = BattleStage.ARHCERY) -> BatchedBattleResults:
+        """Plays a prepared batch on from the given stage, e.g. battles restored from a snapshot."""
+        self.batch = batch
+        rows = np.arange(len(batch))
+        if stage == BattleStage.ARHCERY:
+            rows = self.play_round(rows, BattleStage.ARHCERY)
+        else:
+            rows = self.update_outcomes(rows)
+        return self.play_clash_rounds(rows)
+
+    def run(self, battle_count: int, chunk_size: int = 1_000_000) -> BatchedBattleResults:
+        chunks = [self.run_chunk(min(chunk_size, battle_count - start)) for start in range(0, battle_count, chunk_size)]
+        logger.debug(f"Finished {battle_count} batched battles in {len(chunks)} chunks")
+        return concatenate_results(chunks)
+
+def concatenate_results(results: list[BatchedBattleResults]) -> BatchedBattleResults:
+    return BatchedBattleResults(np.concatenate([result.outcome for result in results]),
+                                np.concatenate([result.net_resources for result in results]),
+                                np.concatenate([result.rounds for result in results]))
@@ -1,3 +1,4 @@
+import random
 from dataclasses import dataclass
 import army
 import uprising_units
@@ -10,9 +11,17 @@ class BattleModifiers:
     roll_modifier: RollModifier
     result_modifier: ResultModifier
 
+def take_loses_with_mercy(enemy_army: army.Army, loss_count: int) -> None:
+    for _ in range(loss_count):
+        if len(enemy_army.units) > 1:
+            enemy_army.take_loses(1)
+        elif enemy_army.units[0].name in [uprising_units.Garrison2.name, uprising_units.Garrison3.name]:
+            enemy_army.take_loses(1)
+
 class Battle:
-    def __init__(self, player_army: army.Army, enemy_army: army.Army, terrian: Terrain, battle_modifiers: BattleModifiers) -> None:
-        self.battle_state: BattleState = BattleState(player_army, enemy_army, terrian, BattleResult())
+    def __init__(self, player_army: army.Army, enemy_army: army.Army, terrian: Terrain, battle_modifiers: BattleModifiers,
+                 rng: random.Random | None = None) -> None:
+        self.battle_state: BattleState = BattleState(player_army, enemy_army, terrian, BattleResult(), rng=rng or random.Random())
         self.roll_modifier = battle_modifiers.roll_modifier
         self.result_modifier = battle_modifiers.result_modifier
         self.initial_player_value: int = player_army.get_army_value()
@@ -25,11 +34,7 @@ class Battle:
         enemy_losses = self.battle_state.player_roll_results.skulls - (self.battle_state.enemy_roll_results.shields - self.battle_state.player_roll_results.bolts)
         self.battle_state.player_army.take_loses(player_losses)
         if self.battle_state.player_army.mercy == True:
-            for _ in range(enemy_losses):
-                if len(self.battle_state.enemy_army.units) > 1:
-                    self.battle_state.enemy_army.take_loses(1)
-                elif self.battle_state.enemy_army.units[0].name in [uprising_units.Garrison2.name, uprising_units.Garrison3.name]:
-                    self.battle_state.enemy_army.take_loses(1)
+            take_loses_with_mercy(self.battle_state.enemy_army, enemy_losses)
         else:
             self.battle_state.enemy_army.take_loses(enemy_losses)
         
@@ -44,13 +49,14 @@ class Battle:
         enemy_dice = self.battle_state.enemy_army.collect_army_dice_archery()
         self.roll_modifier.apply_modifications(self.battle_state)
 
-        self.battle_state.player_roll_results = player_dice.roll_dice()
+        self.battle_state.player_roll_results = player_dice.roll_dice(self.battle_state.rng)
         logger.debug(f"Player rolled following dice: {self.battle_state.player_roll_results}")
-        self.battle_state.enemy_roll_results = enemy_dice.roll_dice()
+        self.battle_state.enemy_roll_results = enemy_dice.roll_dice(self.battle_state.rng)
         logger.debug(f"Enemy rolled following dice: {self.battle_state.enemy_roll_results}")
         self.result_modifier.apply_modifications(self.battle_state)
         self.resolve_roll_result_effects()
         self.update_net_resources()
+        self.battle_state.battle_results.rounds += 1
         
     def clash_round(self):
         logger.debug(f"Performing clash round number {self.battle_state.clash_round_number}")
@@ -58,14 +64,15 @@ class Battle:
         enemy_dice = self.battle_state.enemy_army.collect_army_dice_clash()
         self.roll_modifier.apply_modifications(self.battle_state)
 
-        self.battle_state.player_roll_results = player_dice.roll_dice()
+        self.battle_state.player_roll_results = player_dice.roll_dice(self.battle_state.rng)
         logger.debug(f"Player rolled following dice: {self.battle_state.player_roll_results}")
-        self.battle_state.enemy_roll_results = enemy_dice.roll_dice()
+        self.battle_state.enemy_roll_results = enemy_dice.roll_dice(self.battle_state.rng)
         logger.debug(f"Enemy rolled following dice: {self.battle_state.enemy_roll_results}")
         self.result_modifier.apply_modifications(self.battle_state)
 
         self.resolve_roll_result_effects()
         self.update_net_resources()
+        self.battle_state.battle_results.rounds += 1
         if not self.is_battle_over():
             self.battle_state.clash_round_number += 1
             self.clash_round()
@@ -97,13 +104,22 @@ class Battle:
         logger.debug(f"Battle result: {self.battle_state.battle_results}")
         return self.battle_state.battle_results
 
-imp_army = army.ImperialArmy().add_unit(uprising_units.Garrison3)
+    def resume(self) -> BattleResult:
+        """Plays the battle on from its current stage and clash round, e.g. after restoring a snapshot."""
+        if self.battle_state.battle_stage == BattleStage.ARHCERY:
+            return self.perform_battle()
+        if not self.is_battle_over():
+            self.clash_round()
+        logger.debug(f"Battle result: {self.battle_state.battle_results}")
+        return self.battle_state.battle_results
 
-#tua_army = TuaThanArmy().add_unit(units.Stoneshell.name).add_unit(units.CrabRider.name).add_unit(units.CrabRider.name)
-tua_army = army.UnitsArmy().add_unit(uprising_units.CrabRider, 2).add_unit(uprising_units.Harpooneers, 2).add_unit(uprising_units.ReefKing)
-battle_result_modifiers = [LightOfTheThan, TerrainResultModification, DruidMountainHeart, HarpoonersUpgrade] 
-battle_modifiers = BattleModifiers(RollModifier().add_modification(TerrainRollModification), ResultModifier().add_modifications(battle_result_modifiers))
-battle = Battle(tua_army, imp_army, Terrain(TerrainType.FROZEN_WASTES), battle_modifiers)
-results = battle.perform_battle()
-logger.debug(results)
+if __name__ == "__main__":
+    imp_army = army.ImperialArmy().add_unit(uprising_units.Garrison3)
 
+    #tua_army = TuaThanArmy().add_unit(units.Stoneshell.name).add_unit(units.CrabRider.name).add_unit(units.CrabRider.name)
+    tua_army = army.UnitsArmy().add_unit(uprising_units.CrabRider, 2).add_unit(uprising_units.Harpooneers, 2).add_unit(uprising_units.ReefKing)
+    battle_result_modifiers = [LightOfTheThan, TerrainResultModification, DruidMountainHeart, HarpoonersUpgrade] 
+    battle_modifiers = BattleModifiers(RollModifier().add_modification(TerrainRollModification), ResultModifier().add_modifications(battle_result_modifiers))
+    battle = Battle(tua_army, imp_army, Terrain(TerrainType.FROZEN_WASTES), battle_modifiers)
+    results = battle.perform_battle()
+    logger.debug(results)
@@ -0,0 +1,55 @@
+from __future__ import annotations
+from collections import Counter
+from dataclasses import dataclass, field
+import numpy as np
+from batched_battle import BatchedBattleResults
+from battle_state import OverallBattleResult, OUTCOME_CODES
+
+@dataclass
+class BattleAggregate:
+    """Integer sufficient statistics of a set of battles. Merging is exact and independent of order and grouping."""
+    battles: int = 0
+    outcome_counts: tuple[int, ...] = (0,) * len(OUTCOME_CODES)
+    net_resources_sum: int = 0
+    net_resources_squares: int = 0
+    rounds_sum: int = 0
+    net_resources_histogram: Counter = field(default_factory=Counter)
+
+    @classmethod
+    def from_results(cls, results: BatchedBattleResults) -> "BattleAggregate":
+        net_resources = results.net_resources.astype(np.int64)
+        values, counts = np.unique(net_resources, return_counts=True)
+        return cls(len(results), tuple(int(count) for count in np.bincount(results.outcome, minlength=len(OUTCOME_CODES))),
+                   int(net_resources.sum()), int((net_resources ** 2).sum()), int(results.rounds.astype(np.int64).sum()),
+                   Counter(dict(zip(values.tolist(), counts.tolist()))))
+
+    def merge(self, other: "BattleAggregate") -> "BattleAggregate":
+        return BattleAggregate(self.battles + other.battles,
+                               tuple(mine + theirs for mine, theirs in zip(self.outcome_counts, other.outcome_counts)),
+                               self.net_resources_sum + other.net_resources_sum,
+                               self.net_resources_squares + other.net_resources_squares,
+                               self.rounds_sum + other.rounds_sum,
+                               self.net_resources_histogram + other.net_resources_histogram)
+
+    def outcome_frequencies(self) -> dict[OverallBattleResult, float]:
+        return {result: self.outcome_counts[code] / max(self.battles, 1) for result, code in OUTCOME_CODES.items()}
+
+    @property
+    def net_resources_mean(self) -> float:
+        return self.net_resources_sum / max(self.battles, 1)
+
+    @property
+    def net_resources_std(self) -> float:
+        if self.battles < 2:
+            return 0.0
+        return float(np.sqrt((self.net_resources_squares - self.net_resources_sum ** 2 / self.battles) / (self.battles - 1)))
+
+    @property
+    def average_rounds(self) -> float:
+        return self.rounds_sum / max(self.battles, 1)
+
+    def __str__(self) -> str:
+        frequencies = self.outcome_frequencies()
+        return (f"{self.battles} battles: victory {frequencies[OverallBattleResult.player_victory]:.4f}, "
+                f"draw {frequencies[OverallBattleResult.draw]:.4f}, defeat {frequencies[OverallBattleResult.player_defeat]:.4f}, "
+                f"net resources {self.net_resources_mean:.4f} +/- {self.net_resources_std:.4f}")
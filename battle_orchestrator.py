@@ -6,10 +6,24 @@ from loguru import logger
 logger.remove()
 logger.add(sys.stderr, level="INFO")  # Change "INFO" to the desired level
 
-from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
 import pandas as pd
 import battle
+import batched_battle
+import two_stage
+import importance_sampling
+import modification_subsets
+import result_arena
+import result_store
+import battle_replay
+import run_metrics
+import allocation_profile
 from battle import Battle, BattleModifiers
 import army
 import uprising_units
@@ -20,6 +34,9 @@ from battle_state import BattleResult
 @dataclass
 class MetaResults:
     data: pd.DataFrame
+    seed: int | None = None
+    metrics: run_metrics.RunSummary | None = None
+    results_path: Path | None = None
 
 @dataclass
 class ArmyConfig:
@@ -33,6 +50,43 @@ class BattleConfig:
     terrain: battle.Terrain
     battle_roll_modifications: list[roll_modifier.RollModification] 
     battle_result_modifications: list[result_modifier.ResultModification] 
+
+BATTLE_INDEX_BITS = 40
+BASE_SEED_BITS = 22
+
+def battle_seed(base_seed: int, battle_index: int) -> int:
+    """Seed of a single battle, so any battle of a run can be replayed on its own."""
+    return (base_seed << BATTLE_INDEX_BITS) + battle_index
+
+def split_battle_seed(seed: int) -> tuple[int, int]:
+    """Base seed and battle index of a battle seed."""
+    return seed >> BATTLE_INDEX_BITS, seed & ((1 << BATTLE_INDEX_BITS) - 1)
+
+def new_base_seed() -> int:
+    return random.SystemRandom().randrange(1 << BASE_SEED_BITS)
+
+def run_base_seed(seed: int | None) -> int:
+    """The given base seed of a run, or a new one. Battle seeds are stored as int64, which leaves BASE_SEED_BITS for it."""
+    if seed is None:
+        return new_base_seed()
+    if not 0 <= seed < 1 << BASE_SEED_BITS:
+        raise ValueError(f"Base seed {seed} is outside of [0, 2**{BASE_SEED_BITS})")
+    return seed
+
+_worker_arena: result_arena.ResultArena | None = None
+
+def attach_worker_arena(arena_name: str, battle_count: int) -> None:
+    global _worker_arena
+    _worker_arena = result_arena.ResultArena.attach(arena_name, battle_count)
+
+def run_battle_slice(battle_config: BattleConfig, start: int, stop: int, base_seed: int) -> int:
+    """Plays battles start to stop in a worker process and writes them into its slice of the shared arena."""
+    orchestrator = BattleOrchestrator(battle_config)
+    for battle_index in range(start, stop):
+        seed = battle_seed(base_seed, battle_index)
+        _worker_arena.write(battle_index, orchestrator.execute_battle(random.Random(seed)), seed)
+    return stop - start
+
 class BattleOrchestrator:
     def __init__(self, battle_config: BattleConfig) -> None:
         self.player_army_config = battle_config.player_army_config
@@ -40,8 +94,9 @@ class BattleOrchestrator:
         self.terrain = battle_config.terrain
         self.roll_modifications = battle_config.battle_roll_modifications
         self.result_modifications = battle_config.battle_result_modifications
+        self.battle_config = battle_config
     
-    def execute_battle(self) -> BattleResult:
+    def battle_setup(self) -> tuple[army.Army, army.Army, BattleModifiers]:
         player_army: army.Army = self.player_army_config.army_type()
         for unit in self.player_army_config.units:
             player_army.add_unit(unit)
@@ -51,45 +106,136 @@ class BattleOrchestrator:
 
         battle_modifiers = BattleModifiers(roll_modifier.RollModifier().add_modifications(self.roll_modifications),
                                            result_modifier.ResultModifier().add_modifications(self.result_modifications))
-        battle: Battle = Battle(player_army, enemy_army, self.terrain, battle_modifiers)
+        return player_army, enemy_army, battle_modifiers
+
+    def execute_battle(self, rng: random.Random | None = None) -> BattleResult:
+        player_army, enemy_army, battle_modifiers = self.battle_setup()
+        battle: Battle = Battle(player_army, enemy_army, self.terrain, battle_modifiers, rng)
         return battle.perform_battle()
 
-    def conduct_battles(self, number_of_iterations: int = 5000) -> MetaResults:
-        meta_results = MetaResults(data = pd.DataFrame())
-        with ThreadPoolExecutor() as executor:
-            futures = [executor.submit(self.execute_battle) for _ in range(number_of_iterations)]
+    def execute_battles(self, start: int, stop: int, base_seed: int, metrics: run_metrics.RunMetrics) -> list[BattleResult]:
+        counters = metrics.shard()
+        began = time.perf_counter()
+        battle_results = []
+        for battle_index in range(start, stop):
+            battle_result = self.execute_battle(random.Random(battle_seed(base_seed, battle_index)))
+            counters.battles += 1
+            counters.rounds += battle_result.rounds
+            battle_results.append(battle_result)
+        counters.busy_seconds += time.perf_counter() - began
+        counters.tasks_completed += 1
+        return battle_results
+
+    def conduct_battles(self, number_of_iterations: int = 5000, seed: int | None = None, threads: int | None = None,
+                        slice_size: int = 1000, metrics_textfile: str | None = None, metrics_port: int | None = None,
+                        metrics_interval: float = 5.0, results_path: str | Path | None = None) -> MetaResults:
+        """Plays the battles on a thread pool. Every battle owns its random generator and game objects, so the threads
+        share no mutable state and scale across cores on free-threaded Python.
 
+        Rows carry their battle index, which together with the run seed replays the battle with replay_battle.
+        Throughput, worker utilization, queue depth, rounds and ETA are counted per worker thread, optionally exported
+        to a Prometheus text file or a local endpoint during the run, and summarized in the returned MetaResults.
+        With a results_path the results are also streamed to a columnar result file while the run is going, see
+        result_store.ResultFile for reading it back."""
+        seed = run_base_seed(seed)
+        starts = range(0, number_of_iterations, slice_size)
+        metrics = run_metrics.RunMetrics(number_of_iterations, tasks_submitted=len(starts))
+        exporter = result_store.ResultExporter(results_path, number_of_iterations, seed, result_store.config_hash(self.battle_config))
+        with run_metrics.MetricsExporter(metrics, metrics_textfile, metrics_interval, metrics_port), exporter, ThreadPoolExecutor(threads) as executor:
+            futures = [executor.submit(self.execute_battles, start, min(start + slice_size, number_of_iterations), seed, metrics)
+                       for start in starts]
             # Wait for all tasks to complete and check for errors
+            battle_results: list[BattleResult] = []
             for future in futures:
-                battle_result: battle.BattleResult = future.result()
-                new_row = pd.DataFrame({"overall_result": f"{battle_result.overall_result}, {battle_result.player_net_resources}",
-                                        "victor": battle_result.overall_result,
-                                        'net_resources': battle_result.player_net_resources}, index=[0])
-                meta_results.data = pd.concat([meta_results.data, new_row], ignore_index=True)
-        
-        logger.info(f"Finished running {number_of_iterations}. Presenting dataframe:")
+                slice_results = future.result()
+                exporter.export(slice_results)
+                battle_results.extend(slice_results)
+
+        meta_results = MetaResults(pd.DataFrame({
+            "battle_index": np.arange(len(battle_results), dtype=np.int64),
+            "overall_result": [f"{battle_result.overall_result}, {battle_result.player_net_resources}" for battle_result in battle_results],
+            "victor": [battle_result.overall_result for battle_result in battle_results],
+            "net_resources": [battle_result.player_net_resources for battle_result in battle_results]}), seed, metrics.summary(),
+            exporter.path)
+        logger.info(f"Finished running {number_of_iterations}: {meta_results.metrics}. Presenting dataframe:")
         return meta_results
 
-player_config = ArmyConfig(army.TuaThanArmy, [uprising_units.Stoneshell, uprising_units.CrabRider, uprising_units.CrabRider, uprising_units.Harpooneers, uprising_units.Harpooneers])
-enemy_config = ArmyConfig(army.ImperialArmy, [uprising_units.Garrison2])
-
-terrain = battle.Terrain(battle.TerrainType.MARSHES)
-battle_result_modifications: list[result_modifier.ResultModification] = [
-    result_modifier.LightOfTheThan,
-    result_modifier.TerrainResultModification,
-    result_modifier.DruidMountainHeart,
-    result_modifier.HarpoonersUpgrade
-]
-battle_roll_modifications = [roll_modifier.TerrainRollModification]
-battle_config = BattleConfig(player_config, enemy_config, terrain, battle_roll_modifications, battle_result_modifications)
-meta_battle = BattleOrchestrator(battle_config)
-meta_results = meta_battle.conduct_battles()
-#logger.info(meta_results)
-# Calculate value counts and percentages
-value_counts = meta_results.data['overall_result'].value_counts()
-total_values = len(meta_results.data['overall_result'])
-percentages = (value_counts / total_values) * 100
-
-result_df = pd.DataFrame({'Count': value_counts, 'Percentage': percentages})
-logger.info(f"This is the summary of the battle:")
-logger.info(f"\n{result_df}")
+    def replay_battle(self, battle_index: int, seed: int) -> battle_replay.BattleTrace:
+        """Fully traced re-run of one battle of a conduct_battles or conduct_battles_parallel run with this seed."""
+        return battle_replay.replay_battle(self.battle_config, battle_index, seed)
+
+    def profile_allocations(self, number_of_iterations: int = 1000, seed: int = 0,
+                            sampled_battles: int = 50) -> allocation_profile.AllocationReport:
+        """Opt-in allocation profiling mode: memory per battle by source module and function, and peak resident memory."""
+        return allocation_profile.profile_allocations(self, number_of_iterations, seed, sampled_battles)
+
+    def conduct_battles_parallel(self, number_of_iterations: int = 5000, seed: int | None = None, processes: int | None = None,
+                                 slice_size: int = 10_000) -> result_arena.ResultArena:
+        """Plays the battles in worker processes writing straight into a shared memory arena, so no result is pickled.
+
+        The caller owns the returned arena and should close it once done with its columns. Its seed column replays
+        a battle through split_battle_seed and replay_battle."""
+        seed = run_base_seed(seed)
+        processes = processes or os.cpu_count()
+        slice_size = max(1, min(slice_size, -(-number_of_iterations // (4 * processes))))
+        arena = result_arena.ResultArena.create(number_of_iterations)
+        try:
+            with ProcessPoolExecutor(processes, initializer=attach_worker_arena, initargs=(arena.name, number_of_iterations)) as executor:
+                futures = [executor.submit(run_battle_slice, self.battle_config, start, min(start + slice_size, number_of_iterations), seed)
+                           for start in range(0, number_of_iterations, slice_size)]
+                for future in futures:
+                    future.result()
+        except BaseException:
+            arena.close()
+            raise
+        logger.info(f"Finished running {number_of_iterations} battles in {processes} processes")
+        return arena
+
+    def conduct_battles_batched(self, number_of_iterations: int = 5000, seed: int | None = None,
+                                results_path: str | Path | None = None, chunk_size: int = 1_000_000) -> MetaResults:
+        """Batched battles cannot be replayed one by one, so a result file written with results_path has no seeds."""
+        engine = batched_battle.BatchedBattleEngine(self.battle_config, seed)
+        chunks = []
+        with result_store.ResultExporter(results_path, number_of_iterations, config_hash=result_store.config_hash(self.battle_config)) as exporter:
+            for start in range(0, number_of_iterations, chunk_size):
+                chunk = engine.run_chunk(min(chunk_size, number_of_iterations - start))
+                exporter.export_columns(chunk.outcome, chunk.net_resources, chunk.rounds)
+                chunks.append(chunk)
+        batched_results = batched_battle.concatenate_results(chunks)
+        logger.info(f"Finished running {number_of_iterations} batched battles. Presenting dataframe:")
+        return MetaResults(data = batched_results.to_dataframe(), results_path=exporter.path)
+
+    def conduct_battles_two_stage(self, number_of_iterations: int = 5000, seed: int | None = None) -> two_stage.TwoStageEstimate:
+        return two_stage.TwoStageSimulator(self.battle_config, seed).estimate(number_of_iterations)
+
+    def estimate_rare_outcome(self, result: battle.OverallBattleResult, number_of_iterations: int = 100_000,
+                              seed: int | None = None) -> importance_sampling.ImportanceSamplingEstimate:
+        return importance_sampling.importance_sample(self.battle_config, result, number_of_iterations, seed=seed)
+
+    def evaluate_modification_subsets(self, number_of_iterations: int = 5000, seed: int | None = None) -> modification_subsets.SubsetResults:
+        return modification_subsets.evaluate_modification_subsets(self.battle_config, number_of_iterations, seed)
+
+if __name__ == "__main__":
+    player_config = ArmyConfig(army.UnitsArmy, [uprising_units.Stoneshell, uprising_units.CrabRider, uprising_units.CrabRider, uprising_units.Harpooneers, uprising_units.Harpooneers])
+    enemy_config = ArmyConfig(army.ImperialArmy, [uprising_units.Garrison2])
+
+    terrain = battle.Terrain(battle.TerrainType.MARSHES)
+    battle_result_modifications: list[result_modifier.ResultModification] = [
+        result_modifier.LightOfTheThan,
+        result_modifier.TerrainResultModification,
+        result_modifier.DruidMountainHeart,
+        result_modifier.HarpoonersUpgrade
+    ]
+    battle_roll_modifications = [roll_modifier.TerrainRollModification]
+    battle_config = BattleConfig(player_config, enemy_config, terrain, battle_roll_modifications, battle_result_modifications)
+    meta_battle = BattleOrchestrator(battle_config)
+    meta_results = meta_battle.conduct_battles()
+    #logger.info(meta_results)
+    # Calculate value counts and percentages
+    value_counts = meta_results.data['overall_result'].value_counts()
+    total_values = len(meta_results.data['overall_result'])
+    percentages = (value_counts / total_values) * 100
+
+    result_df = pd.DataFrame({'Count': value_counts, 'Percentage': percentages})
+    logger.info(f"This is the summary of the battle:")
+    logger.info(f"\n{result_df}")
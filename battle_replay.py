@@ -0,0 +1,141 @@
+from __future__ import annotations
+import random
+import threading
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+from loguru import logger
+import army
+import dice
+from battle import Battle, BattleModifiers
+from battle_state import BattleResult, BattleStage, BattleState
+from result_modifier import ResultModifier
+from roll_modifier import RollModifier
+
+if TYPE_CHECKING:
+    from battle_orchestrator import BattleConfig
+
+# (skulls, shields, bolts, stars, blanks)
+RollTotals = tuple[int, int, int, int, int]
+
+def roll_totals(roll_results: dice.DiceRollResults) -> RollTotals:
+    return (roll_results.skulls, roll_results.shields, roll_results.bolts, roll_results.stars, roll_results.blanks)
+
+def rolled_faces(side_army: army.Army) -> list[tuple[str, dice.DieResult]]:
+    return [(die.name, die.result) for die in side_army.current_dice_pool.dice]
+
+@dataclass
+class ModificationTrace:
+    name: str
+    player_roll: RollTotals
+    enemy_roll: RollTotals
+
+@dataclass
+class RoundTrace:
+    stage: BattleStage
+    clash_round_number: int
+    player_units: list[str]
+    enemy_units: list[str]
+    player_dice: list[str] = field(default_factory=list)
+    enemy_dice: list[str] = field(default_factory=list)
+    player_faces: list[tuple[str, dice.DieResult]] = field(default_factory=list)
+    enemy_faces: list[tuple[str, dice.DieResult]] = field(default_factory=list)
+    player_roll: RollTotals | None = None
+    enemy_roll: RollTotals | None = None
+    modifications: list[ModificationTrace] = field(default_factory=list)
+    mercy: bool = False
+    player_units_after: list[str] = field(default_factory=list)
+    enemy_units_after: list[str] = field(default_factory=list)
+    net_resources: int = 0
+
+    def describe(self) -> str:
+        title = "Archery round" if self.stage == BattleStage.ARHCERY else f"Clash round {self.clash_round_number}"
+        lines = [f"{title}: {self.player_units} against {self.enemy_units}",
+                 f"  player dice {self.player_dice} rolled {[f'{name} {result}' for name, result in self.player_faces]}",
+                 f"  enemy dice {self.enemy_dice} rolled {[f'{name} {result}' for name, result in self.enemy_faces]}",
+                 f"  rolls (skulls, shields, bolts, stars, blanks): player {self.player_roll}, enemy {self.enemy_roll}"]
+        lines += [f"  after {modification.name}: player {modification.player_roll}, enemy {modification.enemy_roll}"
+                  for modification in self.modifications]
+        lines += [f"  losses{' with mercy' if self.mercy else ''}: player left with {self.player_units_after}, "
+                  f"enemy left with {self.enemy_units_after}, net resources {self.net_resources}"]
+        return "\n".join(lines)
+
+@dataclass
+class BattleTrace:
+    battle_index: int
+    seed: int
+    result: BattleResult
+    rounds: list[RoundTrace]
+    log: list[str]
+
+    def __str__(self) -> str:
+        return "\n".join([f"Battle {self.battle_index} (seed {self.seed}): {self.result}"] + [round_trace.describe() for round_trace in self.rounds])
+
+class TracingRollModifier(RollModifier):
+    """Opens the trace of every round, as the roll modifications run right before the dice are rolled."""
+    def __init__(self, rounds: list[RoundTrace]) -> None:
+        super().__init__()
+        self.rounds = rounds
+
+    def apply_modifications(self, current_battle_state: BattleState) -> None:
+        self.rounds.append(RoundTrace(current_battle_state.battle_stage, current_battle_state.clash_round_number,
+                                      [unit.name for unit in current_battle_state.player_army.units],
+                                      [unit.name for unit in current_battle_state.enemy_army.units]))
+        super().apply_modifications(current_battle_state)
+        self.rounds[-1].player_dice = [die.name for die in current_battle_state.player_army.current_dice_pool.dice]
+        self.rounds[-1].enemy_dice = [die.name for die in current_battle_state.enemy_army.current_dice_pool.dice]
+
+class TracingResultModifier(ResultModifier):
+    """Records the raw roll and the roll totals after every result modification."""
+    def __init__(self, rounds: list[RoundTrace]) -> None:
+        super().__init__()
+        self.rounds = rounds
+
+    def apply_modifications(self, state: BattleState) -> None:
+        round_trace = self.rounds[-1]
+        round_trace.player_faces = rolled_faces(state.player_army)
+        round_trace.enemy_faces = rolled_faces(state.enemy_army)
+        round_trace.player_roll = roll_totals(state.player_roll_results)
+        round_trace.enemy_roll = roll_totals(state.enemy_roll_results)
+        for modification in self.modification_list:
+            modification.modify_result(state)
+            round_trace.modifications.append(ModificationTrace(modification.name, roll_totals(state.player_roll_results),
+                                                               roll_totals(state.enemy_roll_results)))
+
+class TracingBattle(Battle):
+    """Battle recording its rolls, modifications and losses round by round. It draws from the random generator
+    exactly like Battle, so it replays any battle given the same generator."""
+    def __init__(self, player_army: army.Army, enemy_army: army.Army, terrian, battle_modifiers: BattleModifiers,
+                 rng: random.Random | None = None) -> None:
+        self.rounds: list[RoundTrace] = []
+        roll_modifier = TracingRollModifier(self.rounds)
+        roll_modifier.modification_list = battle_modifiers.roll_modifier.modification_list
+        result_modifier = TracingResultModifier(self.rounds)
+        result_modifier.modification_list = battle_modifiers.result_modifier.modification_list
+        super().__init__(player_army, enemy_army, terrian, BattleModifiers(roll_modifier, result_modifier), rng)
+
+    def resolve_roll_result_effects(self):
+        super().resolve_roll_result_effects()
+        self.rounds[-1].mercy = self.battle_state.player_army.mercy
+        self.rounds[-1].player_units_after = [unit.name for unit in self.battle_state.player_army.units]
+        self.rounds[-1].enemy_units_after = [unit.name for unit in self.battle_state.enemy_army.units]
+
+    def update_net_resources(self):
+        super().update_net_resources()
+        self.rounds[-1].net_resources = self.battle_state.battle_results.player_net_resources
+
+def replay_battle(battle_config: BattleConfig, battle_index: int, base_seed: int) -> BattleTrace:
+    """Re-runs battle battle_index of a run seeded with base_seed, tracing every round and capturing its debug log."""
+    from battle_orchestrator import BattleOrchestrator, battle_seed
+    seed = battle_seed(base_seed, battle_index)
+    orchestrator = BattleOrchestrator(battle_config)
+    player_army, enemy_army, battle_modifiers = orchestrator.battle_setup()
+    log: list[str] = []
+    thread_id = threading.get_ident()
+    handler_id = logger.add(lambda message: log.append(message.rstrip("\n")), level="DEBUG", format="{message}",
+                            filter=lambda record: record["thread"].id == thread_id)
+    try:
+        battle = TracingBattle(player_army, enemy_army, orchestrator.terrain, battle_modifiers, random.Random(seed))
+        result = battle.perform_battle()
+    finally:
+        logger.remove(handler_id)
+    return BattleTrace(battle_index, seed, result, battle.rounds, log)
@@ -0,0 +1,223 @@
+from __future__ import annotations
+import random
+from dataclasses import dataclass
+import numpy as np
+from loguru import logger
+import army
+import effects
+import uprising_units
+from battle_orchestrator import ArmyConfig, BattleConfig
+from batched_battle import STAGES, BatchedBattleEngine, BatchedBattleResults, BattleBatch
+from battle import Battle, BattleModifiers
+from battle_state import BattleStage, Terrain, TerrainType
+from policy_solver import BoltPolicySolver, PolicyObjective
+from result_modifier import DeclarativeResultModification, HarpoonersUpgrade, ResultModification, ResultModifier
+from roll_modifier import RollModification, RollModifier
+
+# Per combat memory of one declarative modification: the sorted items of the memory of each of its effects.
+ModificationMemory = tuple[type[DeclarativeResultModification], tuple[tuple[tuple[str, object], ...], ...]]
+
+@dataclass(frozen=True)
+class BattleSnapshot:
+    """Immutable state of a battle before its next round.
+
+    Snapshots hold unit classes in tuples, so a what-if branch is a dataclasses.replace of another snapshot sharing
+    everything it does not change. harpooneers_fed lines up with player_units and marks the Harpooneers that already
+    generated food this combat. declarative_memory holds the per combat memory of the declarative result modifications
+    in configuration order, e.g. the trades a TradeBoltForResource effect made."""
+    player_army_type: type[army.Army]
+    player_units: tuple[type[uprising_units.Unit], ...]
+    enemy_army_type: type[army.Army]
+    enemy_units: tuple[type[uprising_units.Unit], ...]
+    terrain_type: TerrainType
+    battle_stage: BattleStage = BattleStage.ARHCERY
+    clash_round_number: int = 1
+    player_net_resources: int = 0
+    harpooneers_fed: tuple[bool, ...] = ()
+    harpooners_use_count: int = 0
+    declarative_memory: tuple[ModificationMemory, ...] = ()
+
+    def __post_init__(self) -> None:
+        if not self.harpooneers_fed:
+            object.__setattr__(self, "harpooneers_fed", (False,) * len(self.player_units))
+        if len(self.harpooneers_fed) != len(self.player_units):
+            raise ValueError(f"Expected {len(self.player_units)} harpooneers fed flags, got {len(self.harpooneers_fed)}")
+
+    @classmethod
+    def from_config(cls, battle_config: BattleConfig) -> "BattleSnapshot":
+        return cls(battle_config.player_army_config.army_type, tuple(battle_config.player_army_config.units),
+                   battle_config.enemy_army_config.army_type, tuple(battle_config.enemy_army_config.units),
+                   battle_config.terrain.terrain_type)
+
+    @classmethod
+    def capture(cls, battle: Battle) -> "BattleSnapshot":
+        """Snapshot of a battle between two rounds."""
+        state = battle.battle_state
+        modification_list = battle.result_modifier.modification_list
+        harpooners_use_count = max((modification.use_count for modification in modification_list
+                                    if isinstance(modification, HarpoonersUpgrade)), default=0)
+        declarative_memory = tuple((type(modification), tuple(tuple(sorted(memory.items())) for memory in modification.memory))
+                                   for modification in modification_list if isinstance(modification, DeclarativeResultModification))
+        return cls(type(state.player_army), tuple(type(unit) for unit in state.player_army.units),
+                   type(state.enemy_army), tuple(type(unit) for unit in state.enemy_army.units),
+                   state.terrain.terrain_type, state.battle_stage, state.clash_round_number,
+                   state.battle_results.player_net_resources,
+                   tuple(getattr(unit, "food_generated_this_combat", False) for unit in state.player_army.units),
+                   harpooners_use_count, declarative_memory)
+
+    @property
+    def bolt_trades(self) -> int:
+        """Bolts traded this combat by HarpoonersUpgrade or a TradeBoltForResource effect, counted together by the
+        batched engine."""
+        trades = [self.harpooners_use_count]
+        for modification, memories in self.declarative_memory:
+            trades.extend(dict(memory).get("uses", 0) for effect, memory in zip(modification.effects, memories)
+                          if isinstance(effect, effects.TradeBoltForResource))
+        return max(trades)
+
+    @property
+    def rounds_played(self) -> int:
+        return 0 if self.battle_stage == BattleStage.ARHCERY else self.clash_round_number
+
+    def battle_config(self, roll_modifications: list[type[RollModification]],
+                      result_modifications: list[type[ResultModification]]) -> BattleConfig:
+        return BattleConfig(ArmyConfig(self.player_army_type, list(self.player_units)),
+                            ArmyConfig(self.enemy_army_type, list(self.enemy_units)),
+                            Terrain(self.terrain_type), roll_modifications, result_modifications)
+
+    def restore(self, roll_modifications: list[type[RollModification]], result_modifications: list[type[ResultModification]],
+                rng: random.Random | None = None) -> Battle:
+        """Fresh Battle object in this state, ready to be played on with Battle.resume."""
+        player_army = self.player_army_type()
+        for unit, fed in zip(self.player_units, self.harpooneers_fed):
+            player_army.add_unit(unit)
+            if fed:
+                player_army.units[-1].food_generated_this_combat = True
+        enemy_army = self.enemy_army_type()
+        for unit in self.enemy_units:
+            enemy_army.add_unit(unit)
+        battle_modifiers = BattleModifiers(RollModifier().add_modifications(roll_modifications),
+                                           ResultModifier().add_modifications(result_modifications))
+        memories = list(self.declarative_memory)
+        for modification in battle_modifiers.result_modifier.modification_list:
+            if isinstance(modification, HarpoonersUpgrade):
+                modification.use_count = self.harpooners_use_count
+            if isinstance(modification, DeclarativeResultModification):
+                memory = next((memory for memory in memories if memory[0] is type(modification)), None)
+                if memory is not None:
+                    memories.remove(memory)
+                    modification.memory = [dict(items) for items in memory[1]]
+        restored = Battle(player_army, enemy_army, Terrain(self.terrain_type), battle_modifiers, rng)
+        restored.battle_state.battle_stage = self.battle_stage
+        restored.battle_state.clash_round_number = self.clash_round_number
+        restored.battle_state.battle_results.player_net_resources = self.player_net_resources
+        restored.battle_state.battle_results.rounds = self.rounds_played
+        return restored
+
+    def group_key(self) -> tuple:
+        return (self.player_army_type, self.enemy_army_type, self.terrain_type, self.battle_stage)
+
+    def size(self) -> tuple[int, int]:
+        return (len(self.player_units), garrison_level(self.enemy_units) if issubclass(self.enemy_army_type, army.ImperialArmy)
+                else len(self.enemy_units))
+
+    def codes_within(self, base: "BattleSnapshot") -> tuple[int, int, int] | None:
+        """Player code, enemy code and fed harpooneers of this snapshot in the batched engine of the base snapshot,
+        or None if its armies are not subsequences of the base armies."""
+        if self.group_key() != base.group_key():
+            return None
+        player_positions = subsequence_positions(self.player_units, base.player_units)
+        if issubclass(self.enemy_army_type, army.ImperialArmy):
+            enemy_code = garrison_level(self.enemy_units)
+            enemy_fits = enemy_code <= garrison_level(base.enemy_units)
+        else:
+            enemy_positions = subsequence_positions(self.enemy_units, base.enemy_units)
+            enemy_fits = enemy_positions is not None
+            enemy_code = sum(1 << position for position in enemy_positions or [])
+        if player_positions is None or not enemy_fits:
+            return None
+        return (sum(1 << position for position in player_positions), enemy_code,
+                sum(1 << position for position, fed in zip(player_positions, self.harpooneers_fed) if fed))
+
+    def fill_batch(self, batch: BattleBatch, rows: slice, base: "BattleSnapshot") -> None:
+        player_code, enemy_code, flagged = self.codes_within(base)
+        batch.player_code[rows] = player_code
+        batch.enemy_code[rows] = enemy_code
+        batch.harpooneers_flagged[rows] = flagged
+        batch.harpooners_use_count[rows] = self.bolt_trades
+        batch.net_resources[rows] = self.player_net_resources
+        batch.rounds[rows] = self.rounds_played
+
+def garrison_level(units: tuple[type[uprising_units.Unit], ...]) -> int:
+    return int(units[0].name[-1]) if units else 0
+
+def subsequence_positions(units: tuple, base_units: tuple) -> list[int] | None:
+    """Positions of units in base_units keeping their order, so losses hit equal units in the same order as in units."""
+    positions = []
+    for position, unit in enumerate(base_units):
+        if len(positions) < len(units) and unit is units[len(positions)]:
+            positions.append(position)
+    return positions if len(positions) == len(units) else None
+
+def snapshot_groups(snapshots: list[BattleSnapshot]) -> list[tuple[BattleSnapshot, list[int]]]:
+    """Splits snapshots into groups that one batched engine or policy solver can evaluate together: each group has a
+    base snapshot whose armies contain the armies of every member."""
+    groups: list[tuple[BattleSnapshot, list[int]]] = []
+    for index in sorted(range(len(snapshots)), key=lambda index: snapshots[index].size(), reverse=True):
+        group = next((group for group in groups if snapshots[index].codes_within(group[0]) is not None), None)
+        if group is None:
+            groups.append((snapshots[index], [index]))
+        else:
+            group[1].append(index)
+    return groups
+
+def simulate_snapshots(snapshots: list[BattleSnapshot], roll_modifications: list[type[RollModification]],
+                       result_modifications: list[type[ResultModification]], number_of_iterations: int = 1000,
+                       seed: int | None = None) -> list[BatchedBattleResults]:
+    """Plays number_of_iterations battles on from every snapshot, all branches of a group in a single batch."""
+    rng = np.random.default_rng(seed)
+    results: list[BatchedBattleResults | None] = [None] * len(snapshots)
+    groups = snapshot_groups(snapshots)
+    for base, members in groups:
+        engine = BatchedBattleEngine(base.battle_config(roll_modifications, result_modifications), int(rng.integers(2 ** 63)))
+        batch = BattleBatch.fresh(len(members) * number_of_iterations, 0, 0)
+        for member_number, index in enumerate(members):
+            snapshots[index].fill_batch(batch, slice(member_number * number_of_iterations, (member_number + 1) * number_of_iterations), base)
+        group_results = engine.run_batch(batch, base.battle_stage)
+        for member_number, index in enumerate(members):
+            rows = slice(member_number * number_of_iterations, (member_number + 1) * number_of_iterations)
+            results[index] = BatchedBattleResults(group_results.outcome[rows], group_results.net_resources[rows], group_results.rounds[rows])
+    logger.debug(f"Simulated {len(snapshots)} snapshots in {len(groups)} batches")
+    return results
+
+def simulate_snapshot(snapshot: BattleSnapshot, roll_modifications: list[type[RollModification]],
+                      result_modifications: list[type[ResultModification]], number_of_iterations: int = 5000,
+                      seed: int | None = None) -> BatchedBattleResults:
+    """Plays number_of_iterations battles on from the snapshot with the batched engine."""
+    return simulate_snapshots([snapshot], roll_modifications, result_modifications, number_of_iterations, seed)[0]
+
+def solve_snapshots(snapshots: list[BattleSnapshot], roll_modifications: list[type[RollModification]],
+                    result_modifications: list[type[ResultModification]],
+                    objective: PolicyObjective = PolicyObjective.NET_RESOURCES) -> list[float]:
+    """Expected net resources (including those already gained) or win probability of every snapshot under optimal
+    bolt play. Snapshots of a group share one solver and its memoized states."""
+    values = [0.0] * len(snapshots)
+    for base, members in snapshot_groups(snapshots):
+        solver = BoltPolicySolver(base.battle_config(roll_modifications, result_modifications), objective)
+        for index in members:
+            snapshot = snapshots[index]
+            player_code, enemy_code, flagged = snapshot.codes_within(base)
+            player_down = solver.player_tables.hit_points[player_code] == 0
+            enemy_down = solver.enemy_tables.hit_points[enemy_code] == 0
+            if snapshot.battle_stage == BattleStage.CLASH and (player_down or enemy_down):
+                value = float(solver.terminal_value(np.array(player_down), np.array(enemy_down)))
+            else:
+                value = solver.state_value((STAGES.index(snapshot.battle_stage), player_code, flagged, enemy_code,
+                                            snapshot.harpooners_use_count))
+            values[index] = snapshot.player_net_resources + value if objective == PolicyObjective.NET_RESOURCES else value
+    return values
+
+def solve_snapshot(snapshot: BattleSnapshot, roll_modifications: list[type[RollModification]],
+                   result_modifications: list[type[ResultModification]],
+                   objective: PolicyObjective = PolicyObjective.NET_RESOURCES) -> float:
+    return solve_snapshots([snapshot], roll_modifications, result_modifications, objective)[0]
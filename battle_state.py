@@ -1,5 +1,6 @@
 from __future__ import annotations
-from dataclasses import dataclass
+import random
+from dataclasses import dataclass, field
 from enum import StrEnum
 import army
 import dice
@@ -29,10 +30,14 @@ class OverallBattleResult(StrEnum):
     draw = "Draw!"
     player_defeat = "Player defeat!"
     undecided = "Undecided"
+
+OUTCOME_CODES: dict[OverallBattleResult, int] = {result: code for code, result in enumerate(OverallBattleResult)}
+
 class BattleResult:
     def __init__(self) -> None:
         self.player_net_resources = 0
         self.overall_result: str = OverallBattleResult.undecided
+        self.rounds = 0
 
     def __repr__(self) -> str:
        return f"{self.overall_result} Net resources: {self.player_net_resources}"
@@ -43,7 +48,8 @@ class BattleState:
     enemy_army: army.Army
     terrain: Terrain
     battle_results: BattleResult
-    player_roll_results: dice.DiceRollResults = dice.DiceRollResults()
-    enemy_roll_results: dice.DiceRollResults = dice.DiceRollResults()
+    player_roll_results: dice.DiceRollResults = field(default_factory=dice.DiceRollResults)
+    enemy_roll_results: dice.DiceRollResults = field(default_factory=dice.DiceRollResults)
     clash_round_number: int = 1
     battle_stage: BattleStage = BattleStage.ARHCERY
+    rng: random.Random = field(default_factory=random.Random)
@@ -0,0 +1,205 @@
+import argparse
+import os
+import sys
+import time
+from dataclasses import dataclass, replace
+from typing import Callable
+import numpy as np
+import pandas as pd
+from loguru import logger
+import army
+import uprising_units
+import result_modifier
+import roll_modifier
+from batched_battle import BatchedBattleEngine
+from battle_orchestrator import BASE_SEED_BITS, ArmyConfig, BattleConfig, BattleOrchestrator
+from battle_state import OverallBattleResult, OUTCOME_CODES, Terrain, TerrainType
+from two_stage import TwoStageSimulator
+
+# An estimation strategy returns the win probability and expected net resources from a battle budget and a seed.
+Estimator = Callable[[BattleConfig, int, int], tuple[float, float]]
+VICTORY = OUTCOME_CODES[OverallBattleResult.player_victory]
+# The last base seed, far from the small seeds of the repetitions.
+GROUND_TRUTH_SEED = (1 << BASE_SEED_BITS) - 1
+
+def benchmark_battle_config() -> BattleConfig:
+    return BattleConfig(ArmyConfig(army.UnitsArmy, [uprising_units.Stoneshell, uprising_units.CrabRider, uprising_units.CrabRider,
+                                                    uprising_units.Harpooneers, uprising_units.Harpooneers]),
+                        ArmyConfig(army.ImperialArmy, [uprising_units.Garrison2]),
+                        Terrain(TerrainType.FOREST), [roll_modifier.TerrainRollModification],
+                        [result_modifier.LightOfTheThan, result_modifier.TerrainResultModification,
+                         result_modifier.DruidMountainHeart, result_modifier.HarpoonersUpgrade])
+
+def gil_enabled() -> bool:
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+@dataclass
+class ThreadScaling:
+    threads: int
+    seconds: float
+    battles_per_second: float
+    speedup: float
+
+def thread_scaling(battle_config: BattleConfig, number_of_iterations: int = 20_000,
+                   thread_counts: list[int] | None = None, seed: int = 0) -> list[ThreadScaling]:
+    """Throughput of BattleOrchestrator.conduct_battles per thread count. Only free-threaded Python scales with threads."""
+    thread_counts = thread_counts or sorted({1, 2, 4, os.cpu_count() or 1})
+    orchestrator = BattleOrchestrator(battle_config)
+    orchestrator.conduct_battles(min(number_of_iterations, 1000), seed, threads=1)
+    measurements = []
+    for threads in thread_counts:
+        start = time.perf_counter()
+        orchestrator.conduct_battles(number_of_iterations, seed, threads=threads)
+        seconds = time.perf_counter() - start
+        speedup = measurements[0].seconds / seconds if measurements else 1.0
+        measurements.append(ThreadScaling(threads, seconds, number_of_iterations / seconds, speedup))
+        logger.info(f"{threads} threads: {number_of_iterations / seconds:.0f} battles/s, speedup {speedup:.2f}")
+    return measurements
+
+def accuracy_scenarios() -> dict[str, BattleConfig]:
+    benchmark = benchmark_battle_config()
+    return {"benchmark": benchmark,
+            "garrison 3 in mountains": replace(benchmark, enemy_army_config=ArmyConfig(army.ImperialArmy, [uprising_units.Garrison3]),
+                                               terrain=Terrain(TerrainType.MOUNTAIN))}
+
+def estimate_conduct_battles(battle_config: BattleConfig, battles: int, seed: int) -> tuple[float, float]:
+    data = BattleOrchestrator(battle_config).conduct_battles(battles, seed).data
+    return float((data["victor"] == OverallBattleResult.player_victory).mean()), float(data["net_resources"].mean())
+
+def estimate_batched(battle_config: BattleConfig, battles: int, seed: int) -> tuple[float, float]:
+    results = BatchedBattleEngine(battle_config, seed).run(battles)
+    return float((results.outcome == VICTORY).mean()), float(results.net_resources.mean())
+
+def estimate_two_stage(battle_config: BattleConfig, battles: int, seed: int) -> tuple[float, float]:
+    estimate = TwoStageSimulator(battle_config, seed).estimate(battles)
+    return estimate.outcome_probabilities[OverallBattleResult.player_victory], estimate.net_resources_mean
+
+# Battle budgets of every strategy, spanning similar CPU times.
+ESTIMATION_STRATEGIES: dict[str, tuple[Estimator, list[int]]] = {
+    "conduct_battles": (estimate_conduct_battles, [1000, 4000, 16_000]),
+    "batched": (estimate_batched, [10_000, 100_000, 1_000_000]),
+    "two_stage": (estimate_two_stage, [10_000, 100_000, 1_000_000]),
+}
+
+@dataclass
+class StrategyAccuracy:
+    scenario: str
+    strategy: str
+    battles: int
+    repetitions: int
+    cpu_seconds: float
+    win_probability_rmse: float
+    net_resources_rmse: float
+
+    def cpu_seconds_for(self, rmse: float, target: float) -> float:
+        """CPU seconds this strategy needs for an error of target, as errors shrink with the square root of the work."""
+        return self.cpu_seconds * (rmse / target) ** 2
+
+def ground_truth(battle_config: BattleConfig, battles: int, seed: int) -> tuple[float, float, float, float]:
+    """Win probability and expected net resources with their standard errors from a large run of the reference Battle
+    engine in worker processes. Whole battles under the heuristic modifications have no exact solution here, as
+    exact_rolls covers single rolls and policy_solver only values its own solved policy, so the reference engine
+    rather than one of the strategies being measured sets the truth."""
+    with BattleOrchestrator(battle_config).conduct_battles_parallel(battles, seed) as arena:
+        victories = arena["outcome"] == VICTORY
+        net_resources = arena["net_resources"].astype(np.float64)
+        return (float(victories.mean()), float(net_resources.mean()),
+                float(victories.std() / np.sqrt(battles)), float(net_resources.std() / np.sqrt(battles)))
+
+def accuracy_per_cpu_second(scenarios: dict[str, BattleConfig] | None = None, strategies: list[str] | None = None,
+                            repetitions: int = 5, ground_truth_battles: int = 1_000_000, seed: int = 0,
+                            win_probability_target: float = 0.001, net_resources_target: float = 0.01) -> pd.DataFrame:
+    """Root mean square error of every strategy and battle budget against a high precision ground truth, with the CPU
+    time spent, and the CPU time each strategy would need to reach the target errors.
+
+    CPU time is measured over the whole process, so thread pools are charged for every thread. The ground truth
+    error is listed next to the errors, which cannot be resolved much below it."""
+    scenarios = scenarios or accuracy_scenarios()
+    rows = []
+    for scenario, battle_config in scenarios.items():
+        truth_win, truth_net, truth_win_error, truth_net_error = ground_truth(battle_config, ground_truth_battles, GROUND_TRUTH_SEED)
+        logger.info(f"{scenario}: ground truth win probability {truth_win:.5f} +/- {truth_win_error:.5f}, "
+                    f"net resources {truth_net:.4f} +/- {truth_net_error:.4f}")
+        for strategy in strategies or list(ESTIMATION_STRATEGIES):
+            estimator, battle_counts = ESTIMATION_STRATEGIES[strategy]
+            for battles in battle_counts:
+                cpu_seconds, win_errors, net_errors = 0.0, [], []
+                for repetition in range(repetitions):
+                    start = time.process_time()
+                    win_probability, net_resources = estimator(battle_config, battles, seed + 1 + repetition)
+                    cpu_seconds += time.process_time() - start
+                    win_errors.append(win_probability - truth_win)
+                    net_errors.append(net_resources - truth_net)
+                accuracy = StrategyAccuracy(scenario, strategy, battles, repetitions, cpu_seconds / repetitions,
+                                            float(np.sqrt(np.mean(np.square(win_errors)))), float(np.sqrt(np.mean(np.square(net_errors)))))
+                logger.info(f"{scenario}, {strategy} with {battles} battles: {accuracy.cpu_seconds:.3f} CPU s, "
+                            f"win probability RMSE {accuracy.win_probability_rmse:.5f}, net resources RMSE {accuracy.net_resources_rmse:.4f}")
+                rows.append({"scenario": scenario, "strategy": strategy, "battles": battles, "repetitions": repetitions,
+                             "cpu_seconds": accuracy.cpu_seconds,
+                             "win_probability_rmse": accuracy.win_probability_rmse,
+                             "net_resources_rmse": accuracy.net_resources_rmse,
+                             "ground_truth_win_probability_error": truth_win_error,
+                             "ground_truth_net_resources_error": truth_net_error,
+                             f"cpu_seconds_for_win_probability_rmse_{win_probability_target}":
+                                 accuracy.cpu_seconds_for(accuracy.win_probability_rmse, win_probability_target),
+                             f"cpu_seconds_for_net_resources_rmse_{net_resources_target}":
+                                 accuracy.cpu_seconds_for(accuracy.net_resources_rmse, net_resources_target)})
+    return pd.DataFrame(rows)
+
+def strategy_summary(table: pd.DataFrame) -> pd.DataFrame:
+    """Median CPU seconds to the target errors of every strategy per scenario, the cheapest strategy first."""
+    target_columns = [column for column in table.columns if column.startswith("cpu_seconds_for_")]
+    summary = table.groupby(["scenario", "strategy"])[target_columns].median().reset_index()
+    return summary.sort_values(["scenario", target_columns[0]], ignore_index=True)
+
+def plot_accuracy(table: pd.DataFrame, path: str) -> None:
+    """Error against CPU time on log scales, one panel per scenario and measure. Needs matplotlib."""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        logger.warning("matplotlib is not installed, not plotting accuracy curves")
+        return
+    scenarios = list(dict.fromkeys(table["scenario"]))
+    figure, axes = plt.subplots(2, len(scenarios), figsize=(6 * len(scenarios), 8), squeeze=False)
+    for column, scenario in enumerate(scenarios):
+        for row, measure in enumerate(["win_probability_rmse", "net_resources_rmse"]):
+            axis = axes[row][column]
+            for strategy, strategy_rows in table[table["scenario"] == scenario].groupby("strategy"):
+                axis.loglog(strategy_rows["cpu_seconds"], strategy_rows[measure], marker="o", label=strategy)
+            axis.set_title(f"{scenario}: {measure}")
+            axis.set_xlabel("CPU seconds")
+            axis.legend()
+    figure.tight_layout()
+    figure.savefig(path)
+    logger.info(f"Saved accuracy curves to {path}")
+
+def main(arguments: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks of the battle simulator.")
+    modes = parser.add_subparsers(dest="mode")
+    modes.add_parser("threads", help="Throughput of conduct_battles per thread count (the default)")
+    accuracy = modes.add_parser("accuracy", help="Error of the estimation strategies against CPU time")
+    accuracy.add_argument("--strategy", choices=list(ESTIMATION_STRATEGIES), action="append")
+    accuracy.add_argument("--repetitions", type=int, default=5)
+    accuracy.add_argument("--ground-truth-battles", type=int, default=1_000_000)
+    accuracy.add_argument("--seed", type=int, default=0)
+    accuracy.add_argument("--csv", help="Write the comparison table to this file")
+    accuracy.add_argument("--plot", help="Save error against CPU time curves to this image file")
+    options = parser.parse_args(arguments)
+    if options.mode == "accuracy":
+        table = accuracy_per_cpu_second(strategies=options.strategy, repetitions=options.repetitions,
+                                        ground_truth_battles=options.ground_truth_battles, seed=options.seed)
+        if options.csv:
+            table.to_csv(options.csv, index=False)
+        if options.plot:
+            plot_accuracy(table, options.plot)
+        logger.info(f"Accuracy per CPU second:\n{table.to_string(index=False)}")
+        logger.info(f"CPU seconds to the target errors:\n{strategy_summary(table).to_string(index=False)}")
+        return
+    logger.info(f"Python {sys.version.split()[0]}, GIL {'enabled' if gil_enabled() else 'disabled'}, {os.cpu_count()} cores")
+    thread_scaling(benchmark_battle_config())
+
+if __name__ == "__main__":
+    main()
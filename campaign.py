@@ -0,0 +1,145 @@
+from __future__ import annotations
+from collections import defaultdict
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+from loguru import logger
+import army
+import uprising_units
+from batched_battle import BatchedBattleEngine
+from battle_orchestrator import ArmyConfig, BattleConfig
+from battle_state import OverallBattleResult, OUTCOME_CODES, Terrain, TerrainType
+from result_modifier import ResultModification
+from roll_modifier import RollModification
+
+VICTORY = OUTCOME_CODES[OverallBattleResult.player_victory]
+RESULTS_BY_CODE = {code: result for result, code in OUTCOME_CODES.items()}
+
+# (surviving player units, outcomes of the battles fought so far, net resources so far)
+CampaignState = tuple[tuple[type[uprising_units.Unit], ...], tuple[OverallBattleResult, ...], int]
+
+@dataclass
+class CampaignBattle:
+    enemy_army_config: ArmyConfig
+    terrain: Terrain
+
+@dataclass
+class BattleTransitions:
+    """Observed ends of the battles played from one player army against one enemy: (outcome code, net resources,
+    surviving units) with the number of battles that ended that way."""
+    battles: int = 0
+    counts: dict[tuple[int, int, tuple[type[uprising_units.Unit], ...]], int] = field(default_factory=lambda: defaultdict(int))
+
+    def probabilities(self) -> list[tuple[tuple[int, int, tuple[type[uprising_units.Unit], ...]], float]]:
+        return [(end, count / self.battles) for end, count in self.counts.items()]
+
+@dataclass
+class CampaignResults:
+    paths: pd.DataFrame
+    battle_count: int
+    battles_simulated: int
+    distinct_states: int
+
+    def outcome_probabilities(self) -> pd.Series:
+        return self.paths.groupby("outcomes")["probability"].sum().sort_values(ascending=False)
+
+    def net_resources_distribution(self) -> pd.Series:
+        return self.paths.groupby("net_resources")["probability"].sum()
+
+    def net_resources_mean(self) -> float:
+        return float((self.paths["net_resources"] * self.paths["probability"]).sum())
+
+    def campaign_won_probability(self) -> float:
+        won = self.paths["outcomes"].map(lambda outcomes: outcomes.count(OverallBattleResult.player_victory) == self.battle_count)
+        return float(self.paths.loc[won, "probability"].sum())
+
+class CampaignSimulator:
+    """Plays a sequence of battles in which the survivors of one battle fight the next enemy.
+
+    The campaign is propagated as a distribution over player army states rather than as individual sample paths.
+    The ends of the battles from a given army state against a given enemy are simulated once with the batched engine
+    and memoized, so every path reaching an identical state shares them, also across battles with the same enemy and
+    terrain. Each state gets battles in proportion to the probability of reaching it, with a minimum per state."""
+    def __init__(self, player_army_config: ArmyConfig, battles: list[CampaignBattle], roll_modifications: list[type[RollModification]],
+                 result_modifications: list[type[ResultModification]], seed: int | None = None, minimum_battles_per_state: int = 200) -> None:
+        if not issubclass(player_army_config.army_type, army.UnitsArmy) or issubclass(player_army_config.army_type, army.ImperialArmy):
+            raise ValueError("Campaigns need a units army on the player side")
+        self.player_army_config = player_army_config
+        self.battles = battles
+        self.roll_modifications = roll_modifications
+        self.result_modifications = result_modifications
+        self.minimum_battles_per_state = minimum_battles_per_state
+        self.rng = np.random.default_rng(seed)
+        self.transition_cache: dict[tuple, BattleTransitions] = {}
+        self.battles_simulated = 0
+
+    def transitions(self, survivors: tuple[type[uprising_units.Unit], ...], campaign_battle: CampaignBattle,
+                    battle_count: int) -> BattleTransitions:
+        """Memoized battle ends from the survivors, topped up with new battles until battle_count were played."""
+        enemy_config = campaign_battle.enemy_army_config
+        key = (survivors, enemy_config.army_type, tuple(enemy_config.units), campaign_battle.terrain.terrain_type)
+        transitions = self.transition_cache.setdefault(key, BattleTransitions())
+        missing = battle_count - transitions.battles
+        if missing <= 0:
+            return transitions
+        battle_config = BattleConfig(ArmyConfig(self.player_army_config.army_type, list(survivors)), enemy_config,
+                                     campaign_battle.terrain, self.roll_modifications, self.result_modifications)
+        engine = BatchedBattleEngine(battle_config, int(self.rng.integers(2 ** 63)))
+        results = engine.run_chunk(missing)
+        ends, counts = np.unique(np.stack([results.outcome, results.net_resources, engine.batch.player_code]).astype(np.int64),
+                                 axis=1, return_counts=True)
+        for (outcome, net_resources, code), count in zip(ends.T, counts):
+            remaining = tuple(unit for index, unit in enumerate(survivors) if code >> index & 1)
+            transitions.counts[(int(outcome), int(net_resources), remaining)] += int(count)
+        transitions.battles += missing
+        self.battles_simulated += missing
+        return transitions
+
+    def run(self, number_of_iterations: int = 20_000) -> CampaignResults:
+        """Joint distribution of the battle outcomes, net resources and survivors over the whole campaign.
+
+        number_of_iterations is the battle budget of a state reached with probability one."""
+        states: dict[CampaignState, float] = {(tuple(self.player_army_config.units), (), 0): 1.0}
+        finished: dict[CampaignState, float] = defaultdict(float)
+        for battle_number, campaign_battle in enumerate(self.battles):
+            reach: dict[tuple[type[uprising_units.Unit], ...], float] = defaultdict(float)
+            for (survivors, _, _), probability in states.items():
+                reach[survivors] += probability
+            next_states: dict[CampaignState, float] = defaultdict(float)
+            for (survivors, outcomes, net_resources), probability in states.items():
+                battle_count = max(self.minimum_battles_per_state, int(np.ceil(reach[survivors] * number_of_iterations)))
+                for (outcome, battle_net_resources, remaining), end_probability in self.transitions(survivors, campaign_battle, battle_count).probabilities():
+                    state = (remaining, outcomes + (RESULTS_BY_CODE[outcome],), net_resources + battle_net_resources)
+                    if outcome == VICTORY and battle_number + 1 < len(self.battles):
+                        next_states[state] += probability * end_probability
+                    else:
+                        finished[state] += probability * end_probability
+            logger.debug(f"Battle {battle_number + 1}: {len(reach)} distinct army states, {len(next_states)} campaign states continue")
+            states = next_states
+
+        paths = pd.DataFrame([{"outcomes": tuple(str(result) for result in outcomes),
+                               "battles_fought": len(outcomes),
+                               "survivors": tuple(unit.name for unit in survivors),
+                               "net_resources": net_resources,
+                               "probability": probability}
+                              for (survivors, outcomes, net_resources), probability in finished.items()])
+        logger.info(f"Campaign of {len(self.battles)} battles simulated with {self.battles_simulated} battles "
+                    f"over {len(self.transition_cache)} distinct army states")
+        return CampaignResults(paths, len(self.battles), self.battles_simulated, len(self.transition_cache))
+
+if __name__ == "__main__":
+    import result_modifier
+    import roll_modifier
+    campaign = CampaignSimulator(
+        ArmyConfig(army.UnitsArmy, [uprising_units.Stoneshell, uprising_units.CrabRider, uprising_units.CrabRider,
+                                    uprising_units.Harpooneers, uprising_units.Harpooneers]),
+        [CampaignBattle(ArmyConfig(army.ImperialArmy, [uprising_units.Garrison1]), Terrain(TerrainType.MARSHES)),
+         CampaignBattle(ArmyConfig(army.ImperialArmy, [uprising_units.Garrison2]), Terrain(TerrainType.FOREST)),
+         CampaignBattle(ArmyConfig(army.ImperialArmy, [uprising_units.Garrison1]), Terrain(TerrainType.MARSHES)),
+         CampaignBattle(ArmyConfig(army.ImperialArmy, [uprising_units.Garrison3]), Terrain(TerrainType.MOUNTAIN))],
+        [roll_modifier.TerrainRollModification],
+        [result_modifier.LightOfTheThan, result_modifier.TerrainResultModification, result_modifier.DruidMountainHeart,
+         result_modifier.HarpoonersUpgrade])
+    campaign_results = campaign.run()
+    logger.info(f"\n{campaign_results.outcome_probabilities()}")
+    logger.info(f"Expected net resources: {campaign_results.net_resources_mean():.3f}")
@@ -2,8 +2,12 @@ from dataclasses import dataclass
 from abc import abstractmethod
 import dataclasses
 import random
+from typing import TYPE_CHECKING
 from loguru import logger
 
+if TYPE_CHECKING:
+    import exact_rolls
+
 @dataclass(frozen=True)
 class DiceNames:
     white = "White"
@@ -37,7 +41,7 @@ STANDARD_LOSS_PRIORITY = [DiceNames.white,
                           DiceNames.gold 
 ]
 
-@dataclass
+@dataclass(frozen=True)
 class DieResult:
     skulls: int = 0
     shields: int = 0
@@ -68,7 +72,7 @@ class DiceRollResults:
         self.stars += result.stars
         self.blanks += result.blanks
 
-@dataclass
+@dataclass(frozen=True)
 class DieOutcomeDistribution:
     distribution: tuple[DieResult, DieResult, DieResult, DieResult, DieResult, DieResult]
 
@@ -90,100 +94,98 @@ class Die:
     def __repr__(self) -> str:
         return self.name
     
-    def roll(self) -> None:
-        self.result = random.choice(self.die_outcome_distribution.distribution)
+    def roll(self, rng: random.Random | None = None) -> None:
+        """Rolls with the given generator, or the module level random generator without one."""
+        self.result = (rng or random).choice(self.die_outcome_distribution.distribution)
 
 
 class WhiteDie(Die):    
-    @property
-    def die_outcome_distribution(self):
-        return DieOutcomeDistribution(
-            distribution = (DieResult(skulls=1, shields=1),
-                            DieResult(skulls=1),
-                            DieResult(shields=1),
-                            DieResult(blanks=1),
-                            DieResult(blanks=1),
-                            DieResult(blanks=1))
-        )
+    die_outcome_distribution = DieOutcomeDistribution(
+        distribution = (DieResult(skulls=1, shields=1),
+                        DieResult(skulls=1),
+                        DieResult(shields=1),
+                        DieResult(blanks=1),
+                        DieResult(blanks=1),
+                        DieResult(blanks=1))
+    )
     @property
     def name(self):
         return DiceNames.white
 
 class RedDie(Die):
-    @property
-    def die_outcome_distribution(self):
-        return DieOutcomeDistribution(
-            distribution = (DieResult(skulls=2),
-                            DieResult(skulls=1, bolts=1),
-                            DieResult(skulls=1),
-                            DieResult(skulls=1),
-                            DieResult(blanks=1),
-                            DieResult(blanks=1))
-        )
+    die_outcome_distribution = DieOutcomeDistribution(
+        distribution = (DieResult(skulls=2),
+                        DieResult(skulls=1, bolts=1),
+                        DieResult(skulls=1),
+                        DieResult(skulls=1),
+                        DieResult(blanks=1),
+                        DieResult(blanks=1))
+    )
     @property
     def name(self):
         return DiceNames.red
 
 class OrangeDie(Die):    
-    @property
-    def die_outcome_distribution(self):
-        return DieOutcomeDistribution(
-            distribution = (DieResult(skulls=1),
-                            DieResult(skulls=1),
-                            DieResult(skulls=1),
-                            DieResult(skulls=1),
-                            DieResult(blanks=1),
-                            DieResult(blanks=1))
-        )
+    die_outcome_distribution = DieOutcomeDistribution(
+        distribution = (DieResult(skulls=1),
+                        DieResult(skulls=1),
+                        DieResult(skulls=1),
+                        DieResult(skulls=1),
+                        DieResult(blanks=1),
+                        DieResult(blanks=1))
+    )
     @property
     def name(self):
         return DiceNames.orange
     
 class BlueDie(Die):    
-    @property
-    def die_outcome_distribution(self):
-        return DieOutcomeDistribution(
-            distribution = (DieResult(shields=1),
-                            DieResult(shields=1),
-                            DieResult(skulls=1),
-                            DieResult(skulls=1),
-                            DieResult(skulls=1),
-                            DieResult(blanks=1))
-        )
+    die_outcome_distribution = DieOutcomeDistribution(
+        distribution = (DieResult(shields=1),
+                        DieResult(shields=1),
+                        DieResult(skulls=1),
+                        DieResult(skulls=1),
+                        DieResult(skulls=1),
+                        DieResult(blanks=1))
+    )
     @property
     def name(self):
         return DiceNames.blue
     
 class PurpleDie(Die):    
-    @property
-    def die_outcome_distribution(self):
-        return DieOutcomeDistribution(
-            distribution = (DieResult(bolts=2),
-                            DieResult(skulls=1, bolts=1),
-                            DieResult(skulls=1),
-                            DieResult(skulls=1),
-                            DieResult(skulls=1),
-                            DieResult(blanks=1))
-        )
+    die_outcome_distribution = DieOutcomeDistribution(
+        distribution = (DieResult(bolts=2),
+                        DieResult(skulls=1, bolts=1),
+                        DieResult(skulls=1),
+                        DieResult(skulls=1),
+                        DieResult(skulls=1),
+                        DieResult(blanks=1))
+    )
     @property
     def name(self):
         return DiceNames.purple
 
 class BlackDie(Die):    
-    @property
-    def die_outcome_distribution(self):
-        return DieOutcomeDistribution(
-            distribution = (DieResult(skulls=3),
-                            DieResult(skulls=2),
-                            DieResult(skulls=1),
-                            DieResult(skulls=1),
-                            DieResult(skulls=1),
-                            DieResult(bolts=1))
-        )
+    die_outcome_distribution = DieOutcomeDistribution(
+        distribution = (DieResult(skulls=3),
+                        DieResult(skulls=2),
+                        DieResult(skulls=1),
+                        DieResult(skulls=1),
+                        DieResult(skulls=1),
+                        DieResult(bolts=1))
+    )
     @property
     def name(self):
         return DiceNames.black
 
+DIE_TYPES: dict[str, type[Die]] = {
+    DiceNames.white: WhiteDie,
+    DiceNames.red: RedDie,
+    DiceNames.orange: OrangeDie,
+    DiceNames.blue: BlueDie,
+    DiceNames.purple: PurpleDie,
+    DiceNames.black: BlackDie
+}
+
 class DicePool:
     def __init__(self, reroll_count: int = 0, dice_reroll_priority: list[str] = STANDARD_DICE_PRIORITY):
         self.dice: list[Die] = []
@@ -209,10 +211,10 @@ class DicePool:
                 logger.debug(f"Removing {die} as it matches {die_type}")
                 return
 
-    def roll_dice(self) -> DiceRollResults:
+    def roll_dice(self, rng: random.Random | None = None) -> DiceRollResults:
         logger.debug(f"Rolling the following dice: {self.dice_count}")
         for die in self.dice:
-            die.roll()
+            die.roll(rng)
 
         total_result = DiceRollResults()
         for die in self.dice:
@@ -220,6 +222,12 @@ class DicePool:
 
         return total_result
 
+    def distribution(self) -> "exact_rolls.PoolDistribution":
+        """Exact distribution of the totals of roll_dice, as an exact_rolls.PoolDistribution memoized per combination of dice."""
+        from exact_rolls import distribution_of_dice
+        return distribution_of_dice(self.dice)
+
 
-dice_pool = DicePool(reroll_count=2).add_die(BlueDie()).add_die(WhiteDie()).add_die(BlackDie()).add_die(PurpleDie())
-logger.debug(dice_pool.roll_dice())
+if __name__ == "__main__":
+    dice_pool = DicePool(reroll_count=2).add_die(BlueDie()).add_die(WhiteDie()).add_die(BlackDie()).add_die(PurpleDie())
+    logger.debug(dice_pool.roll_dice(random.Random()))
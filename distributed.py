@@ -0,0 +1,365 @@
+from __future__ import annotations
+import argparse
+import multiprocessing
+import os
+import socket
+import statistics
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from multiprocessing.connection import Client, Connection, Listener
+from loguru import logger
+from batched_battle import BatchedBattleEngine
+from battle_aggregate import BattleAggregate
+from battle_orchestrator import BattleConfig, new_base_seed
+
+# Battles are simulated in blocks of BLOCK_SIZE, each with its own generator seeded from (base seed, config, block).
+# Shards are ranges of whole blocks, so the results do not depend on how the blocks are spread over shards and workers.
+BLOCK_SIZE = 10_000
+AUTHKEY_VARIABLE = "UPRISING_AUTHKEY"
+CONNECTION_BACKLOG = 64
+# Shards reassigned this many times, after losing their workers or running slowly, fail the run rather than being
+# handed out again, since a shard that crashes every worker would otherwise be requeued forever.
+MAX_SHARD_REASSIGNMENTS = 3
+
+def require_authkey(authkey: bytes | None = None) -> bytes:
+    """The given shared secret, else the one in $UPRISING_AUTHKEY. Connections unpickle what peers send, so
+    coordinators and workers never run without one."""
+    if authkey:
+        return authkey
+    environment_authkey = os.environ.get(AUTHKEY_VARIABLE)
+    if not environment_authkey:
+        raise ValueError(f"An authkey is required, set ${AUTHKEY_VARIABLE} to a shared secret")
+    return environment_authkey.encode()
+
+@dataclass(frozen=True)
+class Shard:
+    shard_id: int
+    config_index: int
+    first_block: int
+    stop_block: int
+    battle_count: int
+    base_seed: int
+
+def simulate_shard(battle_config: BattleConfig, shard: Shard, block_size: int = BLOCK_SIZE) -> BattleAggregate:
+    aggregate = BattleAggregate()
+    for block in range(shard.first_block, shard.stop_block):
+        battles = min(block_size, shard.battle_count - block * block_size)
+        engine = BatchedBattleEngine(battle_config, [shard.base_seed, shard.config_index, block])
+        aggregate = aggregate.merge(BattleAggregate.from_results(engine.run(battles)))
+    return aggregate
+
+def plan_shards(battle_counts: list[int], base_seed: int, blocks_per_shard: int, block_size: int = BLOCK_SIZE) -> list[Shard]:
+    shards = []
+    for config_index, battle_count in enumerate(battle_counts):
+        block_count = -(-battle_count // block_size)
+        for first_block in range(0, block_count, blocks_per_shard):
+            shards.append(Shard(len(shards), config_index, first_block, min(first_block + blocks_per_shard, block_count),
+                                battle_count, base_seed))
+    return shards
+
+@dataclass
+class Assignment:
+    shard: Shard
+    worker: str
+    started: float
+    speculative: bool = False
+
+@dataclass
+class DistributedResults:
+    aggregates: list[BattleAggregate]
+    base_seed: int
+    elapsed_seconds: float
+    shards: int
+    reassigned_shards: int
+    battles_per_worker: dict[str, int] = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        battles = sum(aggregate.battles for aggregate in self.aggregates)
+        return (f"{battles} battles in {self.shards} shards on {len(self.battles_per_worker)} workers in "
+                f"{self.elapsed_seconds:.1f}s ({battles / max(self.elapsed_seconds, 1e-9):.0f} battles/s), "
+                f"{self.reassigned_shards} shards reassigned")
+
+class Coordinator:
+    """Hands seed ranged shards of one or more battle configs to workers connecting over TCP and merges their
+    aggregates. Shards of workers that disconnect are put back in the queue, and once the queue is empty idle workers
+    also get a speculative copy of shards running longer than slow_shard_factor times the median shard time; the
+    first result of a shard wins. Every shard yields the same aggregate wherever it runs, so the merge is exact.
+    A shard failing on a worker, or reassigned more than max_shard_reassignments times, fails the run."""
+    def __init__(self, battle_configs: list[BattleConfig], battle_counts: list[int], address: tuple[str, int] = ("127.0.0.1", 0),
+                 authkey: bytes | None = None, seed: int | None = None, blocks_per_shard: int = 1,
+                 block_size: int = BLOCK_SIZE, slow_shard_factor: float = 3.0, minimum_slow_shard_seconds: float = 5.0,
+                 max_shard_reassignments: int = MAX_SHARD_REASSIGNMENTS) -> None:
+        # Compile every config up front, so configs the batched engine cannot run fail here rather than on the workers.
+        for battle_config in battle_configs:
+            BatchedBattleEngine(battle_config, 0)
+        self.battle_configs = battle_configs
+        self.base_seed = new_base_seed() if seed is None else seed
+        self.block_size = block_size
+        self.shards = plan_shards(battle_counts, self.base_seed, blocks_per_shard, block_size)
+        self.pending = list(reversed(self.shards))
+        self.running: list[Assignment] = []
+        self.completed: dict[int, BattleAggregate] = {}
+        self.shard_seconds: list[float] = []
+        self.battles_per_worker: dict[str, int] = {}
+        self.reassigned_shards = 0
+        self.reassignments: dict[int, int] = {}
+        self.max_shard_reassignments = max_shard_reassignments
+        self.error: str | None = None
+        self.slow_shard_factor = slow_shard_factor
+        self.minimum_slow_shard_seconds = minimum_slow_shard_seconds
+        self.condition = threading.Condition()
+        # Workers may connect before run starts accepting, the default backlog of one would drop all but the first.
+        self.listener = Listener(address, backlog=CONNECTION_BACKLOG, authkey=require_authkey(authkey))
+        self.stopping = threading.Event()
+        self.acceptor = threading.Thread(target=self.accept_workers, daemon=True)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self.listener.address
+
+    @property
+    def finished(self) -> bool:
+        return len(self.completed) == len(self.shards)
+
+    @property
+    def done(self) -> bool:
+        return self.finished or self.error is not None
+
+    def fail(self, error: str) -> None:
+        with self.condition:
+            if self.error is None:
+                logger.error(error)
+                self.error = error
+            self.condition.notify_all()
+
+    def reassign(self, shard: Shard) -> bool:
+        """Counts a reassignment of the shard, failing the run instead once it has been reassigned too often."""
+        reassignments = self.reassignments.get(shard.shard_id, 0)
+        if reassignments >= self.max_shard_reassignments:
+            self.fail(f"Shard {shard.shard_id} was reassigned {reassignments} times without completing")
+            return False
+        self.reassignments[shard.shard_id] = reassignments + 1
+        self.reassigned_shards += 1
+        return True
+
+    def overdue_shard(self, worker: str, now: float) -> Assignment | None:
+        if not self.shard_seconds:
+            return None
+        limit = max(self.slow_shard_factor * statistics.median(self.shard_seconds), self.minimum_slow_shard_seconds)
+        running_ids = {assignment.shard.shard_id for assignment in self.running if assignment.speculative}
+        for assignment in self.running:
+            if (assignment.worker != worker and assignment.shard.shard_id not in running_ids
+                    and now - assignment.started > limit):
+                return assignment
+        return None
+
+    def next_shard(self, worker: str) -> Shard | None:
+        """Blocks until there is a shard for the worker, or returns None once every shard is complete or the run failed."""
+        with self.condition:
+            while not self.done:
+                now = time.monotonic()
+                if self.pending:
+                    shard = self.pending.pop()
+                    self.running.append(Assignment(shard, worker, now))
+                    return shard
+                overdue = self.overdue_shard(worker, now)
+                if overdue is not None and self.reassign(overdue.shard):
+                    logger.info(f"Shard {overdue.shard.shard_id} is slow on {overdue.worker}, also running it on {worker}")
+                    self.running.append(Assignment(overdue.shard, worker, now, speculative=True))
+                    return overdue.shard
+                self.condition.wait(timeout=0.5)
+            return None
+
+    def complete(self, worker: str, shard_id: int, aggregate: BattleAggregate) -> None:
+        with self.condition:
+            for assignment in [assignment for assignment in self.running if assignment.shard.shard_id == shard_id]:
+                self.running.remove(assignment)
+                if assignment.worker == worker:
+                    self.shard_seconds.append(time.monotonic() - assignment.started)
+            if shard_id not in self.completed:
+                self.completed[shard_id] = aggregate
+                self.battles_per_worker[worker] = self.battles_per_worker.get(worker, 0) + aggregate.battles
+            self.condition.notify_all()
+
+    def worker_lost(self, worker: str) -> None:
+        with self.condition:
+            for assignment in [assignment for assignment in self.running if assignment.worker == worker]:
+                self.running.remove(assignment)
+                shard_id = assignment.shard.shard_id
+                if (shard_id not in self.completed and all(other.shard.shard_id != shard_id for other in self.running)
+                        and self.reassign(assignment.shard)):
+                    logger.warning(f"Worker {worker} lost, reassigning shard {shard_id}")
+                    self.pending.append(assignment.shard)
+            self.condition.notify_all()
+
+    def serve_worker(self, connection: Connection, worker: str) -> None:
+        try:
+            connection.send(("configs", self.battle_configs, self.block_size))
+            while True:
+                message = connection.recv()
+                if message[0] == "result":
+                    _, shard_id, aggregate = message
+                    self.complete(worker, shard_id, aggregate)
+                elif message[0] == "error":
+                    _, shard_id, error = message
+                    self.fail(f"Shard {shard_id} failed on {worker}:\n{error}")
+                shard = self.next_shard(worker)
+                if shard is None:
+                    connection.send(("stop",))
+                    return
+                connection.send(("shard", shard))
+        except (EOFError, OSError) as error:
+            logger.debug(f"Connection to {worker} closed: {error!r}")
+            self.worker_lost(worker)
+        finally:
+            connection.close()
+
+    def accept_workers(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                connection = self.listener.accept()
+                worker = f"{self.listener.last_accepted[0]}:{self.listener.last_accepted[1]}"
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as error:
+                if not self.stopping.is_set():
+                    logger.warning(f"Rejected a connection: {error!r}")
+                continue
+            if self.stopping.is_set():
+                connection.close()
+                return
+            logger.info(f"Worker {worker} connected")
+            threading.Thread(target=self.serve_worker, args=(connection, worker), daemon=True).start()
+
+    def stop_accepting(self) -> None:
+        """Stops the accept thread before closing the listener, so it never touches a closed listener."""
+        self.stopping.set()
+        host, port = self.address
+        try:
+            # A bare TCP connection wakes the blocking accept, which then fails the handshake and sees the stop flag.
+            socket.create_connection(("127.0.0.1" if host in ("0.0.0.0", "") else host, port), timeout=1).close()
+        except OSError:
+            pass
+        self.acceptor.join(timeout=10)
+        if self.acceptor.is_alive():
+            logger.warning("Accept thread is stuck in a handshake, closing the listener anyway")
+        self.listener.close()
+
+    def run(self) -> DistributedResults:
+        start = time.perf_counter()
+        logger.info(f"Coordinating {len(self.shards)} shards with base seed {self.base_seed} on {self.address[0]}:{self.address[1]}")
+        self.acceptor.start()
+        with self.condition:
+            while not self.done:
+                self.condition.wait()
+        self.stop_accepting()
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        aggregates = [BattleAggregate() for _ in self.battle_configs]
+        for shard in self.shards:
+            aggregates[shard.config_index] = aggregates[shard.config_index].merge(self.completed[shard.shard_id])
+        results = DistributedResults(aggregates, self.base_seed, time.perf_counter() - start, len(self.shards),
+                                     self.reassigned_shards, dict(self.battles_per_worker))
+        logger.info(f"Distributed run finished: {results}")
+        return results
+
+def run_worker(address: tuple[str, int], authkey: bytes | None = None, retry_seconds: float = 10.0) -> int:
+    """Connects to a coordinator and simulates shards until it is told to stop. Returns the number of shards done."""
+    authkey = require_authkey(authkey)
+    deadline = time.monotonic() + retry_seconds
+    while True:
+        try:
+            connection = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+    shards_done = 0
+    with connection:
+        try:
+            _, battle_configs, block_size = connection.recv()
+            connection.send(("ready",))
+        except (EOFError, OSError):
+            logger.info("Coordinator closed the connection before handing out work")
+            return 0
+        while True:
+            try:
+                message = connection.recv()
+                if message[0] == "stop":
+                    break
+                shard = message[1]
+                try:
+                    aggregate = simulate_shard(battle_configs[shard.config_index], shard, block_size)
+                except Exception:
+                    # Report the failure rather than dying, or the coordinator would requeue the shard for the next worker.
+                    connection.send(("error", shard.shard_id, traceback.format_exc()))
+                    continue
+                connection.send(("result", shard.shard_id, aggregate))
+            except (EOFError, OSError):
+                # The coordinator finished without us, e.g. because another worker completed our shard first.
+                break
+            shards_done += 1
+    return shards_done
+
+def run_local_cluster(battle_configs: list[BattleConfig], battle_counts: list[int], workers: int = 4, seed: int | None = None,
+                      blocks_per_shard: int = 1, block_size: int = BLOCK_SIZE) -> DistributedResults:
+    """Runs a coordinator with local worker processes standing in for remote hosts."""
+    authkey = os.urandom(16)
+    coordinator = Coordinator(battle_configs, battle_counts, ("127.0.0.1", 0), authkey, seed, blocks_per_shard, block_size)
+    processes = [multiprocessing.Process(target=run_worker, args=(coordinator.address, authkey), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        return coordinator.run()
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+def main(arguments: list[str] | None = None) -> None:
+    from scenario_runner import DEFAULT_REGISTRY, read_scenarios
+    parser = argparse.ArgumentParser(description="Shard battle simulations over worker processes on several hosts. "
+                                                 f"The shared secret is read from ${AUTHKEY_VARIABLE}.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    coordinator_parser = subparsers.add_parser("coordinator", help="Split the scenarios of a JSON lines file into shards and serve them")
+    coordinator_parser.add_argument("scenarios", help="JSON lines scenario file, as read by scenario_runner")
+    coordinator_parser.add_argument("--address", default="127.0.0.1:6230",
+                                    help="host:port to listen on, e.g. 0.0.0.0:6230 to accept workers from other hosts")
+    coordinator_parser.add_argument("--seed", type=int, default=None)
+    coordinator_parser.add_argument("--blocks-per-shard", type=int, default=1)
+    local_parser = subparsers.add_parser("local", help="Run the scenarios on local worker processes")
+    local_parser.add_argument("scenarios")
+    local_parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1)
+    local_parser.add_argument("--seed", type=int, default=None)
+    local_parser.add_argument("--blocks-per-shard", type=int, default=1)
+    worker_parser = subparsers.add_parser("worker", help="Simulate shards for a coordinator")
+    worker_parser.add_argument("address", help="host:port of the coordinator")
+    parsed = parser.parse_args(arguments)
+
+    if parsed.command == "worker":
+        logger.info(f"Worker finished after {run_worker(parse_address(parsed.address), retry_seconds=60.0)} shards")
+        return
+    with open(parsed.scenarios, encoding="utf-8") as source:
+        scenarios = [scenario for _, scenario, error in read_scenarios(source) if error is None]
+    battle_configs = [DEFAULT_REGISTRY.battle_config(scenario) for scenario in scenarios]
+    battle_counts = [int(scenario.get("battles", 5000)) for scenario in scenarios]
+    if parsed.command == "local":
+        results = run_local_cluster(battle_configs, battle_counts, parsed.workers, parsed.seed, parsed.blocks_per_shard)
+    else:
+        results = Coordinator(battle_configs, battle_counts, parse_address(parsed.address), seed=parsed.seed,
+                              blocks_per_shard=parsed.blocks_per_shard).run()
+    for scenario, aggregate in zip(scenarios, results.aggregates):
+        logger.info(f"{scenario.get('name', '')}: {aggregate}")
+
+if __name__ == "__main__":
+    # Run through the importable module, so pickled shards and aggregates name distributed rather than __main__ and
+    # coordinators and workers started either way understand each other.
+    import distributed
+    distributed.main()
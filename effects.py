@@ -0,0 +1,173 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from loguru import logger
+import dice
+import uprising_units
+from battle_state import BattleStage, BattleState, TerrainType
+from result_rules import (RerollModification, ResultModificationTarget, damage_needed_to_kill_enemy, player_will_take_damage,
+                          return_zero_for_negative)
+
+# Declarative building blocks of roll and result modifications. Result effects describe what a modification does to
+# the rolled results of a round, so the batched engine can compile them into array operations; roll effects change
+# the dice pools before the roll and reach the fast engines through the per army code side tables. Both also have
+# object semantics, used by the reference Battle through DeclarativeResultModification and DeclarativeRollModification.
+
+PLAYER = "Player"
+ENEMY = "Enemy"
+BOTH_SIDES = (PLAYER, ENEMY)
+ALL_STAGES = (BattleStage.ARHCERY, BattleStage.CLASH)
+
+@dataclass(frozen=True, kw_only=True)
+class Effect:
+    stages: tuple[BattleStage, ...] = ALL_STAGES
+    terrains: tuple[TerrainType, ...] | None = None
+
+    def applies_on(self, terrain_type: TerrainType) -> bool:
+        return self.terrains is None or terrain_type in self.terrains
+
+    def applies(self, state: BattleState) -> bool:
+        return state.battle_stage in self.stages and self.applies_on(state.terrain.terrain_type)
+
+def side_roll_results(state: BattleState, side: str) -> dice.DiceRollResults:
+    return state.player_roll_results if side == PLAYER else state.enemy_roll_results
+
+def side_dice_pool(state: BattleState, side: str) -> dice.DicePool:
+    return (state.player_army if side == PLAYER else state.enemy_army).current_dice_pool
+
+class ResultEffect(Effect, ABC):
+    @abstractmethod
+    def apply(self, state: BattleState, memory: dict) -> None:
+        """Changes the roll results of the round. memory lives as long as the battle, for per combat limits."""
+
+class RollEffect(Effect, ABC):
+    @abstractmethod
+    def apply(self, state: BattleState) -> None:
+        pass
+
+@dataclass(frozen=True, kw_only=True)
+class AddBoltIfBlanks(ResultEffect):
+    """Adds bolts to a side that rolled at least one blank (Light of The Than)."""
+    target: str = PLAYER
+    bolts: int = 1
+
+    def apply(self, state: BattleState, memory: dict) -> None:
+        roll_results = side_roll_results(state, self.target)
+        if roll_results.blanks > 0:
+            logger.debug(f"{self.target} gains {self.bolts} bolts because of 1+ blanks")
+            roll_results.bolts += self.bolts
+
+@dataclass(frozen=True, kw_only=True)
+class RerollBlanks(ResultEffect):
+    """Rerolls up to count blank dice of each target side, the best dice by priority first (forest archery)."""
+    count: int
+    targets: tuple[str, ...] = BOTH_SIDES
+    priority: tuple[str, ...] = tuple(dice.STANDARD_DICE_PRIORITY)
+
+    def apply(self, state: BattleState, memory: dict) -> None:
+        for target in self.targets:
+            RerollModification(ResultModificationTarget(target), self.count, list(self.priority)).modify_result(state)
+
+@dataclass(frozen=True, kw_only=True)
+class IgnoreHighestSkullDie(ResultEffect):
+    """When the player would take damage, spends bolts to ignore the enemy die with the most skulls, up to
+    max_skulls (Druid Mountain Heart)."""
+    bolt_cost: int = 1
+    max_skulls: int = 3
+
+    def apply(self, state: BattleState, memory: dict) -> None:
+        if state.player_roll_results.bolts < self.bolt_cost or not player_will_take_damage(state):
+            return
+        for skull_number in range(self.max_skulls, 0, -1):
+            for die in state.enemy_army.current_dice_pool.dice:
+                if die.result.skulls == skull_number:
+                    logger.debug(f"Ignoring {skull_number} skulls of enemy die {die}")
+                    state.enemy_roll_results.skulls -= skull_number
+                    state.player_roll_results.bolts -= self.bolt_cost
+                    return
+
+@dataclass(frozen=True, kw_only=True)
+class TradeBoltForResource(ResultEffect):
+    """Trades surplus player bolts, those not needed to unblock damage for weakening the enemy, for resources. Every
+    unit of the given type trades once per combat and at most per_combat_limit trades happen per combat. While trades
+    are left the player shows mercy if at least mercy_units_left units survive the round (Harpooners Upgrade)."""
+    unit: type[uprising_units.Unit] = uprising_units.Harpooneers
+    per_combat_limit: int = 2
+    resource: int = 1
+    mercy_units_left: int | None = 3
+
+    def bolts_needed(self, state: BattleState) -> int:
+        player, enemy = state.player_roll_results, state.enemy_roll_results
+        damage_needed_for_weakening = damage_needed_to_kill_enemy(state) - 1
+        damage_that_can_be_unblocked = min(player.skulls, enemy.shields)
+        unblocked_shields = return_zero_for_negative(enemy.shields - player.skulls)
+        return min(damage_needed_for_weakening, damage_that_can_be_unblocked) + unblocked_shields
+
+    def apply(self, state: BattleState, memory: dict) -> None:
+        uses = memory.get("uses", 0)
+        player, enemy = state.player_roll_results, state.enemy_roll_results
+        if uses >= self.per_combat_limit:
+            state.player_army.mercy = False
+            return
+        player_losses = enemy.skulls - (player.shields - enemy.bolts)
+        state.player_army.mercy = (self.mercy_units_left is not None
+                                   and len(state.player_army.units) - player_losses >= self.mercy_units_left)
+        if player.bolts <= 0:
+            return
+        bolt_surplus = player.bolts - return_zero_for_negative(self.bolts_needed(state))
+        for _ in range(max(bolt_surplus, 0)):
+            trader = next((unit for unit in state.player_army.units
+                           if type(unit) is self.unit and not getattr(unit, "food_generated_this_combat", False)), None)
+            if trader is None or uses >= self.per_combat_limit:
+                break
+            uses += 1
+            trader.food_generated_this_combat = True
+            state.battle_results.player_net_resources += self.resource
+            player.bolts -= 1
+            logger.debug(f"{self.unit.name} traded a bolt for {self.resource} resources")
+        memory["uses"] = uses
+
+@dataclass(frozen=True, kw_only=True)
+class ConvertDice(RollEffect):
+    """Replaces every die of one colour in the pools of the target sides with a die of another colour."""
+    from_die: str
+    to_die: str
+    targets: tuple[str, ...] = BOTH_SIDES
+
+    def apply(self, state: BattleState) -> None:
+        for target in self.targets:
+            pool = side_dice_pool(state, target)
+            for _ in range(sum(die.name == self.from_die for die in pool.dice)):
+                pool.remove_die(self.from_die)
+                pool.add_die(dice.DIE_TYPES[self.to_die]())
+
+@dataclass(frozen=True, kw_only=True)
+class KeepBestDie(RollEffect):
+    """Removes dice from the pools of the target sides while more than one is left, one die of every colour in loss
+    priority per pass like the mountain terrain. A pass runs to its end, so a pool of several colours can lose all its
+    dice."""
+    targets: tuple[str, ...] = BOTH_SIDES
+
+    def apply(self, state: BattleState) -> None:
+        for target in self.targets:
+            pool = side_dice_pool(state, target)
+            while len(pool.dice) > 1:
+                for die_name in dice.STANDARD_LOSS_PRIORITY:
+                    pool.remove_die(die_name)
+
+@dataclass(frozen=True, kw_only=True)
+class AddUnitDice(RollEffect):
+    """Adds dice like the archery or clash dice of every unit whose type contains unit_type to the pools of the target
+    sides. New dice are added, so a die already in the pool is not rolled twice."""
+    unit_type: str
+    dice_kind: BattleStage = BattleStage.CLASH
+    targets: tuple[str, ...] = BOTH_SIDES
+
+    def apply(self, state: BattleState) -> None:
+        for target in self.targets:
+            side_army = state.player_army if target == PLAYER else state.enemy_army
+            for unit in side_army.units:
+                if self.unit_type in unit.unit_type:
+                    unit_dice = unit.clash_dice if self.dice_kind == BattleStage.CLASH else unit.archery_dice
+                    for die in unit_dice:
+                        side_army.current_dice_pool.add_die(type(die)())
@@ -0,0 +1,251 @@
+from __future__ import annotations
+import argparse
+import math
+import random
+import time
+from dataclasses import dataclass
+from itertools import product
+from typing import Callable
+import numpy as np
+import pandas as pd
+from loguru import logger
+import uprising_units
+from batched_battle import BatchedBattleEngine, BatchedBattleResults
+from battle_orchestrator import BattleConfig, BattleOrchestrator, battle_seed
+from battle_state import OverallBattleResult, OUTCOME_CODES, TerrainType
+from matchup_index import MatchupSpace
+from modification_subsets import SubsetBattleEngine
+
+CandidateEngine = Callable[[BattleConfig, int, int], BatchedBattleResults]
+
+CATALOG_COMPOSITIONS: list[tuple[type[uprising_units.Unit], ...]] = [
+    (uprising_units.Stoneshell, uprising_units.CrabRider, uprising_units.CrabRider, uprising_units.Harpooneers, uprising_units.Harpooneers),
+    (uprising_units.ReefKing, uprising_units.Stoneshell, uprising_units.CrabRider, uprising_units.Harpooneers),
+]
+# Bins of the net resources chi-square test hold at least this many battles of both runs together.
+MINIMUM_BIN_COUNT = 20
+
+@dataclass
+class Scenario:
+    name: str
+    battle_config: BattleConfig
+
+def scenario_catalog(compositions: list[tuple[type[uprising_units.Unit], ...]] | None = None) -> list[Scenario]:
+    """Every terrain, garrison level and modifier set of the default matchup space, for each army composition."""
+    space = MatchupSpace()
+    scenarios = []
+    for composition, garrison_level, terrain, modifier_set in product(compositions or CATALOG_COMPOSITIONS, space.garrison_levels,
+                                                                      space.terrains, space.modifier_sets):
+        name = f"{'+'.join(unit.name for unit in composition)} vs garrison {garrison_level}, {terrain}, {modifier_set.name}"
+        scenarios.append(Scenario(name, space.battle_config(composition, garrison_level, terrain, modifier_set)))
+    return scenarios
+
+def run_batched(battle_config: BattleConfig, battle_count: int, seed: int) -> BatchedBattleResults:
+    return BatchedBattleEngine(battle_config, seed).run(battle_count)
+
+def run_subsets(battle_config: BattleConfig, battle_count: int, seed: int) -> BatchedBattleResults:
+    """The variant with every modification of a SubsetBattleEngine run."""
+    engine = SubsetBattleEngine(battle_config, seed)
+    results = engine.run_chunk(battle_count)
+    rows = np.arange(battle_count) * engine.variant_count + engine.variant_count - 1
+    return BatchedBattleResults(results.outcome[rows], results.net_resources[rows], results.rounds[rows])
+
+CANDIDATE_ENGINES: dict[str, CandidateEngine] = {"batched": run_batched, "subsets": run_subsets}
+
+def run_reference(battle_config: BattleConfig, battle_count: int, seed: int) -> BatchedBattleResults:
+    """Battle.perform_battle on a single thread, one generator per battle as in conduct_battles."""
+    orchestrator = BattleOrchestrator(battle_config)
+    battle_results = [orchestrator.execute_battle(random.Random(battle_seed(seed, battle_index))) for battle_index in range(battle_count)]
+    return BatchedBattleResults(np.array([OUTCOME_CODES[battle_result.overall_result] for battle_result in battle_results], np.int8),
+                                np.array([battle_result.player_net_resources for battle_result in battle_results], np.int32),
+                                np.array([battle_result.rounds for battle_result in battle_results], np.int16))
+
+def chi_square_survival(statistic: float, degrees_of_freedom: int) -> float:
+    """P(X >= statistic) for a chi-square distribution with an integer number of degrees of freedom."""
+    if degrees_of_freedom <= 0:
+        return 1.0
+    if statistic <= 0:
+        return 1.0
+    half = statistic / 2
+    if degrees_of_freedom % 2 == 0:
+        term = math.exp(-half)
+        total = term
+        for i in range(1, degrees_of_freedom // 2):
+            term *= half / i
+            total += term
+    else:
+        total = math.erfc(math.sqrt(half))
+        term = math.sqrt(2 * statistic / math.pi) * math.exp(-half)
+        for i in range(1, (degrees_of_freedom + 1) // 2):
+            total += term
+            term *= statistic / (2 * i + 1)
+    return min(max(total, 0.0), 1.0)
+
+def kolmogorov_survival(statistic: float) -> float:
+    """Asymptotic P(K >= statistic) of the Kolmogorov distribution."""
+    if statistic < 0.2:
+        return 1.0
+    total = sum((-1) ** (k - 1) * math.exp(-2 * k * k * statistic * statistic) for k in range(1, 101))
+    return min(max(2 * total, 0.0), 1.0)
+
+def chi_square_homogeneity(counts: np.ndarray, other_counts: np.ndarray) -> float:
+    """p-value of the two-sample chi-square test that both count vectors come from the same distribution."""
+    keep = (counts + other_counts) > 0
+    counts, other_counts = counts[keep].astype(float), other_counts[keep].astype(float)
+    total, other_total = counts.sum(), other_counts.sum()
+    if len(counts) < 2 or total == 0 or other_total == 0:
+        return 1.0
+    statistic = float(((counts * math.sqrt(other_total / total) - other_counts * math.sqrt(total / other_total)) ** 2
+                       / (counts + other_counts)).sum())
+    return chi_square_survival(statistic, len(counts) - 1)
+
+def pooled_bins(values: np.ndarray, other_values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Counts of both samples over adjacent integer values, pooled until every bin holds MINIMUM_BIN_COUNT battles."""
+    low = int(min(values.min(), other_values.min()))
+    counts = np.bincount(values - low)
+    other_counts = np.bincount(other_values - low)
+    size = max(len(counts), len(other_counts))
+    counts, other_counts = np.pad(counts, (0, size - len(counts))), np.pad(other_counts, (0, size - len(other_counts)))
+    edges = [0]
+    running = 0
+    for value, count in enumerate(counts + other_counts):
+        running += count
+        if running >= MINIMUM_BIN_COUNT:
+            edges.append(value + 1)
+            running = 0
+    if len(edges) > 1:
+        edges[-1] = size
+    else:
+        edges.append(size)
+    return np.add.reduceat(counts, edges[:-1]), np.add.reduceat(other_counts, edges[:-1])
+
+def kolmogorov_smirnov(values: np.ndarray, other_values: np.ndarray) -> float:
+    """p-value of the two-sample Kolmogorov-Smirnov test. Conservative for discrete values like these."""
+    support = np.union1d(values, other_values)
+    cdf = np.searchsorted(np.sort(values), support, side="right") / len(values)
+    other_cdf = np.searchsorted(np.sort(other_values), support, side="right") / len(other_values)
+    distance = float(np.abs(cdf - other_cdf).max())
+    effective = math.sqrt(len(values) * len(other_values) / (len(values) + len(other_values)))
+    return kolmogorov_survival((effective + 0.12 + 0.11 / effective) * distance)
+
+@dataclass
+class ScenarioComparison:
+    scenario: str
+    reference_victory: float
+    candidate_victory: float
+    reference_net_resources: float
+    candidate_net_resources: float
+    outcome_p: float
+    net_resources_chi_square_p: float
+    net_resources_ks_p: float
+    rounds_ks_p: float
+    reference_seconds: float
+    candidate_seconds: float
+
+    @property
+    def p_values(self) -> list[float]:
+        return [self.outcome_p, self.net_resources_chi_square_p, self.net_resources_ks_p, self.rounds_ks_p]
+
+    @property
+    def speedup(self) -> float:
+        return self.reference_seconds / max(self.candidate_seconds, 1e-9)
+
+def compare_scenario(scenario: Scenario, candidate: CandidateEngine, battle_count: int, seed: int) -> ScenarioComparison:
+    start = time.perf_counter()
+    reference = run_reference(scenario.battle_config, battle_count, seed)
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    results = candidate(scenario.battle_config, battle_count, seed)
+    candidate_seconds = time.perf_counter() - start
+    victory = OUTCOME_CODES[OverallBattleResult.player_victory]
+    outcome_p = chi_square_homogeneity(np.bincount(reference.outcome, minlength=len(OUTCOME_CODES)),
+                                       np.bincount(results.outcome, minlength=len(OUTCOME_CODES)))
+    net_resources_chi_square_p = chi_square_homogeneity(*pooled_bins(reference.net_resources.astype(np.int64),
+                                                                     results.net_resources.astype(np.int64)))
+    return ScenarioComparison(scenario.name, float((reference.outcome == victory).mean()), float((results.outcome == victory).mean()),
+                              float(reference.net_resources.mean()), float(results.net_resources.mean()), outcome_p,
+                              net_resources_chi_square_p, kolmogorov_smirnov(reference.net_resources, results.net_resources),
+                              kolmogorov_smirnov(reference.rounds, results.rounds), reference_seconds, candidate_seconds)
+
+@dataclass
+class EquivalenceReport:
+    candidate: str
+    battles: int
+    significance: float
+    comparisons: list[ScenarioComparison]
+
+    @property
+    def threshold(self) -> float:
+        """Bonferroni corrected significance of a single test, so a correct engine fails any test with probability
+        at most the significance over the whole catalog."""
+        return self.significance / max(sum(len(comparison.p_values) for comparison in self.comparisons), 1)
+
+    def divergent(self) -> list[ScenarioComparison]:
+        return [comparison for comparison in self.comparisons if min(comparison.p_values) < self.threshold]
+
+    def table(self) -> pd.DataFrame:
+        return pd.DataFrame([{"scenario": comparison.scenario,
+                              "reference_victory": comparison.reference_victory,
+                              "candidate_victory": comparison.candidate_victory,
+                              "reference_net_resources": comparison.reference_net_resources,
+                              "candidate_net_resources": comparison.candidate_net_resources,
+                              "outcome_p": comparison.outcome_p,
+                              "net_resources_chi_square_p": comparison.net_resources_chi_square_p,
+                              "net_resources_ks_p": comparison.net_resources_ks_p,
+                              "rounds_ks_p": comparison.rounds_ks_p,
+                              "speedup": comparison.speedup,
+                              "divergent": min(comparison.p_values) < self.threshold} for comparison in self.comparisons])
+
+    @property
+    def speedup(self) -> float:
+        return (sum(comparison.reference_seconds for comparison in self.comparisons)
+                / max(sum(comparison.candidate_seconds for comparison in self.comparisons), 1e-9))
+
+    def __str__(self) -> str:
+        divergent = self.divergent()
+        lines = [f"{self.candidate}: {len(self.comparisons)} scenarios of {self.battles} battles, overall speedup {self.speedup:.1f}x, "
+                 f"{len(divergent)} divergent at significance {self.significance} (per test {self.threshold:.2g})"]
+        lines += [f"  DIVERGENT {comparison.scenario}: p-values {', '.join(f'{p:.2g}' for p in comparison.p_values)}, "
+                  f"victory {comparison.reference_victory:.4f} vs {comparison.candidate_victory:.4f}, "
+                  f"net resources {comparison.reference_net_resources:.3f} vs {comparison.candidate_net_resources:.3f}"
+                  for comparison in divergent]
+        return "\n".join(lines)
+
+def check_equivalence(candidate: str | CandidateEngine = "batched", scenarios: list[Scenario] | None = None, battles: int = 4000,
+                      seed: int = 0, significance: float = 0.01) -> EquivalenceReport:
+    """Runs every scenario through Battle.perform_battle and the candidate engine and tests that outcomes, net
+    resources and rounds follow the same distributions."""
+    name = candidate if isinstance(candidate, str) else getattr(candidate, "__name__", "candidate")
+    engine = CANDIDATE_ENGINES[candidate] if isinstance(candidate, str) else candidate
+    scenarios = scenarios if scenarios is not None else scenario_catalog()
+    comparisons = []
+    for index, scenario in enumerate(scenarios):
+        comparison = compare_scenario(scenario, engine, battles, seed + index)
+        logger.debug(f"{scenario.name}: minimum p-value {min(comparison.p_values):.3g}, speedup {comparison.speedup:.1f}x")
+        comparisons.append(comparison)
+    report = EquivalenceReport(name, battles, significance, comparisons)
+    logger.info(f"Equivalence of {name}: {len(report.divergent())} of {len(comparisons)} scenarios divergent, "
+                f"speedup {report.speedup:.1f}x")
+    return report
+
+def main(arguments: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Test fast engines for statistical equivalence with the reference Battle.")
+    parser.add_argument("--candidate", choices=list(CANDIDATE_ENGINES), default="batched")
+    parser.add_argument("--battles", type=int, default=4000, help="Battles per scenario and engine")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--significance", type=float, default=0.01)
+    parser.add_argument("--terrain", choices=[str(terrain) for terrain in TerrainType], action="append",
+                        help="Only scenarios on these terrains")
+    parser.add_argument("--csv", help="Write the per scenario table to this file")
+    options = parser.parse_args(arguments)
+    scenarios = scenario_catalog()
+    if options.terrain:
+        scenarios = [scenario for scenario in scenarios if str(scenario.battle_config.terrain.terrain_type) in options.terrain]
+    report = check_equivalence(options.candidate, scenarios, options.battles, options.seed, options.significance)
+    if options.csv:
+        report.table().to_csv(options.csv, index=False)
+    logger.info(f"{report}")
+    raise SystemExit(1 if report.divergent() else 0)
+
+if __name__ == "__main__":
+    main()
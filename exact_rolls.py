@@ -0,0 +1,204 @@
+from __future__ import annotations
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from fractions import Fraction
+from functools import cache
+from itertools import combinations_with_replacement, product
+from math import factorial, prod
+from typing import Callable, Iterable
+import numpy as np
+import dice
+
+# A roll summary is (skulls, shields, bolts, stars, blanks, highest_skulls) where highest_skulls is the largest
+# skull count on a single die, as used by DruidMountainHeart.
+RollSummary = tuple[int, int, int, int, int, int]
+DieFace = tuple[int, int, int, int, int]
+SKULLS, SHIELDS, BOLTS, STARS, BLANKS, HIGHEST_SKULLS = range(6)
+
+@cache
+def die_face_distribution(die_name: str) -> tuple[tuple[DieFace, float], ...]:
+    faces = Counter((face.skulls, face.shields, face.bolts, face.stars, face.blanks)
+                    for face in dice.DIE_TYPES[die_name]().die_outcome_distribution.distribution)
+    return tuple((face, count / 6) for face, count in faces.items())
+
+def multiset_outcomes(die_name: str, count: int) -> list[tuple[tuple[DieFace, ...], float]]:
+    faces = die_face_distribution(die_name)
+    outcomes = []
+    for combination in combinations_with_replacement(range(len(faces)), count):
+        multiplicity = Counter(combination).values()
+        permutations = factorial(count) // prod(factorial(number) for number in multiplicity)
+        probability = permutations * prod(faces[index][1] for index in combination)
+        outcomes.append((tuple(faces[index][0] for index in combination), probability))
+    return outcomes
+
+def summarize(faces: list[DieFace]) -> RollSummary:
+    totals = [sum(face[field] for face in faces) for field in range(5)]
+    highest_skulls = max((face[SKULLS] for face in faces if face[SKULLS] <= 3), default=0)
+    return (*totals, highest_skulls)
+
+@cache
+def pool_outcome_distribution(dice_counts: tuple[tuple[str, int], ...], reroll_count: int = 0,
+                              bolts_if_blanks: int = 0) -> dict[RollSummary, float]:
+    """Exact distribution of roll summaries for a pool given as (die name, count) pairs.
+
+    With a reroll count, blank dice are rerolled once each in STANDARD_DICE_PRIORITY order, mirroring
+    RerollModification. Rolls showing a blank before the rerolls gain bolts_if_blanks bolts, as LightOfTheThan does
+    when it is applied ahead of them."""
+    per_type = [[(die_name, outcome) for outcome in multiset_outcomes(die_name, count)]
+                for die_name, count in dice_counts if count > 0]
+    distribution: dict[RollSummary, float] = defaultdict(float)
+    for combination in product(*per_type):
+        faces = [(die_name, face) for die_name, (type_faces, _) in combination for face in type_faces]
+        probability = prod(probability for _, (_, probability) in combination)
+        bonus_bolts = bolts_if_blanks if any(face[BLANKS] for _, face in faces) else 0
+        rerolled = []
+        if reroll_count > 0 and any(face[BLANKS] for _, face in faces):
+            for die_name in dice.STANDARD_DICE_PRIORITY:
+                for index, (name, face) in enumerate(faces):
+                    if len(rerolled) < reroll_count and name == die_name and face[BLANKS] == 1:
+                        rerolled.append(index)
+        kept = [face for index, (_, face) in enumerate(faces) if index not in rerolled]
+        reroll_distributions = [die_face_distribution(faces[index][0]) for index in rerolled]
+        for new_faces in product(*reroll_distributions):
+            new_probability = probability * prod(reroll_probability for _, reroll_probability in new_faces)
+            summary = summarize(kept + [face for face, _ in new_faces])
+            if bonus_bolts:
+                summary = summary[:BOLTS] + (summary[BOLTS] + bonus_bolts,) + summary[BOLTS + 1:]
+            distribution[summary] += new_probability
+    return dict(distribution)
+
+FACE_FIELDS = ("skulls", "shields", "bolts", "stars", "blanks")
+DiceCounts = tuple[tuple[str, int], ...]
+
+@cache
+def die_polynomial(die_name: str) -> np.ndarray:
+    """Generating function of one die: coefficient [skulls, shields, bolts, stars, blanks] counts the faces showing them."""
+    faces = [(face.skulls, face.shields, face.bolts, face.stars, face.blanks)
+             for face in dice.DIE_TYPES[die_name]().die_outcome_distribution.distribution]
+    polynomial = np.zeros(tuple(max(face[field] for face in faces) + 1 for field in range(len(FACE_FIELDS))), dtype=np.int64)
+    for face in faces:
+        polynomial[face] += 1
+    return polynomial
+
+def multiply(polynomial: np.ndarray, die: np.ndarray, dtype) -> np.ndarray:
+    product_polynomial = np.zeros(tuple(size + die_size - 1 for size, die_size in zip(polynomial.shape, die.shape)), dtype=dtype)
+    for exponents in zip(*np.nonzero(die)):
+        product_polynomial[tuple(slice(exponent, exponent + size) for exponent, size in zip(exponents, polynomial.shape))] += \
+            polynomial * int(die[exponents])
+    return product_polynomial
+
+@cache
+def pool_polynomial(dice_counts: DiceCounts) -> np.ndarray:
+    """Product of the die polynomials of a pool given as sorted (die name, count) pairs. Pools are built one die at a
+    time from their memoized prefixes, so related pools share most of the work."""
+    if not dice_counts:
+        return np.ones((1,) * len(FACE_FIELDS), dtype=np.int64)
+    *rest, (die_name, count) = dice_counts
+    prefix = tuple(rest) + (((die_name, count - 1),) if count > 1 else ())
+    # Counts add up to 6 ** dice, which outgrows int64 for pools of more than 24 dice.
+    dtype = np.int64 if 6 ** sum(number for _, number in dice_counts) < 2 ** 63 else object
+    polynomial = multiply(pool_polynomial(prefix).astype(dtype), die_polynomial(die_name), dtype)
+    polynomial.flags.writeable = False
+    return polynomial
+
+@dataclass(frozen=True, eq=False)
+class PoolDistribution:
+    """Exact joint distribution of the totals of a dice pool roll.
+
+    counts[skulls, shields, bolts, stars, blanks] is the number of the 6 ** dice equally likely rolls with those totals.
+    Queries take totals by field name and return exact fractions, e.g. at_least(skulls=3) or probability(bolts=0)."""
+    dice_counts: DiceCounts
+    counts: np.ndarray
+
+    @property
+    def outcomes(self) -> int:
+        return 6 ** sum(count for _, count in self.dice_counts)
+
+    def axis(self, field: str) -> int:
+        if field not in FACE_FIELDS:
+            raise ValueError(f"Unknown field {field!r}. Valid options are: {', '.join(FACE_FIELDS)}")
+        return FACE_FIELDS.index(field)
+
+    def count_where(self, bounds: dict[str, tuple[int, int | None]]) -> int:
+        selection = [slice(None)] * len(FACE_FIELDS)
+        for field, (low, high) in bounds.items():
+            selection[self.axis(field)] = slice(max(low, 0), None if high is None else max(high + 1, 0))
+        return int(self.counts[tuple(selection)].sum())
+
+    def probability(self, **totals: int) -> Fraction:
+        """P(every given field has exactly the given total)."""
+        return Fraction(self.count_where({field: (total, total) for field, total in totals.items()}), self.outcomes)
+
+    def at_least(self, **minimums: int) -> Fraction:
+        return Fraction(self.count_where({field: (minimum, None) for field, minimum in minimums.items()}), self.outcomes)
+
+    def at_most(self, **maximums: int) -> Fraction:
+        return Fraction(self.count_where({field: (0, maximum) for field, maximum in maximums.items()}), self.outcomes)
+
+    def joint(self, *fields: str) -> np.ndarray:
+        """Joint probabilities of the given fields, indexed by their totals in the given order."""
+        axes = [self.axis(field) for field in fields]
+        other_axes = tuple(axis for axis in range(len(FACE_FIELDS)) if axis not in axes)
+        counts = self.counts.sum(axis=other_axes)
+        kept_axes = [axis for axis in range(len(FACE_FIELDS)) if axis in axes]
+        return np.transpose(counts, [kept_axes.index(axis) for axis in axes]).astype(float) / self.outcomes
+
+    def marginal(self, field: str) -> np.ndarray:
+        return self.joint(field)
+
+    def expectation(self, quantity: str | Callable[..., np.ndarray]) -> Fraction:
+        """Expected total of a field, or of an integer function of the totals given as skulls=..., shields=... arrays."""
+        if isinstance(quantity, str):
+            counts = self.counts.sum(axis=tuple(axis for axis in range(len(FACE_FIELDS)) if axis != self.axis(quantity)))
+            return Fraction(int((counts * np.arange(len(counts))).sum()), self.outcomes)
+        values = quantity(**dict(zip(FACE_FIELDS, np.indices(self.counts.shape))))
+        return Fraction(int((self.counts * np.asarray(values, dtype=np.int64)).sum()), self.outcomes)
+
+    def attack_totals(self) -> np.ndarray:
+        """Counts by (skulls + bolts, shields), the totals that decide the losses in a round."""
+        skulls_and_bolts = self.counts.sum(axis=(3, 4))
+        totals = np.zeros((skulls_and_bolts.shape[0] + skulls_and_bolts.shape[2] - 1, skulls_and_bolts.shape[1]),
+                          dtype=skulls_and_bolts.dtype)
+        for bolts in range(skulls_and_bolts.shape[2]):
+            totals[bolts:bolts + skulls_and_bolts.shape[0]] += skulls_and_bolts[:, :, bolts]
+        return totals
+
+@cache
+def pool_distribution(dice_counts: DiceCounts) -> PoolDistribution:
+    return PoolDistribution(dice_counts, pool_polynomial(dice_counts))
+
+def distribution_of_dice(pool_dice: Iterable[dice.Die]) -> PoolDistribution:
+    return pool_distribution(tuple(sorted(Counter(die.name for die in pool_dice).items())))
+
+def damage_distribution(attacker: PoolDistribution, defender: PoolDistribution) -> dict[int, Fraction]:
+    """Losses the attacker inflicts on the defender in a round, skulls - (shields - bolts) as in
+    Battle.resolve_roll_result_effects, before any result modification."""
+    attack = attacker.attack_totals().sum(axis=1)
+    shields = defender.attack_totals().sum(axis=0)
+    # Convolving with the reversed shield counts gives the counts of attack - shields, offset by the highest shield total.
+    differences = np.convolve(attack.astype(object), shields[::-1].astype(object))
+    offset = len(shields) - 1
+    losses: dict[int, Fraction] = defaultdict(Fraction)
+    for difference, count in enumerate(differences):
+        if count:
+            losses[max(difference - offset, 0)] += Fraction(int(count), attacker.outcomes * defender.outcomes)
+    return dict(sorted(losses.items()))
+
+def net_damage_distribution(pool: PoolDistribution, opponent: PoolDistribution) -> dict[int, Fraction]:
+    """Losses inflicted minus losses taken when both pools are rolled against each other in a round."""
+    totals, opponent_totals = pool.attack_totals(), opponent.attack_totals()
+    attack, shields = np.indices(totals.shape)
+    opponent_attack, opponent_shields = np.indices(opponent_totals.shape)
+    inflicted = np.maximum(attack[:, :, None, None] - opponent_shields[None, None], 0)
+    taken = np.maximum(opponent_attack[None, None] - shields[:, :, None, None], 0)
+    weights = totals.astype(object)[:, :, None, None] * opponent_totals.astype(object)[None, None]
+    net_damage: dict[int, Fraction] = defaultdict(Fraction)
+    for difference, count in zip((inflicted - taken).ravel().tolist(), weights.ravel().tolist()):
+        if count:
+            net_damage[difference] += Fraction(count, pool.outcomes * opponent.outcomes)
+    return dict(sorted(net_damage.items()))
+
+def expected_net_damage(pool: PoolDistribution, opponent: PoolDistribution) -> Fraction:
+    inflicted = sum(losses * probability for losses, probability in damage_distribution(pool, opponent).items())
+    taken = sum(losses * probability for losses, probability in damage_distribution(opponent, pool).items())
+    return Fraction(inflicted - taken)
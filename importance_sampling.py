@@ -0,0 +1,105 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+import numpy as np
+from loguru import logger
+from batched_battle import BLANKS, BOLTS, FACE_TABLE, SHIELDS, SKULLS, STAGES, BatchedBattleEngine, SideTables
+from battle_state import BattleStage, OverallBattleResult, OUTCOME_CODES
+
+if TYPE_CHECKING:
+    from battle_orchestrator import BattleConfig
+
+PILOT_STRENGTHS = (0.0, 0.25, 0.5, 0.75, 1.0)
+MINIMUM_PILOT_EFFECTIVE_FRACTION = 0.05
+
+@dataclass(frozen=True)
+class FaceTilt:
+    """Exponential tilt of the die faces: a face is reweighted by exp(coefficients . face) for its side."""
+    player: tuple[float, float, float, float, float]
+    enemy: tuple[float, float, float, float, float]
+
+    @classmethod
+    def towards(cls, result: OverallBattleResult, strength: tuple[float, float]) -> "FaceTilt":
+        """Tilt making the result more likely, with separate strengths for the player and the enemy dice."""
+        doing_well = np.zeros(len(FACE_TABLE[0, 0]))
+        doing_well[[SKULLS, SHIELDS, BOLTS]] = 1.0
+        doing_well[BLANKS] = -1.0
+        direction = 1.0 if result == OverallBattleResult.player_victory else -1.0
+        player_strength, enemy_strength = strength
+        return cls(tuple(direction * player_strength * doing_well), tuple(-direction * enemy_strength * doing_well))
+
+    def face_probabilities(self, player_side: bool) -> np.ndarray:
+        coefficients = np.array(self.player if player_side else self.enemy)
+        weights = np.exp(FACE_TABLE @ coefficients)
+        return weights / weights.sum(axis=1, keepdims=True)
+
+@dataclass
+class ImportanceSamplingEstimate:
+    result: OverallBattleResult
+    probability: float
+    standard_error: float
+    strength: tuple[float, float]
+    effective_sample_size: float
+    battles: int
+
+class TiltedBattleEngine(BatchedBattleEngine):
+    """Rolls the dice from tilted face distributions and keeps the log likelihood ratio of every battle.
+
+    Reroll faces are drawn untilted, so only the dice slots in use contribute to the likelihood ratio."""
+    def __init__(self, battle_config: BattleConfig, tilt: FaceTilt, seed: int | None = None) -> None:
+        super().__init__(battle_config, seed)
+        self.face_cdfs = {player_side: np.cumsum(tilt.face_probabilities(player_side), axis=1) for player_side in (True, False)}
+        self.log_ratios = {player_side: np.log(1 / 6) - np.log(tilt.face_probabilities(player_side)) for player_side in (True, False)}
+        self.log_weights = np.zeros(0)
+
+    def draw_faces(self, rows: np.ndarray, tables: SideTables, stage: BattleStage, width: int) -> np.ndarray:
+        faces = super().draw_faces(rows, tables, stage, width)
+        player_side = tables is self.player_tables
+        types = tables.slot_types[STAGES.index(stage)]
+        uniforms = self.rng.random((len(rows), len(types)))
+        tilted = (uniforms[..., None] > self.face_cdfs[player_side][types][None, :, :-1]).sum(axis=2)
+        faces[:, :len(types)] = tilted
+        active = self.active_slots(rows, tables, stage)
+        self.log_weights[rows] += (self.log_ratios[player_side][types[None, :], tilted] * active).sum(axis=1)
+        return faces
+
+    def run_chunk(self, battle_count: int):
+        self.log_weights = np.zeros(battle_count)
+        return super().run_chunk(battle_count)
+
+def estimate_with_tilt(battle_config: BattleConfig, result: OverallBattleResult, strength: tuple[float, float],
+                       number_of_iterations: int, seed: int | None = None) -> ImportanceSamplingEstimate:
+    engine = TiltedBattleEngine(battle_config, FaceTilt.towards(result, strength), seed)
+    results = engine.run_chunk(number_of_iterations)
+    weights = np.exp(engine.log_weights)
+    weighted_hits = weights * (results.outcome == OUTCOME_CODES[result])
+    effective_sample_size = weights.sum() ** 2 / (weights ** 2).sum()
+    return ImportanceSamplingEstimate(result, float(weighted_hits.mean()), float(weighted_hits.std(ddof=1) / np.sqrt(number_of_iterations)),
+                                      strength, float(effective_sample_size), number_of_iterations)
+
+def importance_sample(battle_config: BattleConfig, result: OverallBattleResult = OverallBattleResult.player_defeat,
+                      number_of_iterations: int = 100_000, strength: tuple[float, float] | None = None, pilot_iterations: int = 10_000,
+                      seed: int | None = None) -> ImportanceSamplingEstimate:
+    """Unbiased estimate of the probability of a (rare) battle result from dice tilted towards it.
+
+    Without an explicit (player, enemy) strength, short pilot runs pick the tilt with the smallest relative standard
+    error, first over the enemy strength and then over the player strength. Pilots whose weights collapse onto a few
+    battles are skipped, as their standard error cannot be trusted."""
+    rng = np.random.default_rng(seed)
+    if strength is None:
+        strength = (0.0, 0.0)
+        for side in (1, 0):
+            candidates = [tuple(pilot_strength if index == side else strength[index] for index in range(2))
+                          for pilot_strength in PILOT_STRENGTHS]
+            pilots = [estimate_with_tilt(battle_config, result, candidate, pilot_iterations, int(rng.integers(2 ** 63)))
+                      for candidate in candidates]
+            useful = [pilot for pilot in pilots if pilot.probability > 0
+                      and pilot.effective_sample_size >= MINIMUM_PILOT_EFFECTIVE_FRACTION * pilot_iterations]
+            if not useful:
+                logger.warning(f"No pilot run gave a usable estimate of {result}, keeping tilt strength {strength}")
+                continue
+            strength = min(useful, key=lambda pilot: pilot.standard_error / pilot.probability).strength
+        logger.debug(f"Pilot runs chose tilt strength {strength}")
+    estimate = estimate_with_tilt(battle_config, result, strength, number_of_iterations, int(rng.integers(2 ** 63)))
+    logger.info(f"P({result}) = {estimate.probability:.3e} +/- {estimate.standard_error:.1e} with tilt strength {strength}")
+    return estimate
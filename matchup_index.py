@@ -0,0 +1,171 @@
+from __future__ import annotations
+import hashlib
+import inspect
+import json
+from dataclasses import dataclass, field
+from functools import cache
+from itertools import combinations_with_replacement, product
+from pathlib import Path
+import numpy as np
+from loguru import logger
+import army
+import battle
+import batched_battle
+import battle_state
+import dice
+import effects
+import result_rules
+import uprising_units
+from battle_orchestrator import ArmyConfig, BattleConfig
+from battle_state import OverallBattleResult, Terrain, TerrainType
+from result_modifier import DruidMountainHeart, HarpoonersUpgrade, LightOfTheThan, ResultModification, TerrainResultModification
+from roll_modifier import RollModification, TerrainRollModification
+
+CELL_DTYPE = np.dtype([("victory", np.float32),
+                       ("draw", np.float32),
+                       ("defeat", np.float32),
+                       ("net_resources_mean", np.float32),
+                       ("net_resources_std", np.float32),
+                       ("battles", np.uint32),
+                       ("fingerprint", np.uint64)])
+GARRISONS = [uprising_units.Garrison1, uprising_units.Garrison2, uprising_units.Garrison3]
+
+@dataclass
+class ModifierSet:
+    name: str
+    roll_modifications: list[type[RollModification]]
+    result_modifications: list[type[ResultModification]]
+
+@dataclass
+class MatchupSpace:
+    units: list[type[uprising_units.Unit]] = field(default_factory=lambda: [uprising_units.Stoneshell, uprising_units.CrabRider,
+                                                                            uprising_units.Harpooneers, uprising_units.ReefKing])
+    army_size: int = 5
+    garrison_levels: list[int] = field(default_factory=lambda: [1, 2, 3])
+    terrains: list[TerrainType] = field(default_factory=lambda: list(TerrainType))
+    modifier_sets: list[ModifierSet] = field(default_factory=lambda: [
+        ModifierSet("terrain", [TerrainRollModification], [TerrainResultModification]),
+        ModifierSet("light", [TerrainRollModification], [LightOfTheThan, TerrainResultModification]),
+        ModifierSet("druid and harpooners", [TerrainRollModification], [TerrainResultModification, DruidMountainHeart, HarpoonersUpgrade]),
+        ModifierSet("all", [TerrainRollModification], [LightOfTheThan, TerrainResultModification, DruidMountainHeart, HarpoonersUpgrade])
+    ])
+
+    def compositions(self) -> list[tuple[type[uprising_units.Unit], ...]]:
+        return list(combinations_with_replacement(self.units, self.army_size))
+
+    @property
+    def shape(self) -> tuple[int, int, int, int]:
+        return (len(self.compositions()), len(self.garrison_levels), len(self.terrains), len(self.modifier_sets))
+
+    def describe(self) -> dict:
+        return {"units": [unit.name for unit in self.units],
+                "army_size": self.army_size,
+                "garrison_levels": self.garrison_levels,
+                "terrains": [str(terrain) for terrain in self.terrains],
+                "modifier_sets": [{"name": modifier_set.name,
+                                   "roll_modifications": [modification.__name__ for modification in modifier_set.roll_modifications],
+                                   "result_modifications": [modification.__name__ for modification in modifier_set.result_modifications]}
+                                  for modifier_set in self.modifier_sets]}
+
+    def battle_config(self, composition, garrison_level: int, terrain: TerrainType, modifier_set: ModifierSet) -> BattleConfig:
+        return BattleConfig(ArmyConfig(army.UnitsArmy, list(composition)),
+                            ArmyConfig(army.ImperialArmy, [GARRISONS[garrison_level - 1]]),
+                            Terrain(terrain), modifier_set.roll_modifications, modifier_set.result_modifications)
+
+@cache
+def source_of(obj) -> str:
+    return inspect.getsource(obj)
+
+def cell_fingerprint(battle_config: BattleConfig, battles: int) -> int:
+    """Hash of the rules a cell depends on: the source of its units, their dice, the modifications, the effects
+    describing them and the shared battle and army rules. Only cells whose fingerprint changes need recomputing.
+    The batched engine itself is left out, its changes keep results equivalent as checked by the equivalence module."""
+    units = battle_config.player_army_config.units + battle_config.enemy_army_config.units
+    unit_instances = [unit() for unit in dict.fromkeys(units)]
+    die_classes = {type(die) for unit in unit_instances for die in unit.archery_dice + unit.clash_dice}
+    rule_sources = [source_of(unit) for unit in dict.fromkeys(units)]
+    rule_sources += sorted(source_of(die_class) for die_class in die_classes)
+    rule_sources += [source_of(modification) for modification in battle_config.battle_roll_modifications]
+    rule_sources += [source_of(modification) for modification in battle_config.battle_result_modifications]
+    rule_sources += [source_of(army.UnitsArmy), source_of(army.ImperialArmy), source_of(battle.Battle),
+                     source_of(battle.take_loses_with_mercy), source_of(dice.DicePool), source_of(effects),
+                     source_of(battle_state), source_of(result_rules)]
+    rule_sources += [str(battle_config.terrain.terrain_type), str(battles)]
+    digest = hashlib.blake2b("\0".join(rule_sources).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+@dataclass
+class MatchupCell:
+    victory: float
+    draw: float
+    defeat: float
+    net_resources_mean: float
+    net_resources_std: float
+    battles: int
+
+class MatchupIndex:
+    """Memory-mapped matrix of precomputed matchups, answering a cell with a few dictionary lookups.
+
+    The cells live in a .npy file next to a .json file describing the axes of the space."""
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.axes = json.loads(self.path.with_suffix(".json").read_text(encoding="utf-8"))
+        self.cells = np.load(self.path, mmap_mode="r")
+        self.unit_names = self.axes["units"]
+        self.composition_index = {composition: index for index, composition in
+                                  enumerate(combinations_with_replacement(range(len(self.unit_names)), self.axes["army_size"]))}
+        self.garrison_index = {level: index for index, level in enumerate(self.axes["garrison_levels"])}
+        self.terrain_index = {terrain: index for index, terrain in enumerate(self.axes["terrains"])}
+        self.modifier_set_index = {modifier_set["name"]: index for index, modifier_set in enumerate(self.axes["modifier_sets"])}
+
+    def cell_position(self, units: list[type[uprising_units.Unit]], garrison_level: int, terrain: TerrainType, modifier_set: str) -> tuple[int, int, int, int]:
+        composition = tuple(sorted(self.unit_names.index(unit.name) for unit in units))
+        return (self.composition_index[composition], self.garrison_index[garrison_level],
+                self.terrain_index[str(terrain)], self.modifier_set_index[modifier_set])
+
+    def lookup(self, units: list[type[uprising_units.Unit]], garrison_level: int, terrain: TerrainType, modifier_set: str) -> MatchupCell:
+        cell = self.cells[self.cell_position(units, garrison_level, terrain, modifier_set)]
+        if cell["fingerprint"] == 0:
+            raise KeyError(f"Matchup cell for {units} against garrison {garrison_level} has not been computed")
+        return MatchupCell(float(cell["victory"]), float(cell["draw"]), float(cell["defeat"]),
+                           float(cell["net_resources_mean"]), float(cell["net_resources_std"]), int(cell["battles"]))
+
+def build_matchup_index(path: str | Path, space: MatchupSpace | None = None, battles_per_cell: int = 20_000, seed: int = 0) -> MatchupIndex:
+    """Computes every cell of the space whose rule fingerprint changed since the last build."""
+    space = space or MatchupSpace()
+    path = Path(path)
+    axes_path = path.with_suffix(".json")
+    description = space.describe()
+    if path.exists() and axes_path.exists() and json.loads(axes_path.read_text(encoding="utf-8")) == description:
+        cells = np.load(path, mmap_mode="r+")
+    else:
+        cells = np.lib.format.open_memmap(path, mode="w+", dtype=CELL_DTYPE, shape=space.shape)
+        axes_path.write_text(json.dumps(description, indent=2), encoding="utf-8")
+
+    recomputed = 0
+    cell_positions = product(*(range(size) for size in space.shape))
+    compositions = space.compositions()
+    for cell_number, position in enumerate(cell_positions):
+        composition_index, garrison_index, terrain_index, modifier_set_index = position
+        battle_config = space.battle_config(compositions[composition_index], space.garrison_levels[garrison_index],
+                                            space.terrains[terrain_index], space.modifier_sets[modifier_set_index])
+        fingerprint = cell_fingerprint(battle_config, battles_per_cell)
+        if cells[position]["fingerprint"] == fingerprint:
+            continue
+        results = batched_battle.BatchedBattleEngine(battle_config, seed * cells.size + cell_number).run(battles_per_cell)
+        frequencies = results.outcome_frequencies()
+        cells[position] = (frequencies[OverallBattleResult.player_victory], frequencies[OverallBattleResult.draw],
+                           frequencies[OverallBattleResult.player_defeat], results.net_resources.mean(),
+                           results.net_resources.std(), len(results), fingerprint)
+        recomputed += 1
+        if recomputed % 100 == 0:
+            logger.info(f"Recomputed {recomputed} matchup cells")
+    cells.flush()
+    logger.info(f"Matchup index at {path} is up to date, recomputed {recomputed} of {cells.size} cells")
+    del cells
+    return MatchupIndex(path)
+
+if __name__ == "__main__":
+    matchup_index = build_matchup_index("matchup_index.npy")
+    logger.info(matchup_index.lookup([uprising_units.Stoneshell, uprising_units.CrabRider, uprising_units.CrabRider,
+                                      uprising_units.Harpooneers, uprising_units.Harpooneers], 2, TerrainType.MARSHES, "all"))
@@ -0,0 +1,245 @@
+from __future__ import annotations
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable
+import numpy as np
+import pandas as pd
+from loguru import logger
+from batched_battle import BatchedBattleEngine, BatchedBattleResults, BattleBatch, RoundRolls, SideRoll, SideTables, concatenate_results
+from battle_state import BattleStage, OverallBattleResult, OUTCOME_CODES
+
+if TYPE_CHECKING:
+    from battle_orchestrator import BattleConfig
+
+def modification_name(modification) -> str:
+    return getattr(modification, "__name__", type(modification).__name__)
+
+MAX_MODIFICATIONS = 6
+# Battle state that decides how a battle goes on; branches of a battle that agree on it are merged again.
+MERGE_COLUMNS = ("player_code", "enemy_code", "harpooneers_flagged", "harpooners_use_count", "net_resources")
+
+def select_side(side_roll: SideRoll, selected: np.ndarray) -> SideRoll:
+    return SideRoll(side_roll.types, side_roll.active[selected], side_roll.faces[selected],
+                    side_roll.reroll_faces[selected], side_roll.totals[selected])
+
+def write_back_side(side_roll: SideRoll, selected: np.ndarray, modified: SideRoll) -> None:
+    side_roll.faces[selected] = modified.faces
+    side_roll.totals[selected] = modified.totals
+
+def extend_side(side_roll: SideRoll, split_index: np.ndarray, original: SideRoll, changed: np.ndarray) -> SideRoll:
+    """Appends the modified rolls of the split rows for their new rows and restores the originals in place."""
+    extended = SideRoll(side_roll.types, np.concatenate([side_roll.active, side_roll.active[split_index]]),
+                        np.concatenate([side_roll.faces, side_roll.faces[split_index]]),
+                        np.concatenate([side_roll.reroll_faces, side_roll.reroll_faces[split_index]]),
+                        np.concatenate([side_roll.totals, side_roll.totals[split_index]]))
+    extended.faces[split_index] = original.faces[changed]
+    extended.totals[split_index] = original.totals[changed]
+    return extended
+
+def select_rolls(rolls: RoundRolls, selected: np.ndarray) -> RoundRolls:
+    return RoundRolls(rolls.rows[selected], rolls.stage, select_side(rolls.player, selected), select_side(rolls.enemy, selected))
+
+def side_differs(side_roll: SideRoll, selected: np.ndarray, original: SideRoll) -> np.ndarray:
+    return (side_roll.totals[selected] != original.totals).any(axis=1) | (side_roll.faces[selected] != original.faces).any(axis=1)
+
+class SubsetBattleEngine(BatchedBattleEngine):
+    """Plays every battle under every subset of the config's result modifications in a single pass.
+
+    Variant v of a battle is the battle with the modifications whose bits are set in v. Each row of the batch stands
+    for a set of variants of one battle, kept as a bitmask in variant_set; a battle starts as a single row holding all
+    variants. The faces of a round are drawn once per battle and shared by all its rows. When a modification is only
+    part of the variants of a row and applying it changes the roll or the battle state, the row branches in two, and
+    after every round the branches of a battle that ended up in the same state are merged again. The cost therefore
+    grows with the number of distinct battle paths instead of with the number of subsets. Roll modifications apply to
+    every variant."""
+    def __init__(self, battle_config: BattleConfig, seed: int | None = None) -> None:
+        super().__init__(battle_config, seed)
+        self.modifications = list(battle_config.battle_result_modifications)
+        if len(self.modifications) > MAX_MODIFICATIONS:
+            raise ValueError(f"At most {MAX_MODIFICATIONS} result modifications can be evaluated in all subsets")
+        self.variant_count = 1 << len(self.modifications)
+        self.result_handlers = [self.for_variants_with(handler, bit) for bit, handler in enumerate(self.result_handlers)]
+        self.variant_set = np.zeros(0, dtype=np.uint64)
+        self.battle_of_row = np.zeros(0, dtype=np.int64)
+        self.row_count = 0
+        self.rows_created = 0
+
+    def variants_with(self, bit: int) -> np.uint64:
+        return np.uint64(sum(1 << variant for variant in range(self.variant_count) if variant >> bit & 1))
+
+    def for_variants_with(self, handler: Callable[[RoundRolls], None], bit: int) -> Callable[[RoundRolls], None]:
+        variants_with = self.variants_with(bit)
+
+        def apply(rolls: RoundRolls) -> None:
+            variant_set = self.variant_set[rolls.rows]
+            with_modification = variant_set & variants_with
+            without_modification = variant_set & ~variants_with
+            applies = with_modification != 0
+            mixed = applies & (without_modification != 0)
+            if mixed.any():
+                self.branch(rolls, handler, applies, mixed, with_modification, without_modification)
+            elif applies.all():
+                handler(rolls)
+            elif applies.any():
+                modified = select_rolls(rolls, applies)
+                handler(modified)
+                write_back_side(rolls.player, applies, modified.player)
+                write_back_side(rolls.enemy, applies, modified.enemy)
+        return apply
+
+    def branch(self, rolls: RoundRolls, handler: Callable[[RoundRolls], None], applies: np.ndarray, mixed: np.ndarray,
+               with_modification: np.ndarray, without_modification: np.ndarray) -> None:
+        """Applies the modification to the rows with variants that have it. Rows that also hold variants without it
+        and are changed by it are split into the unmodified row and a new modified row."""
+        mixed_index = np.flatnonzero(mixed)
+        mixed_rows = rolls.rows[mixed_index]
+        original_player, original_enemy = select_side(rolls.player, mixed_index), select_side(rolls.enemy, mixed_index)
+        columns = self.batch.columns()
+        before = [column[mixed_rows] for column in columns]
+        if applies.all():
+            handler(rolls)
+        else:
+            modified = select_rolls(rolls, applies)
+            handler(modified)
+            write_back_side(rolls.player, applies, modified.player)
+            write_back_side(rolls.enemy, applies, modified.enemy)
+        after = [column[mixed_rows] for column in columns]
+        changed = side_differs(rolls.player, mixed_index, original_player) | side_differs(rolls.enemy, mixed_index, original_enemy)
+        for original, modified in zip(before, after):
+            changed |= original != modified
+        if not changed.any():
+            return
+        split_index = mixed_index[changed]
+        source_rows = mixed_rows[changed]
+        for original, column in zip(before, columns):
+            column[source_rows] = original[changed]
+        new_rows = self.add_rows(len(source_rows))
+        for modified, column in zip(after, self.batch.columns()):
+            column[new_rows] = modified[changed]
+        self.battle_of_row[new_rows] = self.battle_of_row[source_rows]
+        self.variant_set[new_rows] = with_modification[split_index]
+        self.variant_set[source_rows] = without_modification[split_index]
+        rolls.rows = np.concatenate([rolls.rows, new_rows])
+        rolls.player = extend_side(rolls.player, split_index, original_player, changed)
+        rolls.enemy = extend_side(rolls.enemy, split_index, original_enemy, changed)
+
+    def add_rows(self, count: int) -> np.ndarray:
+        if self.row_count + count > len(self.variant_set):
+            capacity = max(2 * len(self.variant_set), self.row_count + count)
+            extra = capacity - len(self.variant_set)
+            self.batch = BattleBatch(*(np.concatenate([column, np.zeros(extra, dtype=column.dtype)]) for column in self.batch.columns()))
+            self.variant_set = np.concatenate([self.variant_set, np.zeros(extra, dtype=self.variant_set.dtype)])
+            self.battle_of_row = np.concatenate([self.battle_of_row, np.zeros(extra, dtype=self.battle_of_row.dtype)])
+        new_rows = np.arange(self.row_count, self.row_count + count)
+        self.row_count += count
+        self.rows_created += count
+        return new_rows
+
+    def merge_branches(self, rows: np.ndarray) -> np.ndarray:
+        """Merges the variant sets of unfinished rows of the same battle in the same state into one of them."""
+        keys = [getattr(self.batch, name)[rows] for name in reversed(MERGE_COLUMNS)] + [self.battle_of_row[rows]]
+        order = np.lexsort(keys)
+        sorted_rows = rows[order]
+        new_group = np.ones(len(rows), dtype=bool)
+        new_group[1:] = np.any([key[order][1:] != key[order][:-1] for key in keys], axis=0)
+        if new_group.all():
+            return rows
+        starts = np.flatnonzero(new_group)
+        self.variant_set[sorted_rows[starts]] = np.bitwise_or.reduceat(self.variant_set[sorted_rows], starts)
+        self.variant_set[sorted_rows[~new_group]] = 0
+        return sorted_rows[starts]
+
+    def draw_faces(self, rows: np.ndarray, tables: SideTables, stage: BattleStage, width: int) -> np.ndarray:
+        battles, battle_of_row = np.unique(self.battle_of_row[rows], return_inverse=True)
+        return super().draw_faces(battles, tables, stage, width)[battle_of_row]
+
+    def play_round(self, rows: np.ndarray, stage: BattleStage) -> np.ndarray:
+        # As in BatchedBattleEngine.play_round, except that modifications may branch rows and branches merge afterwards.
+        rolls = RoundRolls(rows, stage, self.roll_side(self.player_tables, stage, rows),
+                           self.roll_side(self.enemy_tables, stage, rows))
+        for handler in self.result_handlers:
+            handler(rolls)
+        self.resolve_roll_result_effects(rolls)
+        # Mercy is decided anew every round by HarpoonersUpgrade, so it must not leak into merged variants without it.
+        self.batch.mercy[rolls.rows] = False
+        self.batch.rounds[rolls.rows] += 1
+        return self.merge_branches(self.update_outcomes(rolls.rows))
+
+    def run_chunk(self, battle_count: int) -> BatchedBattleResults:
+        """Results of battle_count battles in every variant, in row battle * variant_count + variant."""
+        self.variant_set = np.full(battle_count, (1 << self.variant_count) - 1, dtype=np.uint64)
+        self.battle_of_row = np.arange(battle_count)
+        self.row_count = self.rows_created = battle_count
+        self.batch = BattleBatch.fresh(battle_count, self.player_tables.initial_code, self.enemy_tables.initial_code)
+        rows = self.play_round(np.arange(battle_count), BattleStage.ARHCERY)
+        self.play_clash_rounds(rows)
+        logger.debug(f"{battle_count} battles took {self.rows_created} rows for {self.variant_count} variants")
+
+        capacity = battle_count * self.variant_count
+        variant_set = self.variant_set[:self.row_count]
+        outcome = np.empty(capacity, dtype=self.batch.outcome.dtype)
+        net_resources = np.empty(capacity, dtype=self.batch.net_resources.dtype)
+        rounds = np.empty(capacity, dtype=self.batch.rounds.dtype)
+        for variant in range(self.variant_count):
+            rows = np.flatnonzero(variant_set >> np.uint64(variant) & np.uint64(1))
+            targets = self.battle_of_row[rows] * self.variant_count + variant
+            outcome[targets] = self.batch.outcome[rows]
+            net_resources[targets] = self.batch.net_resources[rows]
+            rounds[targets] = self.batch.rounds[rows]
+        return BatchedBattleResults(outcome, net_resources, rounds)
+
+@dataclass
+class SubsetResults:
+    modifications: list[str]
+    outcome: np.ndarray
+    net_resources: np.ndarray
+    elapsed_seconds: float
+
+    @property
+    def battles(self) -> int:
+        return self.outcome.shape[0]
+
+    def subset_names(self, variant: int) -> str:
+        return " + ".join(name for bit, name in enumerate(self.modifications) if variant >> bit & 1) or "none"
+
+    def table(self) -> pd.DataFrame:
+        """Outcome frequencies and net resources for every subset of the modifications."""
+        return pd.DataFrame([{"modifications": self.subset_names(variant),
+                              **{str(result): float((self.outcome[:, variant] == code).mean()) for result, code in OUTCOME_CODES.items()
+                                 if result != OverallBattleResult.undecided},
+                              "net_resources_mean": float(self.net_resources[:, variant].mean()),
+                              "net_resources_std": float(self.net_resources[:, variant].std())}
+                             for variant in range(self.outcome.shape[1])])
+
+    def marginal_contributions(self) -> pd.DataFrame:
+        """Change in win probability and net resources from adding each modification, averaged over all subsets of
+        the other modifications. Variants of a battle share their dice, so the standard errors come from paired
+        differences and are much smaller than those of independent runs."""
+        victories = (self.outcome == OUTCOME_CODES[OverallBattleResult.player_victory]).astype(float)
+        variants = np.arange(self.outcome.shape[1])
+        rows = []
+        for bit, name in enumerate(self.modifications):
+            without = variants[(variants >> bit & 1) == 0]
+            with_modification = without | 1 << bit
+            win_difference = (victories[:, with_modification] - victories[:, without]).mean(axis=1)
+            net_difference = (self.net_resources[:, with_modification] - self.net_resources[:, without]).mean(axis=1)
+            rows.append({"modification": name,
+                         "win_probability_change": float(win_difference.mean()),
+                         "win_probability_change_se": float(win_difference.std(ddof=1) / np.sqrt(self.battles)),
+                         "net_resources_change": float(net_difference.mean()),
+                         "net_resources_change_se": float(net_difference.std(ddof=1) / np.sqrt(self.battles))})
+        return pd.DataFrame(rows)
+
+def evaluate_modification_subsets(battle_config: BattleConfig, number_of_iterations: int = 5000, seed: int | None = None,
+                                  chunk_size: int = 100_000) -> SubsetResults:
+    start = time.perf_counter()
+    engine = SubsetBattleEngine(battle_config, seed)
+    results = concatenate_results([engine.run_chunk(min(chunk_size, number_of_iterations - first))
+                                   for first in range(0, number_of_iterations, chunk_size)])
+    subset_results = SubsetResults([modification_name(modification) for modification in engine.modifications],
+                                   results.outcome.reshape(number_of_iterations, engine.variant_count),
+                                   results.net_resources.reshape(number_of_iterations, engine.variant_count),
+                                   time.perf_counter() - start)
+    logger.info(f"Evaluated {engine.variant_count} modification subsets over {number_of_iterations} battles "
+                f"in {subset_results.elapsed_seconds:.2f}s")
+    return subset_results
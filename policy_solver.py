@@ -0,0 +1,271 @@
+from __future__ import annotations
+import hashlib
+from dataclasses import dataclass, replace
+from enum import StrEnum
+from functools import partial
+from typing import TYPE_CHECKING
+import numpy as np
+from loguru import logger
+import army
+import battle_state
+import exact_rolls
+import uprising_units
+from batched_battle import DIE_NAMES, STAGES, SideTables, build_side_tables, imperial_army_code
+from result_modifier import DruidMountainHeart, HarpoonersUpgrade, LightOfTheThan, TerrainResultModification
+
+if TYPE_CHECKING:
+    from battle_orchestrator import BattleConfig
+
+# (stage index, player code, flagged harpooneers, enemy code, harpooners use count)
+PolicyState = tuple[int, int, int, int, int]
+MAX_HARPOONEERS_USES = 2
+FIXED_POINT_TOLERANCE = 1e-12
+FIXED_POINT_MAX_ITERATIONS = 10_000
+
+class PolicyObjective(StrEnum):
+    NET_RESOURCES = "net resources"
+    WIN_PROBABILITY = "win probability"
+
+@dataclass(frozen=True)
+class BoltDecision:
+    ignore_highest_skull_die: bool
+    food: int
+    mercy: bool
+
+    @classmethod
+    def decode(cls, action: int) -> "BoltDecision":
+        return cls(bool(action & 1), action >> 1 & 3, bool(action >> 3 & 1))
+
+    def encode(self) -> int:
+        return int(self.ignore_highest_skull_die) | self.food << 1 | int(self.mercy) << 3
+
+@dataclass
+class DecisionTable:
+    player_index: dict[tuple[int, int, int], int]
+    enemy_index: dict[tuple[int, int, int, int], int]
+    actions: np.ndarray
+
+@dataclass
+class BoltPolicy:
+    battle_config: BattleConfig
+    objective: PolicyObjective
+    expected_value: float
+    tables: dict[PolicyState, DecisionTable]
+    druid: bool
+    harpooners: bool
+
+    def decide(self, state: PolicyState, player_key: tuple[int, int, int], enemy_key: tuple[int, int, int, int]) -> BoltDecision | None:
+        table = self.tables.get(state)
+        if table is None or player_key not in table.player_index or enemy_key not in table.enemy_index:
+            return None
+        return BoltDecision.decode(int(table.actions[table.player_index[player_key], table.enemy_index[enemy_key]]))
+
+    def fingerprint(self) -> str:
+        """Digest of the objective, fallback heuristics and every decision, naming the policy in the hashes of configs playing it."""
+        digest = hashlib.blake2b(repr((str(self.objective), self.druid, self.harpooners)).encode(), digest_size=8)
+        for state in sorted(self.tables):
+            table = self.tables[state]
+            digest.update(repr((state, sorted(table.player_index.items()), sorted(table.enemy_index.items()))).encode())
+            digest.update(np.ascontiguousarray(table.actions).tobytes())
+        return digest.hexdigest()
+
+    def battle_config_with_policy(self) -> BattleConfig:
+        """The solved config with DruidMountainHeart and HarpoonersUpgrade replaced by the policy, applied last."""
+        modifications = [modification for modification in self.battle_config.battle_result_modifications
+                         if modification not in (DruidMountainHeart, HarpoonersUpgrade)]
+        return replace(self.battle_config, battle_result_modifications=modifications + [partial(PolicyBoltModification, self)])
+
+def collapse(distribution: dict[exact_rolls.RollSummary, float], key_fields: tuple[int, ...], light_of_the_than: bool = False) -> tuple[list[tuple], np.ndarray, np.ndarray]:
+    collapsed: dict[tuple, float] = {}
+    for summary, probability in distribution.items():
+        summary = list(summary)
+        if light_of_the_than and summary[exact_rolls.BLANKS] > 0:
+            summary[exact_rolls.BOLTS] += 1
+        key = tuple(summary[field] for field in key_fields)
+        collapsed[key] = collapsed.get(key, 0.0) + probability
+    keys = list(collapsed)
+    return keys, np.array(keys, dtype=np.int32).reshape(len(keys), len(key_fields)), np.array([collapsed[key] for key in keys])
+
+class BoltPolicySolver:
+    """Solves bolt spending (Druid Mountain Heart, Harpooneers food) and mercy decisions by memoized expectimax.
+
+    Rolls are enumerated exactly per army code with the chance modifications (LightOfTheThan and the forest
+    rerolls of TerrainResultModification) applied first, in their configured order, then every decision is evaluated against the solved
+    values of the successor states. Clash states that can repeat themselves are solved as a fixed point."""
+    def __init__(self, battle_config: BattleConfig, objective: PolicyObjective = PolicyObjective.NET_RESOURCES) -> None:
+        self.battle_config = battle_config
+        self.objective = objective
+        modifications = battle_config.battle_result_modifications
+        unsupported = [modification for modification in modifications
+                       if modification not in (LightOfTheThan, TerrainResultModification, DruidMountainHeart, HarpoonersUpgrade)]
+        if unsupported:
+            raise ValueError(f"Result modifications {unsupported} are not supported by the policy solver")
+        self.light_of_the_than = LightOfTheThan in modifications
+        self.druid = DruidMountainHeart in modifications
+        self.harpooners = HarpoonersUpgrade in modifications
+        self.forest_rerolls = (TerrainResultModification in modifications
+                               and battle_config.terrain.terrain_type == battle_state.TerrainType.FOREST)
+        # Rerolls only change the blanks LightOfTheThan looks at when it comes after them.
+        self.light_before_rerolls = (self.light_of_the_than and TerrainResultModification in modifications
+                                     and modifications.index(LightOfTheThan) < modifications.index(TerrainResultModification))
+        self.player_tables = build_side_tables(battle_config.player_army_config, battle_config.terrain,
+                                               battle_config.battle_roll_modifications, player_side=True)
+        self.enemy_tables = build_side_tables(battle_config.enemy_army_config, battle_config.terrain,
+                                              battle_config.battle_roll_modifications, player_side=False)
+        self.values: dict[PolicyState, float] = {}
+        self.tables: dict[PolicyState, DecisionTable] = {}
+        self.outcome_cache: dict[tuple[bool, int, int], tuple] = {}
+
+    def roll_outcomes(self, tables: SideTables, player_side: bool, stage_index: int, code: int) -> tuple:
+        cache_key = (player_side, stage_index, code)
+        if cache_key not in self.outcome_cache:
+            dice_counts = tuple((DIE_NAMES[index], int(count))
+                                for index, count in enumerate(tables.dice_counts[stage_index, code]) if count > 0)
+            reroll_count = 2 if self.forest_rerolls and STAGES[stage_index] == battle_state.BattleStage.ARHCERY else 0
+            light_first = player_side and self.light_before_rerolls
+            distribution = exact_rolls.pool_outcome_distribution(dice_counts, reroll_count, bolts_if_blanks=int(light_first))
+            if player_side:
+                key_fields = (exact_rolls.SKULLS, exact_rolls.SHIELDS, exact_rolls.BOLTS)
+                self.outcome_cache[cache_key] = collapse(distribution, key_fields, self.light_of_the_than and not light_first)
+            else:
+                key_fields = (exact_rolls.SKULLS, exact_rolls.SHIELDS, exact_rolls.BOLTS, exact_rolls.HIGHEST_SKULLS)
+                self.outcome_cache[cache_key] = collapse(distribution, key_fields)
+        return self.outcome_cache[cache_key]
+
+    def food_flags(self, player_code: int, flagged: int, food: int) -> int | None:
+        for _ in range(food):
+            candidates = player_code & self.player_tables.harpooneer_mask & ~flagged
+            if candidates == 0:
+                return None
+            flagged |= candidates & -candidates
+        return flagged
+
+    def terminal_value(self, player_down: np.ndarray, enemy_down: np.ndarray) -> np.ndarray:
+        if self.objective == PolicyObjective.WIN_PROBABILITY:
+            return (enemy_down & ~player_down).astype(float)
+        return np.zeros(player_down.shape)
+
+    def state_value(self, state: PolicyState) -> float:
+        if state in self.values:
+            return self.values[state]
+        stage_index, player_code, flagged, enemy_code, use_count = state
+        player_keys, player, player_probabilities = self.roll_outcomes(self.player_tables, True, stage_index, player_code)
+        enemy_keys, enemy, enemy_probabilities = self.roll_outcomes(self.enemy_tables, False, stage_index, enemy_code)
+        probabilities = player_probabilities[:, None] * enemy_probabilities[None, :]
+        player_skulls, player_shields, player_bolts = (player[:, field, None] for field in range(3))
+        enemy_skulls, enemy_shields, enemy_bolts, highest_skulls = (enemy[None, :, field] for field in range(4))
+
+        druid_options = (False, True) if self.druid else (False,)
+        harpooners_available = self.harpooners and use_count < MAX_HARPOONEERS_USES
+        food_options = range(MAX_HARPOONEERS_USES - use_count + 1) if harpooners_available else range(1)
+        mercy_options = (False, True) if harpooners_available else (False,)
+        action_codes, base_values, self_loops = [], [], []
+        for ignore_die in druid_options:
+            for food in food_options:
+                new_flagged = self.food_flags(player_code, flagged, food)
+                if new_flagged is None:
+                    continue
+                for mercy in mercy_options:
+                    bolts_left = player_bolts - int(ignore_die) - food
+                    feasible = bolts_left >= 0
+                    skulls = enemy_skulls
+                    if ignore_die:
+                        feasible = feasible & (highest_skulls >= 1)
+                        skulls = enemy_skulls - highest_skulls
+                    player_losses = np.clip(skulls - (player_shields - enemy_bolts), 0, self.player_tables.max_losses)
+                    enemy_losses = np.clip(player_skulls - (enemy_shields - bolts_left), 0, self.enemy_tables.max_losses)
+                    new_player_code = self.player_tables.next_code[player_code, player_losses]
+                    enemy_transitions = self.enemy_tables.next_code_mercy if mercy else self.enemy_tables.next_code
+                    new_enemy_code = enemy_transitions[enemy_code, enemy_losses]
+                    player_down = self.player_tables.hit_points[new_player_code] == 0
+                    enemy_down = self.enemy_tables.hit_points[new_enemy_code] == 0
+                    over = player_down | enemy_down
+                    values = self.terminal_value(player_down, enemy_down)
+                    if self.objective == PolicyObjective.NET_RESOURCES:
+                        values = values + food - (self.player_tables.value[player_code] - self.player_tables.value[new_player_code])
+                    self_loop = np.zeros(probabilities.shape, dtype=bool)
+                    successors: dict[PolicyState, float] = {}
+                    for cell in zip(*np.nonzero(feasible & ~over)):
+                        successor = (1, int(new_player_code[cell]), new_flagged & int(new_player_code[cell]),
+                                     int(new_enemy_code[cell]), use_count + food)
+                        if successor == state:
+                            self_loop[cell] = True
+                            continue
+                        if successor not in successors:
+                            successors[successor] = self.state_value(successor)
+                        values[cell] += successors[successor]
+                    action_codes.append(BoltDecision(ignore_die, food, mercy).encode())
+                    base_values.append(np.where(feasible, values, -np.inf))
+                    self_loops.append(self_loop)
+
+        base_values = np.stack(base_values)
+        self_loops = np.stack(self_loops)
+        value = 0.0
+        for _ in range(FIXED_POINT_MAX_ITERATIONS):
+            best = (base_values + self_loops * value).max(axis=0)
+            new_value = float((probabilities * best).sum())
+            converged = abs(new_value - value) < FIXED_POINT_TOLERANCE
+            value = new_value
+            if converged or not self_loops.any():
+                break
+        best_actions = np.array(action_codes, dtype=np.int8)[(base_values + self_loops * value).argmax(axis=0)]
+        self.tables[state] = DecisionTable({key: index for index, key in enumerate(player_keys)},
+                                           {key: index for index, key in enumerate(enemy_keys)}, best_actions)
+        self.values[state] = value
+        return value
+
+    def solve(self) -> BoltPolicy:
+        initial_state = (0, self.player_tables.initial_code, 0, self.enemy_tables.initial_code, 0)
+        expected_value = self.state_value(initial_state)
+        logger.info(f"Solved {len(self.values)} battle states, optimal expected {self.objective}: {expected_value:.4f}")
+        return BoltPolicy(self.battle_config, self.objective, expected_value, self.tables, self.druid, self.harpooners)
+
+def army_code(side_army: army.Army, unit_index: dict[int, int]) -> int:
+    if isinstance(side_army, army.ImperialArmy):
+        return imperial_army_code(side_army)
+    return sum(1 << unit_index[id(unit)] for unit in side_army.units)
+
+class PolicyBoltModification(HarpoonersUpgrade):
+    """Spends bolts and decides on mercy by looking up a solved BoltPolicy, one dictionary lookup per round.
+
+    Falls back to the DruidMountainHeart and HarpoonersUpgrade heuristics, those the policy was solved with, for
+    states the policy never reached."""
+    def __init__(self, policy: BoltPolicy) -> None:
+        super().__init__()
+        self.policy = policy
+        self.player_unit_index: dict[int, int] = {}
+        self.enemy_unit_index: dict[int, int] = {}
+
+    @property
+    def name(self) -> str:
+        return f"Bolt Policy ({self.policy.objective})"
+
+    def policy_state(self, state: battle_state.BattleState) -> PolicyState:
+        if not self.player_unit_index:
+            self.player_unit_index = {id(unit): index for index, unit in enumerate(state.player_army.units)}
+            self.enemy_unit_index = {id(unit): index for index, unit in enumerate(state.enemy_army.units)}
+        player_code = army_code(state.player_army, self.player_unit_index)
+        flagged = sum(1 << self.player_unit_index[id(unit)] for unit in state.player_army.units
+                      if isinstance(unit, uprising_units.Harpooneers) and unit.food_generated_this_combat)
+        stage_index = STAGES.index(state.battle_stage)
+        return (stage_index, player_code, flagged, army_code(state.enemy_army, self.enemy_unit_index), self.use_count)
+
+    def modify_result(self, state: battle_state.BattleState) -> None:
+        highest_skulls = max((die.result.skulls for die in state.enemy_army.current_dice_pool.dice
+                              if die.result.skulls <= 3), default=0)
+        player_key = (state.player_roll_results.skulls, state.player_roll_results.shields, state.player_roll_results.bolts)
+        enemy_key = (state.enemy_roll_results.skulls, state.enemy_roll_results.shields, state.enemy_roll_results.bolts, highest_skulls)
+        decision = self.policy.decide(self.policy_state(state), player_key, enemy_key)
+        if decision is None:
+            logger.debug("State not covered by the bolt policy, falling back to the heuristics")
+            if self.policy.druid:
+                DruidMountainHeart().modify_result(state)
+            if self.policy.harpooners:
+                super().modify_result(state)
+            return
+        logger.debug(f"Bolt policy decision: {decision}")
+        if decision.ignore_highest_skull_die:
+            DruidMountainHeart().ignore_skulls_of_single_die(state)
+        for _ in range(decision.food):
+            self.generate_food_from_harpooneers(state)
+        state.player_army.mercy = decision.mercy
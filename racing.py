@@ -0,0 +1,123 @@
+from __future__ import annotations
+import math
+import time
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import TYPE_CHECKING
+import pandas as pd
+from loguru import logger
+from batched_battle import BatchedBattleEngine
+from battle_aggregate import BattleAggregate
+from battle_state import OverallBattleResult, OUTCOME_CODES
+from policy_solver import PolicyObjective
+
+if TYPE_CHECKING:
+    from battle_orchestrator import BattleConfig
+
+@dataclass
+class Contender:
+    name: str
+    engine: BatchedBattleEngine
+    aggregate: BattleAggregate
+    eliminated_round: int | None = None
+    lower: float = -math.inf
+    upper: float = math.inf
+
+    def mean(self, objective: PolicyObjective) -> float:
+        if objective == PolicyObjective.WIN_PROBABILITY:
+            return self.aggregate.outcome_counts[OUTCOME_CODES[OverallBattleResult.player_victory]] / max(self.aggregate.battles, 1)
+        return self.aggregate.net_resources_mean
+
+    def standard_error(self, objective: PolicyObjective) -> float:
+        battles = max(self.aggregate.battles, 1)
+        if objective == PolicyObjective.WIN_PROBABILITY:
+            # Bounded away from zero so that candidates that never won yet are not considered certain.
+            probability = min(max(self.mean(objective), 1 / battles), 1 - 1 / battles)
+            return math.sqrt(probability * (1 - probability) / battles)
+        return self.aggregate.net_resources_std / math.sqrt(battles)
+
+@dataclass
+class RaceResults:
+    winner: str
+    objective: PolicyObjective
+    confidence: float
+    decided: bool
+    rounds: int
+    battles: int
+    uniform_battles: int
+    elapsed_seconds: float
+    table: pd.DataFrame
+
+    @property
+    def budget_fraction(self) -> float:
+        """Battles spent relative to giving every candidate as many battles as the finalists got."""
+        return self.battles / max(self.uniform_battles, 1)
+
+    def __str__(self) -> str:
+        return (f"Best by {self.objective}: {self.winner} with confidence {self.confidence:.3f}"
+                f"{'' if self.decided else ' (budget exhausted before the race was decided)'}, "
+                f"{self.battles} battles in {self.rounds} rounds, {self.budget_fraction:.1%} of uniform allocation\n"
+                f"{self.table.to_string(index=False)}")
+
+def race_candidates(candidates: dict[str, BattleConfig], objective: PolicyObjective = PolicyObjective.WIN_PROBABILITY,
+                    confidence: float = 0.95, budget: int = 1_000_000, initial_batch: int = 1000, batch_growth: float = 1.5,
+                    seed: int | None = None) -> RaceResults:
+    """Successive elimination over candidate battle configs with the batched engine.
+
+    Every round plays a batch of battles for each candidate still in the race and drops those whose upper confidence
+    bound falls below the best lower bound. The bounds are normal intervals, with the error level split over the
+    candidates and the rounds (delta / (k * r * (r + 1)) in round r), so the winner is the best candidate with at least
+    the given confidence when the race is decided. If the budget runs out first, the leader is reported with the
+    approximate probability that it beats each remaining contender."""
+    from battle_orchestrator import new_base_seed
+    if not candidates:
+        raise ValueError("Racing needs at least one candidate")
+    if len(candidates) > 1 and budget < len(candidates):
+        raise ValueError(f"A budget of {budget} battles cannot play one battle for each of the {len(candidates)} candidates")
+    start = time.perf_counter()
+    base_seed = new_base_seed() if seed is None else seed
+    contenders = [Contender(name, BatchedBattleEngine(battle_config, [base_seed, index]), BattleAggregate())
+                  for index, (name, battle_config) in enumerate(candidates.items())]
+    delta = 1 - confidence
+    battles = 0
+    batch = initial_batch
+    round_number = 0
+    alive = list(contenders)
+    while len(alive) > 1 and battles + len(alive) <= budget:
+        round_number += 1
+        batch_size = min(int(batch), (budget - battles) // len(alive))
+        for contender in alive:
+            contender.aggregate = contender.aggregate.merge(BattleAggregate.from_results(contender.engine.run(batch_size)))
+        battles += batch_size * len(alive)
+        z = NormalDist().inv_cdf(1 - delta / (2 * len(contenders) * round_number * (round_number + 1)))
+        for contender in alive:
+            mean, error = contender.mean(objective), contender.standard_error(objective)
+            contender.lower, contender.upper = mean - z * error, mean + z * error
+        best_lower = max(contender.lower for contender in alive)
+        for contender in alive:
+            if contender.upper < best_lower:
+                contender.eliminated_round = round_number
+        alive = [contender for contender in alive if contender.eliminated_round is None]
+        logger.debug(f"Racing round {round_number}: {len(alive)} of {len(contenders)} candidates left after {battles} battles")
+        batch *= batch_growth
+
+    winner = max(alive, key=lambda contender: contender.mean(objective))
+    decided = len(alive) == 1
+    if decided:
+        stated_confidence = confidence
+    else:
+        stated_confidence = 1.0
+        for contender in alive:
+            if contender is not winner:
+                spread = math.hypot(winner.standard_error(objective), contender.standard_error(objective))
+                stated_confidence *= NormalDist().cdf((winner.mean(objective) - contender.mean(objective)) / max(spread, 1e-12))
+    table = pd.DataFrame([{"candidate": contender.name, "battles": contender.aggregate.battles,
+                           "estimate": contender.mean(objective), "lower": contender.lower, "upper": contender.upper,
+                           "eliminated_round": contender.eliminated_round} for contender in contenders])
+    table = table.sort_values("estimate", ascending=False, ignore_index=True)
+    results = RaceResults(winner.name, objective, stated_confidence, decided, round_number, battles,
+                          len(contenders) * max(contender.aggregate.battles for contender in contenders),
+                          time.perf_counter() - start, table)
+    logger.info(f"Race over {len(contenders)} candidates won by {winner.name} after {battles} battles "
+                f"({results.budget_fraction:.1%} of uniform allocation)")
+    return results
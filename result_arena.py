@@ -0,0 +1,86 @@
+from __future__ import annotations
+import sys
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from battle_state import BattleResult, OverallBattleResult, OUTCOME_CODES
+
+ARENA_COLUMNS: dict[str, np.dtype] = {"outcome": np.dtype(np.int8),
+                                      "net_resources": np.dtype(np.int32),
+                                      "rounds": np.dtype(np.int16),
+                                      "seed": np.dtype(np.int64)}
+COLUMN_ALIGNMENT = 64
+
+def column_offsets(battle_count: int, columns: dict[str, np.dtype] = ARENA_COLUMNS) -> tuple[dict[str, int], int]:
+    """Byte offset of every column in an arena of battle_count rows, each column aligned to a cache line."""
+    offsets = {}
+    size = 0
+    for name, dtype in columns.items():
+        offsets[name] = size
+        size += -(-battle_count * dtype.itemsize // COLUMN_ALIGNMENT) * COLUMN_ALIGNMENT
+    return offsets, max(size, 1)
+
+class ResultArena:
+    """Fixed-width typed result columns in one shared memory block.
+
+    The parent creates the arena once per run, workers attach to it by name and write their own disjoint slice of rows,
+    and the columns are read back as NumPy views of the shared block without any copying or pickling."""
+    def __init__(self, memory: shared_memory.SharedMemory, battle_count: int, owner: bool) -> None:
+        self.memory = memory
+        self.battle_count = battle_count
+        self.owner = owner
+        offsets, _ = column_offsets(battle_count)
+        self.columns: dict[str, np.ndarray] = {name: np.ndarray(battle_count, dtype, memory.buf, offsets[name])
+                                               for name, dtype in ARENA_COLUMNS.items()}
+
+    @classmethod
+    def create(cls, battle_count: int) -> "ResultArena":
+        _, size = column_offsets(battle_count)
+        arena = cls(shared_memory.SharedMemory(create=True, size=size), battle_count, owner=True)
+        arena.columns["outcome"][:] = OUTCOME_CODES[OverallBattleResult.undecided]
+        return arena
+
+    @classmethod
+    def attach(cls, name: str, battle_count: int) -> "ResultArena":
+        # Worker processes share the resource tracker of the parent, which unlinks the block once the run is over.
+        if sys.version_info >= (3, 13):
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            memory = shared_memory.SharedMemory(name=name)
+        return cls(memory, battle_count, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def __len__(self) -> int:
+        return self.battle_count
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.columns[column]
+
+    def write(self, index: int, battle_result: BattleResult, seed: int) -> None:
+        self.columns["outcome"][index] = OUTCOME_CODES[battle_result.overall_result]
+        self.columns["net_resources"][index] = battle_result.player_net_resources
+        self.columns["rounds"][index] = battle_result.rounds
+        self.columns["seed"][index] = seed
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """DataFrame backed by the shared columns. It is only valid until the arena is closed."""
+        return pd.DataFrame(self.columns, copy=False)
+
+    def outcome_frequencies(self) -> dict[OverallBattleResult, float]:
+        counts = np.bincount(self.columns["outcome"], minlength=len(OUTCOME_CODES))
+        return {result: counts[code] / max(self.battle_count, 1) for result, code in OUTCOME_CODES.items()}
+
+    def close(self) -> None:
+        self.columns = {}
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __enter__(self) -> "ResultArena":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,33 +1,34 @@
 from __future__ import annotations
-from abc import ABC, abstractmethod
-from enum import StrEnum
 from loguru import logger
 import battle_state
-import dice
+import effects
+from effects import ResultEffect
 import uprising_units
+from result_rules import (ResultModification, ResultModificationTarget, RerollModification, damage_needed_to_kill_enemy,
+                          player_will_take_damage, return_zero_for_negative)
 
-class ResultModificationTarget(StrEnum):
-    PLAYER = "Player"
-    ENEMY = "Enemy"
+class DeclarativeResultModification(ResultModification):
+    """A modification described by result effects alone, which fast engines can compile instead of running it.
+    Subclasses only set effects, e.g. effects = (effects.AddBoltIfBlanks(bolts=2),)."""
+    effects: tuple[ResultEffect, ...] = ()
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        if "modify_result" in vars(cls):
+            raise TypeError(f"{cls.__name__} overrides modify_result, which fast engines would not run. Change its effects instead")
 
-class ResultModification(ABC):
     def __init__(self) -> None:
-        self.once_per_combat: bool
-        self.once_per_round: bool
-        self.used_this_combat: bool
-        self.used_this_round: bool
+        super().__init__()
+        self.memory: list[dict] = [{} for _ in self.effects]
 
     @property
-    @abstractmethod
     def name(self) -> str:
-        pass
+        return type(self).__name__
 
-    def __repr__(self) -> str:
-        return self.name
-    
-    @abstractmethod
     def modify_result(self, state: battle_state.BattleState) -> None:
-        pass
+        for effect, memory in zip(self.effects, self.memory):
+            if effect.applies(state):
+                effect.apply(state, memory)
 
 class ResultModifier:
     def __init__(self) -> None:
@@ -46,71 +47,9 @@ class ResultModifier:
         for modification in self.modification_list:
             modification.modify_result(state)
 
-class RerollModification(ResultModification):
-    def __init__(self, target: ResultModificationTarget, reroll_count: int, reroll_priority: list[dice.DiceNames] = dice.STANDARD_DICE_PRIORITY) -> None:
-        super().__init__()
-        self.target = target
-        self.reroll_count = reroll_count
-        self.reroll_priority = reroll_priority
-
-    def reroll_die(self, dice_pool: dice.DicePool, dice_results: dice.DiceRollResults):
-        for dice_type_name in self.reroll_priority:
-            for die in dice_pool.dice:
-                if die.name == dice_type_name and not die.rerolled and die.result.blanks == 1:
-                    logger.debug(f"Rerolling dice {die.name} with result {die.result}")
-                    dice_results.blanks -= 1
-                    die.roll()
-                    die.rerolled = True
-                    dice_results.add_die_result(die.result)
-                    logger.debug(f"New result: {die.result}")
-                    return
-
-    def reroll_dice(self, dice_pool: dice.DicePool, dice_results: dice.DiceRollResults) -> None:
-        if dice_results.blanks == 0:
-            logger.debug(f"No blanks to reroll")
-            return
-    
-        for _ in range(self.reroll_count):
-            self.reroll_die(dice_pool, dice_results)
-        for die in dice_pool.dice:
-            die.rerolled = False
-        logger.debug(f"New dice roll results after rerolling: {dice_results}")
-    
-    def modify_result(self, state: battle_state.BattleState) -> None:
-        logger.debug(f"Rerolling dice (with reroll count {self.reroll_count}) for {self.target}")
-        if self.target == ResultModificationTarget.PLAYER:
-            self.reroll_dice(state.player_army.current_dice_pool, state.player_roll_results)
-        else:
-            self.reroll_dice(state.enemy_army.current_dice_pool, state.enemy_roll_results)
-
-    @property
-    def name(self) -> str:
-        return "RerollModification" 
-
-def player_will_take_damage(state: battle_state.BattleState) -> bool:
-    if (state.player_roll_results.shields - state.enemy_roll_results.bolts) < state.enemy_roll_results.skulls:
-        logger.debug(f"The enemy will deal damage to the player units without intervention")
-        return True
-    logger.debug(f"The player will not take damage from the enemy roll")
-    return False
-
-def damage_needed_to_kill_enemy(state: battle_state.BattleState):
-    hit_points: int
-    if len(state.enemy_army.units) == 1:
-        unit_name = state.enemy_army.units[0].name
-        if "Garrison" in unit_name:
-            hit_points = int(unit_name[-1])
-        else:
-            hit_points = 1
-    else:
-        hit_points = len(state.enemy_army.units)
-    damage_incoming = state.player_roll_results.skulls
-    damage_needed = hit_points + state.enemy_roll_results.shields - damage_incoming
-    logger.debug(f"Enemy has {hit_points} 'hit points' and {state.enemy_roll_results.shields} shields")
-    logger.debug(f"Player has {damage_incoming} skulls and thus needs to deal {damage_needed} damage more")
-    return damage_needed
-
 class LightOfTheThan(ResultModification):
+    effects = (effects.AddBoltIfBlanks(),)
+
     @property
     def name(self) -> int:
         return "Light of The Than"
@@ -120,13 +59,9 @@ class LightOfTheThan(ResultModification):
             logger.debug("LightOfTheThan generated a bolt because of 1+ blanks")
             state.player_roll_results.bolts += 1
 
-def return_zero_for_negative(num):
-    if num < 0:
-        return 0
-    else:
-        return num
-    
 class HarpoonersUpgrade(ResultModification):
+    effects = (effects.TradeBoltForResource(unit=uprising_units.Harpooneers, per_combat_limit=2, mercy_units_left=3),)
+
     def __init__(self) -> None:
         super().__init__()
         self.use_count = 0
@@ -186,6 +121,8 @@ class HarpoonersUpgrade(ResultModification):
         state.player_army.mercy = False
 
 class DruidMountainHeart(ResultModification):
+    effects = (effects.IgnoreHighestSkullDie(),)
+
     def ignore_skulls_of_single_die(self, state: battle_state.BattleState) -> None:
         for skull_number in [3, 2, 1]:
             for die in state.enemy_army.current_dice_pool.dice:
@@ -205,6 +142,8 @@ class DruidMountainHeart(ResultModification):
         return "Druid Mountain Heart"
 
 class TerrainResultModification(ResultModification):
+    effects = (effects.RerollBlanks(count=2, stages=(battle_state.BattleStage.ARHCERY,), terrains=(battle_state.TerrainType.FOREST,)),)
+
     def modify_result(self, state: battle_state.BattleState) -> None:
         if state.battle_stage == battle_state.BattleStage.ARHCERY:
             if state.terrain.terrain_type == battle_state.TerrainType.FOREST:
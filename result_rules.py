@@ -0,0 +1,103 @@
+from __future__ import annotations
+import random
+from abc import ABC, abstractmethod
+from enum import StrEnum
+from loguru import logger
+import battle_state
+import dice
+
+# Result modification base and the round rules shared by the modifications and by the effects describing them, kept
+# apart from result_modifier so that effects can use them without importing the modifications built from effects.
+
+class ResultModificationTarget(StrEnum):
+    PLAYER = "Player"
+    ENEMY = "Enemy"
+
+class ResultModification(ABC):
+    def __init__(self) -> None:
+        self.once_per_combat: bool
+        self.once_per_round: bool
+        self.used_this_combat: bool
+        self.used_this_round: bool
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        pass
+
+    def __repr__(self) -> str:
+        return self.name
+    
+    @abstractmethod
+    def modify_result(self, state: battle_state.BattleState) -> None:
+        pass
+
+class RerollModification(ResultModification):
+    def __init__(self, target: ResultModificationTarget, reroll_count: int, reroll_priority: list[dice.DiceNames] = dice.STANDARD_DICE_PRIORITY) -> None:
+        super().__init__()
+        self.target = target
+        self.reroll_count = reroll_count
+        self.reroll_priority = reroll_priority
+
+    def reroll_die(self, dice_pool: dice.DicePool, dice_results: dice.DiceRollResults, rng: random.Random):
+        for dice_type_name in self.reroll_priority:
+            for die in dice_pool.dice:
+                if die.name == dice_type_name and not die.rerolled and die.result.blanks == 1:
+                    logger.debug(f"Rerolling dice {die.name} with result {die.result}")
+                    dice_results.blanks -= 1
+                    die.roll(rng)
+                    die.rerolled = True
+                    dice_results.add_die_result(die.result)
+                    logger.debug(f"New result: {die.result}")
+                    return
+
+    def reroll_dice(self, dice_pool: dice.DicePool, dice_results: dice.DiceRollResults, rng: random.Random) -> None:
+        if dice_results.blanks == 0:
+            logger.debug(f"No blanks to reroll")
+            return
+    
+        for _ in range(self.reroll_count):
+            self.reroll_die(dice_pool, dice_results, rng)
+        for die in dice_pool.dice:
+            die.rerolled = False
+        logger.debug(f"New dice roll results after rerolling: {dice_results}")
+    
+    def modify_result(self, state: battle_state.BattleState) -> None:
+        logger.debug(f"Rerolling dice (with reroll count {self.reroll_count}) for {self.target}")
+        if self.target == ResultModificationTarget.PLAYER:
+            self.reroll_dice(state.player_army.current_dice_pool, state.player_roll_results, state.rng)
+        else:
+            self.reroll_dice(state.enemy_army.current_dice_pool, state.enemy_roll_results, state.rng)
+
+    @property
+    def name(self) -> str:
+        return "RerollModification" 
+
+def player_will_take_damage(state: battle_state.BattleState) -> bool:
+    if (state.player_roll_results.shields - state.enemy_roll_results.bolts) < state.enemy_roll_results.skulls:
+        logger.debug(f"The enemy will deal damage to the player units without intervention")
+        return True
+    logger.debug(f"The player will not take damage from the enemy roll")
+    return False
+
+def damage_needed_to_kill_enemy(state: battle_state.BattleState):
+    hit_points: int
+    if len(state.enemy_army.units) == 1:
+        unit_name = state.enemy_army.units[0].name
+        if "Garrison" in unit_name:
+            hit_points = int(unit_name[-1])
+        else:
+            hit_points = 1
+    else:
+        hit_points = len(state.enemy_army.units)
+    damage_incoming = state.player_roll_results.skulls
+    damage_needed = hit_points + state.enemy_roll_results.shields - damage_incoming
+    logger.debug(f"Enemy has {hit_points} 'hit points' and {state.enemy_roll_results.shields} shields")
+    logger.debug(f"Player has {damage_incoming} skulls and thus needs to deal {damage_needed} damage more")
+    return damage_needed
+
+def return_zero_for_negative(num):
+    if num < 0:
+        return 0
+    else:
+        return num
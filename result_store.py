@@ -0,0 +1,246 @@
+from __future__ import annotations
+import hashlib
+import json
+import struct
+from dataclasses import dataclass, replace
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING
+import numpy as np
+import pandas as pd
+from loguru import logger
+from battle_aggregate import BattleAggregate
+from battle_state import BattleResult, OverallBattleResult, OUTCOME_CODES
+from result_arena import COLUMN_ALIGNMENT, column_offsets
+
+if TYPE_CHECKING:
+    from battle_orchestrator import BattleConfig
+
+# On-disk layout of a result file: a fixed header followed by one contiguous, cache line aligned column per field.
+# Seeds are not stored per battle, they follow from the base seed and battle index in the header like in a run.
+RESULT_FILE_MAGIC = b"UPRBATTL"
+RESULT_FILE_VERSION = 1
+RESULT_FILE_SUFFIX = ".battles"
+HEADER_FORMAT = struct.Struct("<8sHHIqqqqQ")
+HEADER_SIZE = COLUMN_ALIGNMENT
+RESULT_FILE_COLUMNS: dict[str, np.dtype] = {"outcome": np.dtype(np.int8),
+                                            "net_resources": np.dtype(np.int16),
+                                            "rounds": np.dtype(np.uint8)}
+NO_SEED = -1
+
+def config_hash(battle_config: BattleConfig) -> int:
+    """Stable 64 bit hash of what a battle config is made of, to tell runs of different configs apart on disk."""
+    def name(cls) -> str:
+        if not isinstance(cls, partial):
+            return f"{cls.__module__}.{cls.__qualname__}"
+        # Bound modifications such as a solved bolt policy are named after their class and the fingerprints of what they
+        # are bound to, so runs of different policies are never merged.
+        bound = list(cls.args) + [value for _, value in sorted(cls.keywords.items())]
+        if not all(hasattr(value, "fingerprint") for value in bound):
+            raise ValueError(f"Cannot hash {cls}, bind modifications only to values with a fingerprint()")
+        return f"{name(cls.func)}({', '.join(value.fingerprint() for value in bound)})"
+
+    def names(classes) -> list[str]:
+        return [name(cls) for cls in classes]
+    description = {"player": names([battle_config.player_army_config.army_type] + battle_config.player_army_config.units),
+                   "enemy": names([battle_config.enemy_army_config.army_type] + battle_config.enemy_army_config.units),
+                   "terrain": str(battle_config.terrain.terrain_type),
+                   "roll_modifications": names(battle_config.battle_roll_modifications),
+                   "result_modifications": names(battle_config.battle_result_modifications)}
+    digest = hashlib.blake2b(json.dumps(description).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+@dataclass(frozen=True)
+class ResultFileHeader:
+    battle_count: int
+    rows_written: int
+    base_seed: int
+    first_battle_index: int
+    config_hash: int
+    complete: bool = False
+
+    def pack(self) -> bytes:
+        return HEADER_FORMAT.pack(RESULT_FILE_MAGIC, RESULT_FILE_VERSION, int(self.complete), 0, self.battle_count,
+                                  self.rows_written, self.base_seed, self.first_battle_index, self.config_hash)
+
+    @classmethod
+    def unpack(cls, data: bytes, path: Path) -> "ResultFileHeader":
+        magic, version, complete, _, battle_count, rows_written, base_seed, first_battle_index, hash_value = \
+            HEADER_FORMAT.unpack(data[:HEADER_FORMAT.size])
+        if magic != RESULT_FILE_MAGIC:
+            raise ValueError(f"{path} is not a battle result file")
+        if version != RESULT_FILE_VERSION:
+            raise ValueError(f"{path} has result file version {version}, only version {RESULT_FILE_VERSION} can be read")
+        return cls(battle_count, rows_written, base_seed, first_battle_index, hash_value, bool(complete))
+
+def file_size(battle_count: int) -> int:
+    _, size = column_offsets(battle_count, RESULT_FILE_COLUMNS)
+    return HEADER_SIZE + size
+
+def column_views(raw: np.ndarray, battle_count: int) -> dict[str, np.ndarray]:
+    offsets, _ = column_offsets(battle_count, RESULT_FILE_COLUMNS)
+    return {name: raw[HEADER_SIZE + offsets[name]:HEADER_SIZE + offsets[name] + battle_count * dtype.itemsize].view(dtype)
+            for name, dtype in RESULT_FILE_COLUMNS.items()}
+
+class ResultFileWriter:
+    """Appends battle results to a preallocated, memory-mapped result file.
+
+    The header counts the rows written so far after every append, so the file can be read while the run is going
+    and the finished part of an interrupted run stays usable. Rows must be appended in battle index order."""
+    def __init__(self, path: str | Path, battle_count: int, base_seed: int = NO_SEED, config_hash: int = 0,
+                 first_battle_index: int = 0) -> None:
+        from battle_orchestrator import run_base_seed
+        if base_seed != NO_SEED:
+            run_base_seed(base_seed)
+        self.path = Path(path)
+        self.header = ResultFileHeader(battle_count, 0, base_seed, first_battle_index, config_hash)
+        self.raw = np.memmap(self.path, np.uint8, mode="w+", shape=(file_size(battle_count),))
+        self.columns = column_views(self.raw, battle_count)
+        self.write_header()
+
+    def write_header(self) -> None:
+        self.raw[:HEADER_FORMAT.size] = np.frombuffer(self.header.pack(), np.uint8)
+
+    def append_columns(self, outcome: np.ndarray, net_resources: np.ndarray, rounds: np.ndarray) -> None:
+        start = self.header.rows_written
+        stop = start + len(outcome)
+        if stop > self.header.battle_count:
+            raise ValueError(f"Result file {self.path} holds {self.header.battle_count} battles, cannot append up to {stop}")
+        for name, values in (("outcome", outcome), ("net_resources", net_resources), ("rounds", rounds)):
+            limits = np.iinfo(RESULT_FILE_COLUMNS[name])
+            if len(values) > 0 and (values.min() < limits.min or values.max() > limits.max):
+                raise ValueError(f"Values of {name} outside of [{limits.min}, {limits.max}] do not fit a result file")
+            self.columns[name][start:stop] = values
+        self.header = replace(self.header, rows_written=stop)
+        self.write_header()
+
+    def append_results(self, battle_results: list[BattleResult]) -> None:
+        self.append_columns(np.array([OUTCOME_CODES[battle_result.overall_result] for battle_result in battle_results], np.int64),
+                            np.array([battle_result.player_net_resources for battle_result in battle_results], np.int64),
+                            np.array([battle_result.rounds for battle_result in battle_results], np.int64))
+
+    def close(self) -> None:
+        if self.raw is None:
+            return
+        self.header = replace(self.header, complete=self.header.rows_written == self.header.battle_count)
+        self.write_header()
+        self.raw.flush()
+        self.columns = {}
+        self.raw = None
+        logger.debug(f"Wrote {self.header.rows_written} battles to {self.path}")
+
+    def __enter__(self) -> "ResultFileWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+class ResultExporter:
+    """Streams the results of a run to a result file as they come in, or does nothing if no path is given."""
+    def __init__(self, path: str | Path | None, battle_count: int, base_seed: int = NO_SEED, config_hash: int = 0) -> None:
+        self.path = Path(path) if path is not None else None
+        self.battle_count = battle_count
+        self.base_seed = base_seed
+        self.config_hash = config_hash
+        self.writer: ResultFileWriter | None = None
+
+    def export(self, battle_results: list[BattleResult]) -> None:
+        if self.writer is not None:
+            self.writer.append_results(battle_results)
+
+    def export_columns(self, outcome: np.ndarray, net_resources: np.ndarray, rounds: np.ndarray) -> None:
+        if self.writer is not None:
+            self.writer.append_columns(outcome, net_resources, rounds)
+
+    def __enter__(self) -> "ResultExporter":
+        if self.path is not None:
+            self.writer = ResultFileWriter(self.path, self.battle_count, self.base_seed, self.config_hash)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+class ResultFile:
+    """Read-only view of a result file. The columns are memory-mapped, so opening a file reads nothing but the header."""
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.raw = np.memmap(self.path, np.uint8, mode="r")
+        self.header = ResultFileHeader.unpack(self.raw[:HEADER_SIZE].tobytes(), self.path)
+        if len(self.raw) < file_size(self.header.battle_count):
+            raise ValueError(f"Result file {self.path} is truncated")
+        self.columns = {name: column[:self.header.rows_written]
+                        for name, column in column_views(self.raw, self.header.battle_count).items()}
+
+    def __len__(self) -> int:
+        return self.header.rows_written
+
+    @property
+    def outcome(self) -> np.ndarray:
+        return self.columns["outcome"]
+
+    @property
+    def net_resources(self) -> np.ndarray:
+        return self.columns["net_resources"]
+
+    @property
+    def rounds(self) -> np.ndarray:
+        return self.columns["rounds"]
+
+    @property
+    def config_hash(self) -> int:
+        return self.header.config_hash
+
+    @property
+    def battle_index(self) -> np.ndarray:
+        return np.arange(self.header.first_battle_index, self.header.first_battle_index + len(self), dtype=np.int64)
+
+    @property
+    def seed(self) -> np.ndarray:
+        """Seed of every battle for replay_battle, or NO_SEED for runs whose battles cannot be replayed one by one."""
+        from battle_orchestrator import battle_seed
+        if self.header.base_seed == NO_SEED:
+            return np.full(len(self), NO_SEED, dtype=np.int64)
+        return battle_seed(self.header.base_seed, self.battle_index)
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        if column in self.columns:
+            return self.columns[column]
+        if column == "config_hash":
+            return np.full(len(self), self.config_hash, dtype=np.uint64)
+        return getattr(self, column)
+
+    def aggregate(self) -> BattleAggregate:
+        return BattleAggregate.from_results(self)
+
+    def outcome_frequencies(self) -> dict[OverallBattleResult, float]:
+        counts = np.bincount(self.outcome, minlength=len(OUTCOME_CODES))
+        return {result: counts[code] / max(len(self), 1) for result, code in OUTCOME_CODES.items()}
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """DataFrame of all columns. The stored columns stay backed by the file."""
+        return pd.DataFrame({"battle_index": self.battle_index, **self.columns, "seed": self.seed,
+                             "config_hash": self["config_hash"]}, copy=False)
+
+class ResultFileSet:
+    """Result files of many runs, for analysis across them without loading them into memory."""
+    def __init__(self, paths: list[str | Path]) -> None:
+        self.files = [ResultFile(path) for path in paths]
+
+    @classmethod
+    def from_directory(cls, directory: str | Path, pattern: str = f"*{RESULT_FILE_SUFFIX}") -> "ResultFileSet":
+        return cls(sorted(Path(directory).glob(pattern)))
+
+    def __len__(self) -> int:
+        return sum(len(result_file) for result_file in self.files)
+
+    def aggregates_by_config(self) -> dict[int, BattleAggregate]:
+        """Exact statistics per config hash, merged over every run of that config."""
+        aggregates: dict[int, BattleAggregate] = {}
+        for result_file in self.files:
+            aggregates[result_file.config_hash] = aggregates.get(result_file.config_hash, BattleAggregate()).merge(result_file.aggregate())
+        return aggregates
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Copies every run into one DataFrame."""
+        return pd.concat([result_file.to_dataframe() for result_file in self.files], ignore_index=True)
@@ -2,6 +2,7 @@ from abc import abstractmethod
 import dice
 from loguru import logger
 import army
+from effects import RollEffect
 from battle_state import BattleState, TerrainType, BattleStage
 
 class RollModification:
@@ -23,6 +24,19 @@ class RollModification:
     def modify_roll(self, current_battle_state: BattleState) -> None:
         pass
 
+class DeclarativeRollModification(RollModification):
+    """A modification described by roll effects alone. Fast engines see its dice through the side tables."""
+    effects: tuple[RollEffect, ...] = ()
+
+    @property
+    def name(self) -> str:
+        return type(self).__name__
+
+    def modify_roll(self, current_battle_state: BattleState) -> None:
+        for effect in self.effects:
+            if effect.applies(current_battle_state):
+                effect.apply(current_battle_state)
+
 class RollModifier:
     def __init__(self) -> None:
         self.modification_list: list[RollModification] = []
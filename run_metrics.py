@@ -0,0 +1,149 @@
+from __future__ import annotations
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from loguru import logger
+
+METRIC_PREFIX = "uprising"
+
+@dataclass
+class WorkerCounters:
+    """Counters written by a single worker thread only, so increments need no lock."""
+    worker: int
+    battles: int = 0
+    rounds: int = 0
+    busy_seconds: float = 0.0
+    tasks_completed: int = 0
+
+@dataclass
+class RunSummary:
+    battles: int
+    total_battles: int
+    elapsed_seconds: float
+    battles_per_second: float
+    average_rounds: float
+    queue_depth: int
+    eta_seconds: float | None
+    worker_busy_seconds: dict[int, float]
+    worker_utilization: dict[int, float]
+
+    def __str__(self) -> str:
+        utilization = sum(self.worker_utilization.values()) / max(len(self.worker_utilization), 1)
+        return (f"{self.battles}/{self.total_battles} battles in {self.elapsed_seconds:.1f}s, "
+                f"{self.battles_per_second:.0f} battles/s, {self.average_rounds:.2f} rounds per battle, "
+                f"{len(self.worker_utilization)} workers {utilization:.0%} busy")
+
+@dataclass
+class RunMetrics:
+    """Live counters of a conduct_battles run, sharded per worker thread and summed only when read."""
+    total_battles: int
+    started: float = field(default_factory=time.perf_counter)
+    tasks_submitted: int = 0
+    shards: list[WorkerCounters] = field(default_factory=list)
+    local: threading.local = field(default_factory=threading.local)
+    registration_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def shard(self) -> WorkerCounters:
+        counters = getattr(self.local, "counters", None)
+        if counters is None:
+            with self.registration_lock:
+                counters = WorkerCounters(len(self.shards))
+                self.shards.append(counters)
+            self.local.counters = counters
+        return counters
+
+    def summary(self) -> RunSummary:
+        elapsed = time.perf_counter() - self.started
+        shards = list(self.shards)
+        battles = sum(counters.battles for counters in shards)
+        rounds = sum(counters.rounds for counters in shards)
+        rate = battles / elapsed if elapsed > 0 else 0.0
+        remaining = self.total_battles - battles
+        return RunSummary(battles, self.total_battles, elapsed, rate, rounds / battles if battles else 0.0,
+                          self.tasks_submitted - sum(counters.tasks_completed for counters in shards),
+                          remaining / rate if rate > 0 else None,
+                          {counters.worker: counters.busy_seconds for counters in shards},
+                          {counters.worker: counters.busy_seconds / elapsed if elapsed > 0 else 0.0 for counters in shards})
+
+    def render(self) -> str:
+        """Prometheus text exposition of the current counters."""
+        summary = self.summary()
+        lines = [f"# TYPE {METRIC_PREFIX}_battles_completed_total counter",
+                 f"{METRIC_PREFIX}_battles_completed_total {summary.battles}",
+                 f"# TYPE {METRIC_PREFIX}_battles_planned gauge",
+                 f"{METRIC_PREFIX}_battles_planned {summary.total_battles}",
+                 f"# TYPE {METRIC_PREFIX}_battles_per_second gauge",
+                 f"{METRIC_PREFIX}_battles_per_second {summary.battles_per_second:.3f}",
+                 f"# TYPE {METRIC_PREFIX}_average_rounds_per_battle gauge",
+                 f"{METRIC_PREFIX}_average_rounds_per_battle {summary.average_rounds:.4f}",
+                 f"# TYPE {METRIC_PREFIX}_queue_depth gauge",
+                 f"{METRIC_PREFIX}_queue_depth {summary.queue_depth}",
+                 f"# TYPE {METRIC_PREFIX}_eta_seconds gauge",
+                 f"{METRIC_PREFIX}_eta_seconds {summary.eta_seconds if summary.eta_seconds is not None else 'NaN'}",
+                 f"# TYPE {METRIC_PREFIX}_worker_busy_seconds_total counter"]
+        lines += [f'{METRIC_PREFIX}_worker_busy_seconds_total{{worker="{worker}"}} {busy:.6f}'
+                  for worker, busy in summary.worker_busy_seconds.items()]
+        lines += [f"# TYPE {METRIC_PREFIX}_worker_utilization gauge"]
+        lines += [f'{METRIC_PREFIX}_worker_utilization{{worker="{worker}"}} {utilization:.4f}'
+                  for worker, utilization in summary.worker_utilization.items()]
+        return "\n".join(lines) + "\n"
+
+class MetricsExporter:
+    """Rewrites a Prometheus text file (for the node exporter textfile collector) every interval seconds and/or
+    serves the metrics on a local HTTP endpoint while a run is going on."""
+    def __init__(self, metrics: RunMetrics, textfile: str | Path | None = None, interval: float = 5.0, port: int | None = None) -> None:
+        self.metrics = metrics
+        self.textfile = Path(textfile) if textfile is not None else None
+        self.interval = interval
+        self.port = port
+        self.stopped = threading.Event()
+        self.writer: threading.Thread | None = None
+        self.server: ThreadingHTTPServer | None = None
+
+    def write_textfile(self) -> None:
+        # Written next to the target and renamed, so the collector never reads a partial file.
+        with tempfile.NamedTemporaryFile("w", dir=self.textfile.parent, suffix=".tmp", delete=False) as temporary:
+            temporary.write(self.metrics.render())
+        os.replace(temporary.name, self.textfile)
+
+    def write_periodically(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.write_textfile()
+
+    def __enter__(self) -> "MetricsExporter":
+        if self.textfile is not None:
+            self.write_textfile()
+            self.writer = threading.Thread(target=self.write_periodically, daemon=True)
+            self.writer.start()
+        if self.port is not None:
+            metrics = self.metrics
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self) -> None:
+                    body = metrics.render().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args) -> None:
+                    pass
+
+            self.server = ThreadingHTTPServer(("127.0.0.1", self.port), MetricsHandler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            logger.info(f"Serving battle metrics on http://127.0.0.1:{self.server.server_port}/metrics")
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stopped.set()
+        if self.writer is not None:
+            self.writer.join()
+            self.write_textfile()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,166 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import IO, Iterator
+import numpy as np
+from loguru import logger
+import army
+import uprising_units
+import result_modifier
+import roll_modifier
+from batched_battle import BatchedBattleEngine
+from battle_orchestrator import ArmyConfig, BattleConfig, BattleOrchestrator
+from battle_state import OverallBattleResult, OUTCOME_CODES, Terrain, TerrainType
+
+@dataclass
+class ScenarioRegistry:
+    """Names that scenario files may use for units, armies, terrains and modifications."""
+    units: dict[str, type[uprising_units.Unit]] = field(default_factory=dict)
+    armies: dict[str, type[army.Army]] = field(default_factory=dict)
+    roll_modifications: dict[str, type[roll_modifier.RollModification]] = field(default_factory=dict)
+    result_modifications: dict[str, type[result_modifier.ResultModification]] = field(default_factory=dict)
+
+    def register_unit(self, unit: type[uprising_units.Unit]) -> "ScenarioRegistry":
+        self.units[unit.name] = unit
+        self.units[unit.__name__] = unit
+        return self
+
+    @staticmethod
+    def resolve(kind: str, names: dict, name: str):
+        if name not in names:
+            raise ValueError(f"Unknown {kind} {name!r}. Valid options are: {', '.join(names)}")
+        return names[name]
+
+    def terrain(self, name: str) -> Terrain:
+        terrains = {terrain.value: terrain for terrain in TerrainType} | {terrain.name: terrain for terrain in TerrainType}
+        return Terrain(self.resolve("terrain", terrains, name))
+
+    def army_config(self, army_description: dict) -> ArmyConfig:
+        return ArmyConfig(self.resolve("army", self.armies, army_description["army"]),
+                          [self.resolve("unit", self.units, unit) for unit in army_description["units"]])
+
+    def battle_config(self, scenario: dict) -> BattleConfig:
+        return BattleConfig(self.army_config(scenario["player"]), self.army_config(scenario["enemy"]),
+                            self.terrain(scenario["terrain"]),
+                            [self.resolve("roll modification", self.roll_modifications, name)
+                             for name in scenario.get("roll_modifications", [])],
+                            [self.resolve("result modification", self.result_modifications, name)
+                             for name in scenario.get("result_modifications", [])])
+
+DEFAULT_REGISTRY = ScenarioRegistry(
+    armies={"UnitsArmy": army.UnitsArmy, "ImperialArmy": army.ImperialArmy},
+    roll_modifications={"TerrainRollModification": roll_modifier.TerrainRollModification},
+    result_modifications={"LightOfTheThan": result_modifier.LightOfTheThan,
+                          "TerrainResultModification": result_modifier.TerrainResultModification,
+                          "DruidMountainHeart": result_modifier.DruidMountainHeart,
+                          "HarpoonersUpgrade": result_modifier.HarpoonersUpgrade})
+for registered_unit in (uprising_units.Garrison1, uprising_units.Garrison2, uprising_units.Garrison3, uprising_units.Stoneshell,
+                        uprising_units.CrabRider, uprising_units.Harpooneers, uprising_units.ReefKing):
+    DEFAULT_REGISTRY.register_unit(registered_unit)
+
+ENGINES = ("batched", "object")
+
+def read_scenarios(source: IO[str]) -> Iterator[tuple[int, dict | None, str | None]]:
+    """Lazily yields (line number, scenario, parse error) for every non blank line."""
+    for line_number, line in enumerate(source, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line), None
+        except json.JSONDecodeError as error:
+            yield line_number, None, f"Invalid JSON: {error}"
+
+def run_scenario(scenario: dict, registry: ScenarioRegistry = DEFAULT_REGISTRY) -> dict:
+    """Plays one scenario and summarizes it. Scenarios default to the batched engine; "engine": "object" uses the
+    reference BattleOrchestrator."""
+    start = time.perf_counter()
+    battle_config = registry.battle_config(scenario)
+    number_of_iterations = int(scenario.get("battles", 5000))
+    seed = scenario.get("seed")
+    engine = scenario.get("engine", "batched")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}. Valid options are: {', '.join(ENGINES)}")
+    if engine == "batched":
+        results = BatchedBattleEngine(battle_config, seed).run(number_of_iterations)
+        frequencies = results.outcome_frequencies()
+        net_resources = results.net_resources
+    else:
+        data = BattleOrchestrator(battle_config).conduct_battles(number_of_iterations, seed).data
+        frequencies = {result: float((data["victor"] == result).mean()) for result in OUTCOME_CODES}
+        net_resources = data["net_resources"].to_numpy()
+    return {"victory": float(frequencies[OverallBattleResult.player_victory]),
+            "draw": float(frequencies[OverallBattleResult.draw]),
+            "defeat": float(frequencies[OverallBattleResult.player_defeat]),
+            "net_resources_mean": float(np.mean(net_resources)),
+            "net_resources_std": float(np.std(net_resources)),
+            "battles": number_of_iterations,
+            "seconds": round(time.perf_counter() - start, 6)}
+
+def summary_line(line_number: int, scenario: dict | None, summary: dict | None = None, error: str | None = None) -> str:
+    head = {"line": line_number}
+    if isinstance(scenario, dict) and "name" in scenario:
+        head["name"] = scenario["name"]
+    body = {"error": error} if error is not None else summary
+    return json.dumps(head | body)
+
+def run_scenarios(source: IO[str], output: IO[str], executor: Executor, max_pending: int,
+                  registry: ScenarioRegistry = DEFAULT_REGISTRY) -> int:
+    """Streams scenarios from source through the executor and writes one summary line per scenario to output as soon
+    as it finishes, so results arrive in completion order. At most max_pending scenarios are read ahead. The registry
+    is sent along with every scenario, so process pools need one that pickles."""
+    pending: dict[Future, tuple[int, dict]] = {}
+    finished = 0
+
+    def write_finished(done: set[Future]) -> None:
+        nonlocal finished
+        for future in done:
+            line_number, scenario = pending.pop(future)
+            try:
+                output.write(summary_line(line_number, scenario, future.result()) + "\n")
+            except Exception as error:
+                logger.warning(f"Scenario on line {line_number} failed: {error}")
+                output.write(summary_line(line_number, scenario, error=f"{type(error).__name__}: {error}") + "\n")
+            finished += 1
+        output.flush()
+
+    for line_number, scenario, parse_error in read_scenarios(source):
+        if parse_error is not None or not isinstance(scenario, dict):
+            output.write(summary_line(line_number, None, error=parse_error or "Scenario must be a JSON object") + "\n")
+            output.flush()
+            finished += 1
+            continue
+        pending[executor.submit(run_scenario, scenario, registry)] = (line_number, scenario)
+        done, _ = wait(pending, timeout=0 if len(pending) < max_pending else None, return_when=FIRST_COMPLETED)
+        write_finished(done)
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        write_finished(done)
+    return finished
+
+def main(arguments: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Run battle scenarios from a JSON lines file and stream one summary per line")
+    parser.add_argument("scenarios", nargs="?", default="-", help="JSON lines file with one scenario per line, - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="File for the JSON lines summaries, - for stdout")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes")
+    parsed = parser.parse_args(arguments)
+
+    source = sys.stdin if parsed.scenarios == "-" else open(parsed.scenarios, encoding="utf-8")
+    output = sys.stdout if parsed.output == "-" else open(parsed.output, "w", encoding="utf-8")
+    try:
+        workers = parsed.workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(workers) as executor:
+            finished = run_scenarios(source, output, executor, 2 * workers)
+        logger.info(f"Finished {finished} scenarios")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()
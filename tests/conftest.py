@@ -0,0 +1,35 @@
+import sys
+from dataclasses import replace
+import pytest
+from loguru import logger
+import army
+import result_modifier
+import roll_modifier
+import uprising_units
+from battle_orchestrator import ArmyConfig, BattleConfig
+from battle_state import Terrain, TerrainType
+
+# The engines log every roll at debug level, which would dominate the test run.
+logger.remove()
+logger.add(sys.stderr, level="WARNING")
+
+@pytest.fixture
+def battle_config() -> BattleConfig:
+    """Forest battle with every result modification."""
+    return BattleConfig(ArmyConfig(army.UnitsArmy, [uprising_units.Stoneshell, uprising_units.CrabRider, uprising_units.CrabRider,
+                                                    uprising_units.Harpooneers, uprising_units.Harpooneers]),
+                        ArmyConfig(army.ImperialArmy, [uprising_units.Garrison2]),
+                        Terrain(TerrainType.FOREST), [roll_modifier.TerrainRollModification],
+                        [result_modifier.LightOfTheThan, result_modifier.TerrainResultModification,
+                         result_modifier.DruidMountainHeart, result_modifier.HarpoonersUpgrade])
+
+@pytest.fixture
+def plain_battle_config() -> BattleConfig:
+    """A short battle without modifications."""
+    return BattleConfig(ArmyConfig(army.UnitsArmy, [uprising_units.CrabRider, uprising_units.Harpooneers]),
+                        ArmyConfig(army.ImperialArmy, [uprising_units.Garrison1]), Terrain(TerrainType.FROZEN_WASTES), [], [])
+
+@pytest.fixture
+def mountain_battle_config(battle_config: BattleConfig) -> BattleConfig:
+    return replace(battle_config, enemy_army_config=ArmyConfig(army.ImperialArmy, [uprising_units.Garrison3]),
+                   terrain=Terrain(TerrainType.MOUNTAIN))
@@ -0,0 +1,44 @@
+import cProfile
+import sys
+import tracemalloc
+import pytest
+from allocation_profile import AllocationBudget, AllocationBudgetExceeded, max_rss_bytes, reset_peak_rss
+from battle_orchestrator import BattleOrchestrator
+
+@pytest.fixture(scope="module")
+def report():
+    from benchmarks import benchmark_battle_config
+    return BattleOrchestrator(benchmark_battle_config()).profile_allocations(40, seed=2, sampled_battles=4)
+
+def test_battles_allocate_from_package_functions(report):
+    assert not tracemalloc.is_tracing()
+    assert (report.battles, report.sampled_battles) == (40, 4)
+    assert report.peak_bytes_per_battle > 0
+    assert report.max_peak_bytes >= report.peak_bytes_per_battle
+    assert report.allocated_blocks_per_battle >= report.live_blocks_per_battle
+    assert report.by_source["allocated_blocks_per_battle"].sum() == pytest.approx(report.allocated_blocks_per_battle)
+    assert {"battle", "dice"} <= set(report.by_source["module"])
+
+def test_budgets_flag_every_measure_over_its_limit(report):
+    report.check(AllocationBudget(peak_bytes_per_battle=report.peak_bytes_per_battle + 1))
+    with pytest.raises(AllocationBudgetExceeded, match="peak_bytes_per_battle"):
+        report.check(AllocationBudget(peak_bytes_per_battle=report.peak_bytes_per_battle / 2, live_bytes_per_battle=None))
+
+def test_profiling_works_next_to_cprofile(plain_battle_config):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        report = BattleOrchestrator(plain_battle_config).profile_allocations(5, seed=1, sampled_battles=2)
+    finally:
+        profiler.disable()
+    assert report.by_source["allocated_blocks_per_battle"].sum() > 0
+    assert sys.monitoring.get_tool(sys.monitoring.PROFILER_ID) is None
+
+def test_peak_rss_is_of_the_run():
+    ballast = bytearray(200_000_000)
+    ballast[::4096] = bytes(len(ballast[::4096]))
+    peak = max_rss_bytes()
+    del ballast
+    if not reset_peak_rss():
+        pytest.skip("the peak resident set size cannot be reset on this platform")
+    assert max_rss_bytes() < peak - 100_000_000
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from batched_battle import BatchedBattleEngine
+from battle_orchestrator import BattleOrchestrator
+from battle_state import OverallBattleResult, OUTCOME_CODES
+from result_rules import ResultModification
+
+def test_same_seed_plays_the_same_battles(battle_config):
+    first = BatchedBattleEngine(battle_config, 7).run(2000)
+    second = BatchedBattleEngine(battle_config, 7).run(2000)
+    assert np.array_equal(first.outcome, second.outcome)
+    assert np.array_equal(first.net_resources, second.net_resources)
+    assert np.array_equal(first.rounds, second.rounds)
+
+def test_every_battle_is_decided(battle_config):
+    results = BatchedBattleEngine(battle_config, 0).run(5000, chunk_size=1500)
+    assert len(results) == 5000
+    assert not (results.outcome == OUTCOME_CODES[OverallBattleResult.undecided]).any()
+    assert (results.rounds >= 1).all()
+    assert sum(results.outcome_frequencies().values()) == pytest.approx(1.0)
+
+def test_agrees_with_the_reference_engine(battle_config):
+    battles = 4000
+    batched = BatchedBattleEngine(battle_config, 1).run(battles)
+    reference = BattleOrchestrator(battle_config).conduct_battles(battles, 2).data
+    reference_net = reference["net_resources"].to_numpy()
+    standard_error = np.sqrt(batched.net_resources.var() / battles + reference_net.var() / battles)
+    assert abs(batched.net_resources.mean() - reference_net.mean()) < 4 * standard_error
+
+def test_modifications_without_effects_are_rejected(battle_config):
+    class Opaque(ResultModification):
+        name = "Opaque"
+
+        def modify_result(self, state) -> None:
+            pass
+
+    battle_config.battle_result_modifications = [Opaque]
+    with pytest.raises(ValueError, match="not supported by the batched engine"):
+        BatchedBattleEngine(battle_config, 0)
@@ -0,0 +1,33 @@
+import random
+import pytest
+import dice
+import uprising_units
+from battle_orchestrator import BattleOrchestrator, battle_seed
+
+def test_results_do_not_depend_on_the_thread_count(battle_config):
+    orchestrator = BattleOrchestrator(battle_config)
+    single = orchestrator.conduct_battles(2000, 9, threads=1, slice_size=100).data
+    threaded = orchestrator.conduct_battles(2000, 9, threads=4, slice_size=100).data
+    assert single.equals(threaded)
+
+def test_battles_leave_the_module_generator_alone(battle_config):
+    orchestrator = BattleOrchestrator(battle_config)
+    state = random.getstate()
+    first = orchestrator.execute_battle(random.Random(battle_seed(3, 14)))
+    assert random.getstate() == state
+    second = orchestrator.execute_battle(random.Random(battle_seed(3, 14)))
+    assert (first.overall_result, first.player_net_resources, first.rounds) == \
+           (second.overall_result, second.player_net_resources, second.rounds)
+
+@pytest.mark.parametrize("unit", [uprising_units.Garrison1, uprising_units.Garrison2, uprising_units.Garrison3, uprising_units.Stoneshell,
+                                  uprising_units.CrabRider, uprising_units.Harpooneers, uprising_units.ReefKing])
+def test_unit_attributes_read_from_the_class(unit):
+    assert isinstance(unit.name, str)
+    assert isinstance(unit.cost, int)
+    assert isinstance(unit.unit_type, str)
+    assert unit().archery_dice is not unit().archery_dice
+
+def test_dice_roll_without_a_generator():
+    pool = dice.DicePool().add_die(dice.WhiteDie()).add_die(dice.BlueDie())
+    results = pool.roll_dice()
+    assert results.skulls + results.shields + results.bolts + results.stars + results.blanks >= 2
@@ -0,0 +1,22 @@
+from battle_orchestrator import BattleOrchestrator, battle_seed
+from battle_state import BattleStage
+
+def test_replays_match_the_recorded_run(battle_config):
+    orchestrator = BattleOrchestrator(battle_config)
+    meta_results = orchestrator.conduct_battles(200, 21, slice_size=50)
+    for row in meta_results.data.iloc[::17].itertuples():
+        trace = orchestrator.replay_battle(row.battle_index, meta_results.seed)
+        assert trace.seed == battle_seed(21, row.battle_index)
+        assert trace.result.overall_result == row.victor
+        assert trace.result.player_net_resources == row.net_resources
+
+def test_traces_follow_every_round(battle_config):
+    trace = BattleOrchestrator(battle_config).replay_battle(5, 21)
+    assert len(trace.rounds) == trace.result.rounds
+    assert trace.rounds[0].stage == BattleStage.ARHCERY
+    assert all(round_trace.stage == BattleStage.CLASH for round_trace in trace.rounds[1:])
+    assert [modification.name for modification in trace.rounds[0].modifications] == \
+           [modification().name for modification in battle_config.battle_result_modifications]
+    assert trace.rounds[-1].net_resources == trace.result.player_net_resources
+    assert trace.log
+    assert str(trace).startswith(f"Battle 5 (seed {battle_seed(21, 5)})")
@@ -0,0 +1,71 @@
+import random
+from dataclasses import replace
+import numpy as np
+import pytest
+import effects
+from battle import Battle
+from battle_orchestrator import BattleOrchestrator
+from battle_snapshot import BattleSnapshot, simulate_snapshot, simulate_snapshots, snapshot_groups, solve_snapshot
+from battle_state import BattleStage
+from batched_battle import BatchedBattleEngine
+from policy_solver import BoltPolicySolver
+from result_modifier import DeclarativeResultModification
+
+class TradeForFood(DeclarativeResultModification):
+    effects = (effects.TradeBoltForResource(per_combat_limit=2),)
+
+def modifications(battle_config):
+    return battle_config.battle_roll_modifications, battle_config.battle_result_modifications
+
+def played_archery(battle_config, seed: int) -> Battle:
+    battle = BattleSnapshot.from_config(battle_config).restore(*modifications(battle_config), random.Random(seed))
+    battle.archery_round()
+    battle.battle_state.battle_stage = BattleStage.CLASH
+    return battle
+
+def test_restored_start_plays_like_a_fresh_battle(battle_config):
+    snapshot = BattleSnapshot.from_config(battle_config)
+    for seed in range(20):
+        resumed = snapshot.restore(*modifications(battle_config), random.Random(seed)).resume()
+        fresh = BattleOrchestrator(battle_config).execute_battle(random.Random(seed))
+        assert (resumed.overall_result, resumed.player_net_resources, resumed.rounds) == \
+               (fresh.overall_result, fresh.player_net_resources, fresh.rounds)
+
+def test_mid_battle_snapshots_round_trip(battle_config):
+    for seed in range(20):
+        snapshot = BattleSnapshot.capture(played_archery(battle_config, seed))
+        assert snapshot.battle_stage == BattleStage.CLASH
+        assert BattleSnapshot.capture(snapshot.restore(*modifications(battle_config))) == snapshot
+
+def test_declarative_memory_survives_a_round_trip(battle_config):
+    battle = played_archery(replace(battle_config, battle_result_modifications=[TradeForFood]), 0)
+    battle.result_modifier.modification_list[0].memory[0]["uses"] = 2
+    snapshot = BattleSnapshot.capture(battle)
+    assert snapshot.bolt_trades == 2
+    restored = snapshot.restore(battle_config.battle_roll_modifications, [TradeForFood])
+    assert restored.result_modifier.modification_list[0].memory == [{"uses": 2}]
+    assert BattleSnapshot.capture(restored) == snapshot
+
+def test_fed_flags_must_line_up_with_the_units(battle_config):
+    with pytest.raises(ValueError):
+        replace(BattleSnapshot.from_config(battle_config), harpooneers_fed=(True,))
+
+def test_simulated_start_matches_the_batched_engine(battle_config):
+    simulated = simulate_snapshot(BattleSnapshot.from_config(battle_config), *modifications(battle_config), 20_000, seed=1)
+    results = BatchedBattleEngine(battle_config, 2).run(20_000)
+    error = np.sqrt(simulated.net_resources.var() / len(simulated) + results.net_resources.var() / len(results))
+    assert abs(simulated.net_resources.mean() - results.net_resources.mean()) < 4 * error
+
+def test_branches_share_a_batch_with_their_base(battle_config):
+    base = BattleSnapshot.from_config(battle_config)
+    branch = replace(base, player_units=base.player_units[1:], harpooneers_fed=(), battle_stage=BattleStage.ARHCERY)
+    groups = snapshot_groups([branch, base])
+    assert groups == [(base, [1, 0])]
+    branch_results, _ = simulate_snapshots([branch, base], *modifications(battle_config), 20_000, seed=3)
+    alone = BatchedBattleEngine(branch.battle_config(*modifications(battle_config)), 4).run(20_000)
+    error = np.sqrt(branch_results.net_resources.var() / len(branch_results) + alone.net_resources.var() / len(alone))
+    assert abs(branch_results.net_resources.mean() - alone.net_resources.mean()) < 4 * error
+
+def test_solved_start_is_the_policy_value(battle_config):
+    expected = BoltPolicySolver(battle_config).solve().expected_value
+    assert solve_snapshot(BattleSnapshot.from_config(battle_config), *modifications(battle_config)) == pytest.approx(expected)
@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+import benchmarks
+from battle_orchestrator import BattleOrchestrator
+from battle_state import OverallBattleResult
+
+def test_ground_truth_comes_from_the_reference_engine(plain_battle_config):
+    win_probability, net_resources, _, _ = benchmarks.ground_truth(plain_battle_config, 1000, 6)
+    data = BattleOrchestrator(plain_battle_config).conduct_battles(1000, 6).data
+    assert win_probability == pytest.approx((data["victor"] == OverallBattleResult.player_victory).mean())
+    assert net_resources == pytest.approx(data["net_resources"].mean())
+
+def test_cpu_time_scales_with_the_squared_error_ratio():
+    accuracy = benchmarks.StrategyAccuracy("scenario", "batched", 1000, 5, 2.0, 0.01, 0.1)
+    assert accuracy.cpu_seconds_for(0.01, 0.005) == pytest.approx(8.0)
+
+def test_accuracy_table_covers_every_budget(monkeypatch, plain_battle_config):
+    monkeypatch.setitem(benchmarks.ESTIMATION_STRATEGIES, "batched", (benchmarks.estimate_batched, [500, 2000]))
+    monkeypatch.setitem(benchmarks.ESTIMATION_STRATEGIES, "two_stage", (benchmarks.estimate_two_stage, [500]))
+    table = benchmarks.accuracy_per_cpu_second({"plain": plain_battle_config}, ["batched", "two_stage"], repetitions=2,
+                                               ground_truth_battles=4000)
+    assert list(zip(table["strategy"], table["battles"])) == [("batched", 500), ("batched", 2000), ("two_stage", 500)]
+    assert (table["win_probability_rmse"] >= 0).all()
+    assert (table["ground_truth_win_probability_error"] > 0).all()
+    summary = benchmarks.strategy_summary(table)
+    assert set(summary["strategy"]) == {"batched", "two_stage"}
+    target_column = [column for column in summary.columns if column.startswith("cpu_seconds_for_")][0]
+    assert summary[target_column].is_monotonic_increasing
+
+def test_strategy_summary_puts_the_cheapest_first():
+    table = pd.DataFrame({"scenario": ["s"] * 3, "strategy": ["slow", "fast", "fast"],
+                          "cpu_seconds_for_win_probability_rmse_0.001": [10.0, 1.0, 3.0]})
+    summary = benchmarks.strategy_summary(table)
+    assert list(summary["strategy"]) == ["fast", "slow"]
+    assert summary["cpu_seconds_for_win_probability_rmse_0.001"].tolist() == [2.0, 10.0]
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+import army
+import uprising_units
+from batched_battle import BatchedBattleEngine
+from battle_orchestrator import ArmyConfig
+from battle_state import OverallBattleResult, Terrain, TerrainType
+from campaign import CampaignBattle, CampaignSimulator
+
+def campaign_battles(battle_config, count: int) -> list[CampaignBattle]:
+    return [CampaignBattle(battle_config.enemy_army_config, battle_config.terrain)] * count
+
+def simulator(battle_config, battles: list[CampaignBattle], seed: int = 0) -> CampaignSimulator:
+    return CampaignSimulator(battle_config.player_army_config, battles, battle_config.battle_roll_modifications,
+                             battle_config.battle_result_modifications, seed)
+
+def test_single_battle_campaign_is_a_battle(battle_config):
+    results = simulator(battle_config, campaign_battles(battle_config, 1)).run(20_000)
+    assert results.paths["probability"].sum() == pytest.approx(1.0)
+    battles = BatchedBattleEngine(battle_config, 1).run(20_000)
+    victory = battles.outcome_frequencies()[OverallBattleResult.player_victory]
+    assert abs(results.campaign_won_probability() - victory) < 4 * np.sqrt(2 * victory * (1 - victory) / 20_000)
+    error = np.sqrt(2 * battles.net_resources.var() / 20_000)
+    assert abs(results.net_resources_mean() - battles.net_resources.mean()) < 4 * error
+
+def test_later_battles_are_only_fought_after_victories(battle_config):
+    results = simulator(battle_config, campaign_battles(battle_config, 3)).run(5000)
+    assert results.paths["probability"].sum() == pytest.approx(1.0)
+    for outcomes in results.paths["outcomes"]:
+        assert all(outcome == OverallBattleResult.player_victory for outcome in outcomes[:-1])
+    first_won = results.paths["outcomes"].map(lambda outcomes: outcomes[0] == OverallBattleResult.player_victory)
+    assert 0 < results.campaign_won_probability() < results.paths.loc[first_won, "probability"].sum()
+
+def test_battle_ends_are_memoized(battle_config):
+    campaign = simulator(battle_config, campaign_battles(battle_config, 1))
+    survivors = tuple(battle_config.player_army_config.units)
+    first = campaign.transitions(survivors, campaign.battles[0], 1000)
+    assert campaign.transitions(survivors, campaign.battles[0], 500) is first
+    assert campaign.battles_simulated == 1000
+    campaign.transitions(survivors, campaign.battles[0], 1500)
+    assert campaign.battles_simulated == first.battles == 1500
+
+def test_player_must_field_a_units_army(battle_config):
+    with pytest.raises(ValueError):
+        CampaignSimulator(ArmyConfig(army.ImperialArmy, [uprising_units.Garrison1]),
+                          [CampaignBattle(battle_config.enemy_army_config, Terrain(TerrainType.FOREST))], [], [])
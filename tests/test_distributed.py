@@ -0,0 +1,161 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from functools import reduce
+import pytest
+import distributed
+from batched_battle import BatchedBattleEngine, concatenate_results
+from battle_aggregate import BattleAggregate
+from distributed import (AUTHKEY_VARIABLE, Coordinator, plan_shards, require_authkey, run_local_cluster, run_worker,
+                         simulate_shard)
+from result_rules import ResultModification
+
+AUTHKEY = b"test secret"
+
+class UncompiledModification(ResultModification):
+    def modify_result(self, state) -> None:
+        pass
+
+def sharded_reference(battle_config, battle_count: int, seed: int, block_size: int) -> BattleAggregate:
+    shards = plan_shards([battle_count], seed, 1, block_size)
+    return reduce(BattleAggregate.merge, [simulate_shard(battle_config, shard, block_size) for shard in shards])
+
+def stalling_worker(address, authkey) -> None:
+    distributed.simulate_shard = lambda *arguments: time.sleep(600)
+    run_worker(address, authkey)
+
+def wait_for_assignment(coordinator: Coordinator, timeout: float = 10.0) -> str:
+    deadline = time.monotonic() + timeout
+    while not coordinator.running:
+        assert time.monotonic() < deadline, "no worker took a shard"
+        time.sleep(0.01)
+    return coordinator.running[0].worker
+
+@pytest.fixture
+def aggregates(battle_config) -> tuple[list, list[BattleAggregate]]:
+    results = [BatchedBattleEngine(battle_config, seed).run(battles) for seed, battles in enumerate([300, 1, 700])]
+    return results, [BattleAggregate.from_results(result) for result in results]
+
+def test_merging_is_associative_and_commutative(aggregates):
+    _, (first, second, third) = aggregates
+    assert first.merge(second).merge(third) == first.merge(second.merge(third))
+    assert first.merge(second) == second.merge(first)
+    assert first.merge(BattleAggregate()) == first
+
+def test_merged_statistics_match_the_pooled_battles(aggregates):
+    results, parts = aggregates
+    merged = reduce(BattleAggregate.merge, parts)
+    pooled = concatenate_results(results)
+    assert merged == BattleAggregate.from_results(pooled)
+    assert merged.net_resources_mean == pytest.approx(pooled.net_resources.mean())
+    assert merged.net_resources_std == pytest.approx(pooled.net_resources.std(ddof=1))
+    assert merged.average_rounds == pytest.approx(pooled.rounds.mean())
+
+def test_shards_cover_every_block_once():
+    shards = plan_shards([25_000, 3000], base_seed=4, blocks_per_shard=2, block_size=10_000)
+    assert [(shard.config_index, shard.first_block, shard.stop_block) for shard in shards] == [(0, 0, 2), (0, 2, 3), (1, 0, 1)]
+    assert [shard.shard_id for shard in shards] == [0, 1, 2]
+
+def test_results_do_not_depend_on_the_sharding(battle_config):
+    def run(blocks_per_shard: int) -> BattleAggregate:
+        shards = plan_shards([5000], 4, blocks_per_shard, block_size=1000)
+        return reduce(BattleAggregate.merge, [simulate_shard(battle_config, shard, 1000) for shard in shards])
+    assert run(1) == run(3)
+    assert run(1).battles == 5000
+
+def test_authkey_is_required(monkeypatch):
+    monkeypatch.delenv(AUTHKEY_VARIABLE, raising=False)
+    with pytest.raises(ValueError):
+        require_authkey()
+    monkeypatch.setenv(AUTHKEY_VARIABLE, "from environment")
+    assert require_authkey() == b"from environment"
+    assert require_authkey(AUTHKEY) == AUTHKEY
+
+def test_coordinator_merges_worker_results(battle_config, plain_battle_config):
+    coordinator = Coordinator([battle_config, plain_battle_config], [3000, 1500], authkey=AUTHKEY, seed=8, block_size=1000)
+    workers = [threading.Thread(target=run_worker, args=(coordinator.address, AUTHKEY)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    results = coordinator.run()
+    for worker in workers:
+        worker.join(timeout=10)
+    assert [aggregate.battles for aggregate in results.aggregates] == [3000, 1500]
+    for config_index, config in enumerate([battle_config, plain_battle_config]):
+        shards = [shard for shard in plan_shards([3000, 1500], 8, 1, 1000) if shard.config_index == config_index]
+        assert results.aggregates[config_index] == reduce(BattleAggregate.merge, [simulate_shard(config, shard, 1000) for shard in shards])
+
+def test_workers_with_the_wrong_key_are_turned_away(battle_config):
+    coordinator = Coordinator([battle_config], [1000], authkey=AUTHKEY, seed=8, block_size=1000)
+    try:
+        coordinator.acceptor.start()
+        with pytest.raises(multiprocessing.AuthenticationError):
+            run_worker(coordinator.address, b"wrong secret")
+    finally:
+        coordinator.stop_accepting()
+    assert not coordinator.completed
+
+def test_local_cluster_matches_the_sharded_reference(battle_config):
+    results = run_local_cluster([battle_config], [4000], workers=2, seed=5, block_size=1000)
+    assert results.aggregates == [sharded_reference(battle_config, 4000, 5, 1000)]
+    assert sum(results.battles_per_worker.values()) == 4000
+
+def test_shards_of_killed_workers_are_reassigned(battle_config):
+    coordinator = Coordinator([battle_config], [3000], authkey=AUTHKEY, seed=6, block_size=1000)
+    doomed = multiprocessing.Process(target=stalling_worker, args=(coordinator.address, AUTHKEY), daemon=True)
+    # Start the process before the coordinator threads, forking a multi-threaded process is unsafe.
+    doomed.start()
+    with ThreadPoolExecutor(1) as executor:
+        run = executor.submit(coordinator.run)
+        wait_for_assignment(coordinator)
+        doomed.kill()
+        doomed.join()
+        run_worker(coordinator.address, AUTHKEY)
+        results = run.result(timeout=30)
+    assert results.reassigned_shards == 1
+    assert results.aggregates == [sharded_reference(battle_config, 3000, 6, 1000)]
+
+def test_slow_shards_are_run_speculatively(battle_config):
+    coordinator = Coordinator([battle_config], [3000], authkey=AUTHKEY, seed=7, block_size=1000, minimum_slow_shard_seconds=0.0)
+    stalled = multiprocessing.Process(target=stalling_worker, args=(coordinator.address, AUTHKEY), daemon=True)
+    stalled.start()
+    try:
+        with ThreadPoolExecutor(1) as executor:
+            run = executor.submit(coordinator.run)
+            stalled_worker = wait_for_assignment(coordinator)
+            run_worker(coordinator.address, AUTHKEY)
+            results = run.result(timeout=30)
+    finally:
+        stalled.kill()
+    assert results.reassigned_shards == 1
+    assert stalled_worker not in results.battles_per_worker
+    assert results.aggregates == [sharded_reference(battle_config, 3000, 7, 1000)]
+
+def test_configs_the_batched_engine_cannot_run_are_rejected(battle_config):
+    unsupported = replace(battle_config, battle_result_modifications=[UncompiledModification])
+    with pytest.raises(ValueError, match="not supported by the batched engine"):
+        Coordinator([unsupported], [1000], authkey=AUTHKEY)
+
+def test_failing_shards_fail_the_run(monkeypatch, battle_config):
+    def failing_shard(*arguments):
+        raise ValueError("shard exploded")
+
+    monkeypatch.setattr(distributed, "simulate_shard", failing_shard)
+    coordinator = Coordinator([battle_config], [2000], authkey=AUTHKEY, seed=8, block_size=1000)
+    worker = threading.Thread(target=run_worker, args=(coordinator.address, AUTHKEY))
+    worker.start()
+    with pytest.raises(RuntimeError, match="shard exploded"):
+        coordinator.run()
+    worker.join(timeout=10)
+    assert not worker.is_alive()
+
+def test_shards_are_reassigned_a_bounded_number_of_times(battle_config):
+    coordinator = Coordinator([battle_config], [1000], authkey=AUTHKEY, block_size=1000, max_shard_reassignments=2)
+    for attempt in range(3):
+        assert coordinator.next_shard(f"worker {attempt}").shard_id == 0
+        coordinator.worker_lost(f"worker {attempt}")
+    assert coordinator.reassigned_shards == 2
+    assert coordinator.next_shard("worker 3") is None
+    coordinator.listener.close()
+    assert "reassigned 2 times" in coordinator.error
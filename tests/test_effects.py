@@ -0,0 +1,62 @@
+import random
+from dataclasses import replace
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import dice
+import effects
+from batched_battle import BatchedBattleEngine
+from battle_orchestrator import BattleOrchestrator
+from result_modifier import DeclarativeResultModification, LightOfTheThan
+from roll_modifier import DeclarativeRollModification, TerrainRollModification
+
+class DoubleLight(DeclarativeResultModification):
+    effects = (effects.AddBoltIfBlanks(bolts=2),)
+
+class WhiteoutRolls(DeclarativeRollModification):
+    effects = (effects.ConvertDice(from_die=dice.DiceNames.blue, to_die=dice.DiceNames.white),)
+
+def assert_engines_agree(battle_config, battles: int = 4000) -> None:
+    batched = BatchedBattleEngine(battle_config, 1).run(battles)
+    reference = BattleOrchestrator(battle_config).conduct_battles(battles, 2).data["net_resources"].to_numpy()
+    error = np.sqrt(batched.net_resources.var() / battles + reference.var() / battles)
+    assert abs(batched.net_resources.mean() - reference.mean()) < 4 * error
+
+def test_declarative_modifications_play_alike_in_both_engines(battle_config):
+    assert_engines_agree(replace(battle_config, battle_roll_modifications=[TerrainRollModification, WhiteoutRolls],
+                                 battle_result_modifications=[DoubleLight] + battle_config.battle_result_modifications[1:]))
+
+def test_keep_best_die_matches_the_mountain_terrain():
+    rng = random.Random(0)
+    die_types = list(dice.DIE_TYPES.values())
+    for _ in range(500):
+        pool = [rng.choice(die_types) for _ in range(rng.randrange(0, 7))]
+        effect_pool, terrain_pool = dice.DicePool(), dice.DicePool()
+        for die_type in pool:
+            effect_pool.add_die(die_type())
+            terrain_pool.add_die(die_type())
+        effects.KeepBestDie(targets=(effects.PLAYER,)).apply(SimpleNamespace(player_army=SimpleNamespace(current_dice_pool=effect_pool)))
+        TerrainRollModification().remove_all_but_one_die(terrain_pool)
+        assert [die.name for die in effect_pool.dice] == [die.name for die in terrain_pool.dice]
+
+def test_effects_must_implement_apply():
+    with pytest.raises(TypeError):
+        effects.ResultEffect()
+    with pytest.raises(TypeError):
+        effects.RollEffect()
+
+def test_declarative_modifications_cannot_override_modify_result():
+    with pytest.raises(TypeError, match="overrides modify_result"):
+        class Sneaky(DeclarativeResultModification):
+            effects = (effects.AddBoltIfBlanks(),)
+
+            def modify_result(self, state) -> None:
+                pass
+
+def test_batched_engine_rejects_overrides_below_the_effects(battle_config):
+    class BrighterLight(LightOfTheThan):
+        def modify_result(self, state) -> None:
+            state.player_roll_results.bolts += 2
+
+    with pytest.raises(ValueError, match="overrides modify_result"):
+        BatchedBattleEngine(replace(battle_config, battle_result_modifications=[BrighterLight]), 0)
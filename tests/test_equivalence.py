@@ -0,0 +1,45 @@
+from dataclasses import replace
+import numpy as np
+import pytest
+import army
+import uprising_units
+from battle_orchestrator import ArmyConfig
+from equivalence import (MINIMUM_BIN_COUNT, Scenario, check_equivalence, chi_square_homogeneity, chi_square_survival,
+                         kolmogorov_survival, pooled_bins, run_batched, scenario_catalog)
+
+@pytest.mark.parametrize("statistic, degrees_of_freedom", [(3.841, 1), (5.991, 2), (11.070, 5), (18.307, 10)])
+def test_chi_square_critical_values(statistic, degrees_of_freedom):
+    assert chi_square_survival(statistic, degrees_of_freedom) == pytest.approx(0.05, abs=1e-3)
+
+def test_kolmogorov_critical_value():
+    assert kolmogorov_survival(1.358) == pytest.approx(0.05, abs=1e-3)
+
+def test_identical_counts_are_homogeneous():
+    counts = np.array([50, 30, 20])
+    assert chi_square_homogeneity(counts, 2 * counts) == pytest.approx(1.0)
+    assert chi_square_homogeneity(counts, counts[::-1]) < 1e-3
+
+def test_pooled_bins_keep_every_battle():
+    rng = np.random.default_rng(0)
+    values, other_values = rng.poisson(3, 500) - 5, rng.poisson(3, 300) - 5
+    counts, other_counts = pooled_bins(values, other_values)
+    assert (counts.sum(), other_counts.sum()) == (500, 300)
+    assert ((counts + other_counts)[:-1] >= MINIMUM_BIN_COUNT).all()
+
+@pytest.fixture
+def scenarios() -> list[Scenario]:
+    return scenario_catalog([(uprising_units.Stoneshell, uprising_units.CrabRider, uprising_units.Harpooneers)])[:4]
+
+def test_batched_engine_is_equivalent(scenarios):
+    report = check_equivalence("batched", scenarios, battles=2000, seed=1)
+    assert not report.divergent()
+    assert len(report.table()) == len(scenarios)
+
+def test_divergent_engines_are_caught(scenarios):
+    def weakened(battle_config, battle_count, seed):
+        smaller_army = ArmyConfig(army.UnitsArmy, battle_config.player_army_config.units[1:])
+        return run_batched(replace(battle_config, player_army_config=smaller_army), battle_count, seed)
+
+    report = check_equivalence(weakened, scenarios, battles=2000, seed=1)
+    assert report.candidate == "weakened"
+    assert len(report.divergent()) == len(scenarios)
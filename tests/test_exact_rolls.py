@@ -0,0 +1,56 @@
+import random
+from fractions import Fraction
+import pytest
+import dice
+from exact_rolls import (BLANKS, BOLTS, FACE_FIELDS, damage_distribution, distribution_of_dice, expected_net_damage,
+                         pool_distribution, pool_outcome_distribution)
+
+POOLS = [(), ((dice.DiceNames.white, 3),), ((dice.DiceNames.blue, 2), (dice.DiceNames.red, 1)),
+         ((dice.DiceNames.black, 1), (dice.DiceNames.purple, 2), (dice.DiceNames.white, 2))]
+
+@pytest.mark.parametrize("dice_counts", POOLS + [((dice.DiceNames.white, 30),)])
+def test_counts_cover_every_roll(dice_counts):
+    distribution = pool_distribution(dice_counts)
+    assert distribution.counts.sum() == distribution.outcomes == 6 ** sum(count for _, count in dice_counts)
+    assert sum(distribution.marginal("skulls")) == pytest.approx(1.0)
+
+@pytest.mark.parametrize("dice_counts", POOLS[1:])
+def test_polynomials_match_enumerated_rolls(dice_counts):
+    distribution = pool_distribution(dice_counts)
+    enumerated = pool_outcome_distribution(dice_counts)
+    assert sum(enumerated.values()) == pytest.approx(1.0)
+    for summary, probability in enumerated.items():
+        totals = dict(zip(FACE_FIELDS, summary))
+        assert float(distribution.probability(**totals)) == pytest.approx(
+            sum(other for other_summary, other in enumerated.items() if other_summary[:5] == summary[:5]))
+
+def test_dice_pools_roll_like_their_distribution():
+    pool = dice.DicePool()
+    for die_type in (dice.DiceNames.blue, dice.DiceNames.blue, dice.DiceNames.red, dice.DiceNames.white):
+        pool.add_die(dice.DIE_TYPES[die_type]())
+    distribution = pool.distribution()
+    assert distribution is distribution_of_dice(reversed(pool.dice))
+    rng = random.Random(0)
+    rolls = 20_000
+    skulls = sum(pool.roll_dice(rng).skulls >= 2 for _ in range(rolls)) / rolls
+    probability = float(distribution.at_least(skulls=2))
+    assert abs(skulls - probability) < 4 * (probability * (1 - probability) / rolls) ** 0.5
+
+def test_light_bolts_follow_the_blanks():
+    dice_counts = ((dice.DiceNames.white, 2),)
+    with_light = pool_outcome_distribution(dice_counts, bolts_if_blanks=1)
+    without_light = pool_outcome_distribution(dice_counts)
+    assert sum(probability for summary, probability in with_light.items() if summary[BOLTS]) == pytest.approx(
+        sum(probability for summary, probability in without_light.items() if summary[BOLTS] or summary[BLANKS]))
+    assert sum(pool_outcome_distribution(dice_counts, reroll_count=1, bolts_if_blanks=1).values()) == pytest.approx(1.0)
+
+def test_damage_distributions_are_exact():
+    attacker = pool_distribution(POOLS[2])
+    defender = pool_distribution(POOLS[3])
+    assert sum(damage_distribution(attacker, defender).values()) == 1
+    assert expected_net_damage(attacker, defender) == -expected_net_damage(defender, attacker)
+    assert isinstance(attacker.expectation("skulls"), Fraction)
+
+def test_unknown_fields_are_rejected():
+    with pytest.raises(ValueError, match="Unknown field"):
+        pool_distribution(POOLS[1]).at_least(swords=1)
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from batched_battle import BatchedBattleEngine
+from battle_state import OverallBattleResult
+from importance_sampling import FaceTilt, estimate_with_tilt, importance_sample
+
+def test_untilted_faces_are_fair():
+    tilt = FaceTilt.towards(OverallBattleResult.player_defeat, (0.0, 0.0))
+    assert np.allclose(tilt.face_probabilities(True), 1 / 6)
+    assert np.allclose(tilt.face_probabilities(False), 1 / 6)
+
+def test_untilted_estimate_is_plain_simulation(battle_config):
+    estimate = estimate_with_tilt(battle_config, OverallBattleResult.player_defeat, (0.0, 0.0), 5000, 3)
+    assert estimate.effective_sample_size == pytest.approx(5000)
+
+def test_tilted_estimate_is_unbiased(battle_config):
+    defeat = OverallBattleResult.player_defeat
+    estimate = importance_sample(battle_config, defeat, 100_000, strength=(0.5, 0.5), seed=4)
+    assert estimate.effective_sample_size < estimate.battles
+    results = BatchedBattleEngine(battle_config, 5).run(200_000)
+    probability = results.outcome_frequencies()[defeat]
+    error = np.sqrt(probability * (1 - probability) / len(results) + estimate.standard_error ** 2)
+    assert abs(estimate.probability - probability) < 4 * error
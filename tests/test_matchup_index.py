@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+import uprising_units
+from battle_state import TerrainType
+from matchup_index import MatchupSpace, ModifierSet, build_matchup_index, cell_fingerprint
+from result_modifier import LightOfTheThan, TerrainResultModification
+from roll_modifier import TerrainRollModification
+
+@pytest.fixture
+def space() -> MatchupSpace:
+    return MatchupSpace(units=[uprising_units.Stoneshell, uprising_units.CrabRider], army_size=2, garrison_levels=[1, 2],
+                        terrains=[TerrainType.FOREST],
+                        modifier_sets=[ModifierSet("light", [TerrainRollModification], [LightOfTheThan, TerrainResultModification])])
+
+def test_lookup_answers_every_cell_in_any_unit_order(tmp_path, space):
+    index = build_matchup_index(tmp_path / "index.npy", space, battles_per_cell=500)
+    assert index.cells.shape == (3, 2, 1, 1)
+    cell = index.lookup([uprising_units.CrabRider, uprising_units.Stoneshell], 2, TerrainType.FOREST, "light")
+    assert cell == index.lookup([uprising_units.Stoneshell, uprising_units.CrabRider], 2, TerrainType.FOREST, "light")
+    assert cell.victory + cell.draw + cell.defeat == pytest.approx(1.0, abs=1e-6)
+    assert cell.battles == 500
+
+def test_rebuild_only_recomputes_changed_cells(tmp_path, space):
+    path = tmp_path / "index.npy"
+    first = np.array(build_matchup_index(path, space, battles_per_cell=500, seed=0).cells)
+    # A different seed would change every recomputed cell, so equal cells were kept.
+    assert np.array_equal(first, np.array(build_matchup_index(path, space, battles_per_cell=500, seed=1).cells))
+    recomputed = np.array(build_matchup_index(path, space, battles_per_cell=600, seed=1).cells)
+    assert (recomputed["battles"] == 600).all()
+
+def test_fingerprint_follows_the_config(space):
+    composition = space.compositions()[0]
+    base = space.battle_config(composition, 1, TerrainType.FOREST, space.modifier_sets[0])
+    assert cell_fingerprint(base, 500) == cell_fingerprint(space.battle_config(composition, 1, TerrainType.FOREST, space.modifier_sets[0]), 500)
+    assert cell_fingerprint(base, 500) != cell_fingerprint(base, 600)
+    assert cell_fingerprint(base, 500) != cell_fingerprint(space.battle_config(composition, 2, TerrainType.FOREST, space.modifier_sets[0]), 500)
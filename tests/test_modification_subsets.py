@@ -0,0 +1,33 @@
+from dataclasses import replace
+import numpy as np
+import pytest
+from batched_battle import BatchedBattleEngine
+from battle_state import OverallBattleResult, OUTCOME_CODES
+from modification_subsets import evaluate_modification_subsets
+
+@pytest.fixture(scope="module")
+def subsets():
+    from benchmarks import benchmark_battle_config
+    return evaluate_modification_subsets(benchmark_battle_config(), 20_000, seed=3, chunk_size=7000)
+
+def test_every_subset_is_played_for_every_battle(subsets):
+    assert subsets.outcome.shape == (20_000, 16)
+    assert not (subsets.outcome == OUTCOME_CODES[OverallBattleResult.undecided]).any()
+    table = subsets.table()
+    assert table["modifications"].iloc[0] == "none"
+    assert table["modifications"].iloc[-1] == " + ".join(subsets.modifications)
+
+@pytest.mark.parametrize("variant", [0, 1, 2, 5, 15])
+def test_subsets_match_separate_runs(subsets, battle_config, variant):
+    modifications = [modification for bit, modification in enumerate(battle_config.battle_result_modifications) if variant >> bit & 1]
+    results = BatchedBattleEngine(replace(battle_config, battle_result_modifications=modifications), variant).run(20_000)
+    shared = subsets.net_resources[:, variant]
+    error = np.sqrt(shared.var() / len(shared) + results.net_resources.var() / len(results))
+    assert abs(shared.mean() - results.net_resources.mean()) < 4 * error
+
+def test_marginal_contributions_are_paired_averages(subsets):
+    contributions = subsets.marginal_contributions().set_index("modification")
+    assert list(contributions.index) == subsets.modifications
+    all_with_first = subsets.net_resources[:, 1::2].mean() - subsets.net_resources[:, 0::2].mean()
+    assert contributions["net_resources_change"].iloc[0] == pytest.approx(all_with_first)
+    assert (contributions["net_resources_change_se"] > 0).all()
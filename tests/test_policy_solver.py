@@ -0,0 +1,53 @@
+from dataclasses import replace
+import numpy as np
+import pytest
+import army
+import exact_rolls
+import result_modifier
+import roll_modifier
+import uprising_units
+from battle_orchestrator import ArmyConfig, BattleConfig, BattleOrchestrator
+from battle_state import Terrain, TerrainType
+from policy_solver import BoltDecision, BoltPolicy, BoltPolicySolver, PolicyObjective, collapse
+
+@pytest.fixture
+def solver_battle_config() -> BattleConfig:
+    return BattleConfig(ArmyConfig(army.UnitsArmy, [uprising_units.CrabRider, uprising_units.CrabRider, uprising_units.Harpooneers,
+                                                    uprising_units.Harpooneers, uprising_units.ReefKing]),
+                        ArmyConfig(army.ImperialArmy, [uprising_units.Garrison2]), Terrain(TerrainType.FOREST),
+                        [roll_modifier.TerrainRollModification],
+                        [result_modifier.LightOfTheThan, result_modifier.TerrainResultModification,
+                         result_modifier.DruidMountainHeart, result_modifier.HarpoonersUpgrade])
+
+def test_decisions_round_trip_through_their_action_codes():
+    for action in range(16):
+        assert BoltDecision.decode(action).encode() == action
+
+def test_light_of_the_than_before_the_rerolls_looks_at_the_first_roll():
+    white_dice = (("White", 2),)
+    first = exact_rolls.pool_outcome_distribution(white_dice, 2, bolts_if_blanks=1)
+    _, bolts, probabilities = collapse(first, (exact_rolls.BOLTS,))
+    assert probabilities[bolts[:, 0] == 1].sum() == pytest.approx(0.75)
+    after = exact_rolls.pool_outcome_distribution(white_dice, 2)
+    _, bolts, probabilities = collapse(after, (exact_rolls.BOLTS,), light_of_the_than=True)
+    assert probabilities[bolts[:, 0] == 1].sum() == pytest.approx(0.4375)
+
+def test_solved_value_matches_playing_the_policy(solver_battle_config):
+    policy = BoltPolicySolver(solver_battle_config, PolicyObjective.NET_RESOURCES).solve()
+    data = BattleOrchestrator(policy.battle_config_with_policy()).conduct_battles(10_000, 3).data
+    net_resources = data["net_resources"].to_numpy()
+    assert abs(net_resources.mean() - policy.expected_value) < 4 * net_resources.std() / np.sqrt(len(net_resources))
+
+@pytest.mark.parametrize("heuristics", [False, True])
+def test_uncovered_states_fall_back_to_the_configured_heuristics(solver_battle_config, heuristics):
+    modifications = solver_battle_config.battle_result_modifications[:4 if heuristics else 2]
+    battle_config = replace(solver_battle_config, battle_result_modifications=modifications)
+    uncovered = BoltPolicy(battle_config, PolicyObjective.NET_RESOURCES, 0.0, {}, druid=heuristics, harpooners=heuristics)
+    played = BattleOrchestrator(uncovered.battle_config_with_policy()).conduct_battles(2000, 4).data
+    expected = BattleOrchestrator(battle_config).conduct_battles(2000, 4).data
+    assert np.array_equal(played["net_resources"].to_numpy(), expected["net_resources"].to_numpy())
+
+def test_unsupported_modifications_are_rejected(solver_battle_config):
+    solver_battle_config.battle_result_modifications = [result_modifier.LightOfTheThan, result_modifier.RerollModification]
+    with pytest.raises(ValueError, match="not supported by the policy solver"):
+        BoltPolicySolver(solver_battle_config)
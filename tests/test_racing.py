@@ -0,0 +1,46 @@
+from dataclasses import replace
+import pytest
+import army
+import uprising_units
+from battle_orchestrator import ArmyConfig
+from policy_solver import PolicyObjective
+from racing import race_candidates
+
+@pytest.fixture
+def candidates(battle_config) -> dict:
+    return {"full army": battle_config,
+            "two riders": replace(battle_config, player_army_config=ArmyConfig(army.UnitsArmy, [uprising_units.CrabRider] * 2)),
+            "one rider": replace(battle_config, player_army_config=ArmyConfig(army.UnitsArmy, [uprising_units.CrabRider]))}
+
+def test_clearly_better_candidate_wins_early(candidates):
+    results = race_candidates(candidates, PolicyObjective.WIN_PROBABILITY, budget=300_000, seed=5)
+    assert results.winner == "full army"
+    assert results.decided
+    assert results.confidence == 0.95
+    assert results.battles < 300_000
+    assert results.table["candidate"].iloc[0] == "full army"
+    assert results.table.set_index("candidate")["eliminated_round"].drop("full army").notna().all()
+
+def test_races_are_reproducible(candidates):
+    first = race_candidates(candidates, PolicyObjective.NET_RESOURCES, budget=20_000, seed=6)
+    second = race_candidates(candidates, PolicyObjective.NET_RESOURCES, budget=20_000, seed=6)
+    assert first.table.equals(second.table)
+
+def test_exhausted_budget_reports_the_leader(candidates):
+    results = race_candidates({"full army": candidates["full army"], "same army": candidates["full army"]},
+                              budget=4000, seed=7)
+    assert not results.decided
+    assert results.battles <= 4000
+    assert 0 < results.confidence <= 1
+
+def test_single_candidate_needs_no_battles(candidates):
+    results = race_candidates({"full army": candidates["full army"]}, seed=1)
+    assert (results.winner, results.decided, results.battles) == ("full army", True, 0)
+
+def test_racing_needs_candidates():
+    with pytest.raises(ValueError, match="at least one candidate"):
+        race_candidates({})
+
+def test_budget_must_fund_a_battle_per_candidate(candidates):
+    with pytest.raises(ValueError, match="one battle for each of the 3 candidates"):
+        race_candidates(candidates, budget=2)
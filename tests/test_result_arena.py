@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from battle_orchestrator import BASE_SEED_BITS, BATTLE_INDEX_BITS, BattleOrchestrator, battle_seed, run_base_seed, split_battle_seed
+from battle_state import BattleResult, OverallBattleResult, OUTCOME_CODES
+from result_arena import COLUMN_ALIGNMENT, ResultArena, column_offsets
+
+@pytest.mark.parametrize("base_seed, battle_index", [(0, 0), (12345, 678), ((1 << BASE_SEED_BITS) - 1, (1 << BATTLE_INDEX_BITS) - 1)])
+def test_battle_seeds_split_back_into_base_seed_and_index(base_seed, battle_index):
+    seed = battle_seed(base_seed, battle_index)
+    assert seed < 1 << 63
+    assert split_battle_seed(seed) == (base_seed, battle_index)
+
+def test_base_seeds_must_fit_the_seed_column():
+    assert run_base_seed((1 << BASE_SEED_BITS) - 1) == (1 << BASE_SEED_BITS) - 1
+    assert 0 <= run_base_seed(None) < 1 << BASE_SEED_BITS
+    for seed in (-1, 1 << BASE_SEED_BITS):
+        with pytest.raises(ValueError):
+            run_base_seed(seed)
+
+def test_columns_start_on_cache_lines():
+    offsets, size = column_offsets(1001)
+    assert all(offset % COLUMN_ALIGNMENT == 0 for offset in offsets.values())
+    assert size >= max(offsets.values())
+
+def test_attached_arenas_share_rows():
+    battle_result = BattleResult()
+    battle_result.overall_result = OverallBattleResult.player_victory
+    battle_result.player_net_resources = -3
+    battle_result.rounds = 4
+    with ResultArena.create(10) as arena:
+        assert (arena["outcome"] == OUTCOME_CODES[OverallBattleResult.undecided]).all()
+        worker = ResultArena.attach(arena.name, 10)
+        worker.write(7, battle_result, battle_seed(5, 7))
+        worker.close()
+        assert arena["outcome"][7] == OUTCOME_CODES[OverallBattleResult.player_victory]
+        assert arena["net_resources"][7] == -3
+        assert arena["rounds"][7] == 4
+        assert split_battle_seed(int(arena["seed"][7])) == (5, 7)
+
+def test_parallel_run_plays_the_same_battles_as_threads(plain_battle_config):
+    orchestrator = BattleOrchestrator(plain_battle_config)
+    threaded = orchestrator.conduct_battles(300, 11, slice_size=50).data
+    with orchestrator.conduct_battles_parallel(300, 11, processes=2, slice_size=50) as arena:
+        assert np.array_equal(arena["net_resources"], threaded["net_resources"].to_numpy())
+        assert np.array_equal(arena["outcome"], threaded["victor"].map(OUTCOME_CODES).to_numpy())
+        assert np.array_equal(arena["seed"], [battle_seed(11, index) for index in range(300)])
@@ -0,0 +1,90 @@
+from dataclasses import replace
+from functools import partial
+import numpy as np
+import pytest
+from battle_aggregate import BattleAggregate
+from battle_orchestrator import BASE_SEED_BITS, BattleOrchestrator, battle_seed
+from battle_state import OUTCOME_CODES
+from policy_solver import BoltPolicySolver, PolicyObjective
+from result_modifier import HarpoonersUpgrade
+from result_store import (HEADER_SIZE, RESULT_FILE_VERSION, ResultFile, ResultFileHeader, ResultFileSet, ResultFileWriter,
+                          config_hash, file_size)
+
+def write_columns(path, battle_count: int, rows: int, **writer_options) -> ResultFileWriter:
+    writer = ResultFileWriter(path, battle_count, **writer_options)
+    writer.append_columns(np.arange(rows) % 4, np.arange(rows) - 50, np.arange(rows) % 7 + 1)
+    return writer
+
+def test_headers_round_trip(tmp_path):
+    header = ResultFileHeader(1000, 400, 12345, 17, 2 ** 64 - 1, complete=True)
+    assert ResultFileHeader.unpack(header.pack(), tmp_path) == header
+
+def test_foreign_files_are_rejected(tmp_path):
+    path = tmp_path / "other.battles"
+    path.write_bytes(b"NOTBATTL" + bytes(HEADER_SIZE))
+    with pytest.raises(ValueError, match="not a battle result file"):
+        ResultFile(path)
+    newer = bytearray(ResultFileHeader(0, 0, 0, 0, 0).pack())
+    newer[8:10] = (RESULT_FILE_VERSION + 1).to_bytes(2, "little")
+    with pytest.raises(ValueError, match="version"):
+        ResultFileHeader.unpack(bytes(newer), path)
+
+def test_partial_files_are_readable_while_writing(tmp_path):
+    path = tmp_path / "run.battles"
+    writer = write_columns(path, 100, 60, base_seed=3, config_hash=99)
+    reading = ResultFile(path)
+    assert len(reading) == 60
+    assert not reading.header.complete
+    assert np.array_equal(reading.net_resources, np.arange(60) - 50)
+    writer.append_columns(np.zeros(40), np.zeros(40), np.ones(40))
+    writer.close()
+    finished = ResultFile(path)
+    assert finished.header.complete
+    assert len(finished) == 100
+    assert finished.config_hash == 99
+    assert finished.seed[59] == battle_seed(3, 59)
+
+def test_truncated_files_are_rejected(tmp_path):
+    path = tmp_path / "run.battles"
+    write_columns(path, 100, 100).close()
+    with open(path, "r+b") as result_file:
+        result_file.truncate(file_size(100) - 1)
+    with pytest.raises(ValueError, match="truncated"):
+        ResultFile(path)
+
+def test_appends_must_fit_the_file(tmp_path):
+    writer = write_columns(tmp_path / "run.battles", 10, 8)
+    with pytest.raises(ValueError, match="holds 10 battles"):
+        writer.append_columns(np.zeros(3), np.zeros(3), np.zeros(3))
+    with pytest.raises(ValueError, match="net_resources"):
+        writer.append_columns(np.zeros(1), np.array([1 << 20]), np.zeros(1))
+    writer.close()
+    with pytest.raises(ValueError):
+        ResultFileWriter(tmp_path / "bad_seed.battles", 10, base_seed=1 << BASE_SEED_BITS)
+
+def test_runs_stream_into_result_files(tmp_path, battle_config, plain_battle_config):
+    first = BattleOrchestrator(battle_config).conduct_battles(500, 4, slice_size=100, results_path=tmp_path / "a.battles")
+    BattleOrchestrator(plain_battle_config).conduct_battles_batched(3000, 5, results_path=tmp_path / "b.battles", chunk_size=1000)
+    result_file = ResultFile(first.results_path)
+    assert np.array_equal(result_file.outcome, first.data["victor"].map(OUTCOME_CODES).to_numpy())
+    assert np.array_equal(result_file.net_resources, first.data["net_resources"].to_numpy())
+    assert np.array_equal(result_file.seed, battle_seed(4, np.arange(500)))
+    files = ResultFileSet.from_directory(tmp_path)
+    assert len(files) == 3500
+    aggregates = files.aggregates_by_config()
+    assert aggregates[config_hash(battle_config)] == BattleAggregate.from_results(result_file)
+    assert aggregates[config_hash(plain_battle_config)].battles == 3000
+
+def test_config_hash_tells_configs_apart(battle_config, plain_battle_config):
+    assert config_hash(battle_config) == config_hash(replace(battle_config))
+    assert config_hash(battle_config) != config_hash(plain_battle_config)
+    unnamed = partial(battle_config.battle_result_modifications[0], "unnamed")
+    with pytest.raises(ValueError, match="fingerprint"):
+        config_hash(replace(battle_config, battle_result_modifications=[unnamed]))
+
+def test_config_hash_tells_policies_apart(plain_battle_config):
+    solved_config = replace(plain_battle_config, battle_result_modifications=[HarpoonersUpgrade])
+    policies = [BoltPolicySolver(solved_config, objective).solve() for objective in PolicyObjective]
+    hashes = [config_hash(policy.battle_config_with_policy()) for policy in policies]
+    assert hashes[0] != hashes[1]
+    assert hashes[0] == config_hash(policies[0].battle_config_with_policy())
@@ -0,0 +1,36 @@
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from battle_orchestrator import BattleOrchestrator
+from run_metrics import MetricsExporter, RunMetrics
+
+def count_battles(metrics: RunMetrics, battles: int) -> None:
+    counters = metrics.shard()
+    counters.battles += battles
+    counters.rounds += 2 * battles
+    counters.tasks_completed += 1
+
+def test_shards_are_summed_per_thread():
+    metrics = RunMetrics(1000, tasks_submitted=10)
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda _: count_battles(metrics, 100), range(10)))
+    summary = metrics.summary()
+    assert 1 <= len(metrics.shards) <= 4
+    assert (summary.battles, summary.queue_depth, summary.average_rounds) == (1000, 0, 2.0)
+    assert summary.eta_seconds == 0
+
+def test_runs_export_their_metrics(tmp_path, plain_battle_config):
+    textfile = tmp_path / "battles.prom"
+    meta_results = BattleOrchestrator(plain_battle_config).conduct_battles(500, 1, threads=2, slice_size=100, metrics_textfile=textfile)
+    assert meta_results.metrics.battles == 500
+    assert meta_results.metrics.queue_depth == 0
+    assert "uprising_battles_completed_total 500\n" in textfile.read_text()
+    assert not list(tmp_path.glob("*.tmp"))
+
+def test_metrics_are_served_over_http():
+    metrics = RunMetrics(10)
+    count_battles(metrics, 3)
+    with MetricsExporter(metrics, port=0) as exporter:
+        with urllib.request.urlopen(f"http://127.0.0.1:{exporter.server.server_port}/metrics") as response:
+            body = response.read().decode()
+    assert "uprising_battles_completed_total 3\n" in body
+    assert 'uprising_worker_busy_seconds_total{worker="0"}' in body
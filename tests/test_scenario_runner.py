@@ -0,0 +1,45 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import army
+import uprising_units
+from scenario_runner import DEFAULT_REGISTRY, ScenarioRegistry, run_scenario, run_scenarios
+
+SCENARIO = {"name": "forest", "player": {"army": "UnitsArmy", "units": ["Stoneshell", "CrabRider", "Harpooneers"]},
+            "enemy": {"army": "ImperialArmy", "units": ["Garrison2"]}, "terrain": "Forest",
+            "roll_modifications": ["TerrainRollModification"],
+            "result_modifications": ["LightOfTheThan", "TerrainResultModification"], "battles": 500, "seed": 1}
+
+def run_lines(lines: list[str], registry: ScenarioRegistry = DEFAULT_REGISTRY) -> dict[int, dict]:
+    output = io.StringIO()
+    with ThreadPoolExecutor(2) as executor:
+        finished = run_scenarios(io.StringIO("\n".join(lines) + "\n"), output, executor, 2, registry)
+    summaries = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert finished == len(summaries)
+    return {summary.pop("line"): summary for summary in summaries}
+
+@pytest.mark.parametrize("engine", ["batched", "object"])
+def test_scenarios_are_summarized(engine):
+    summary = run_scenario(SCENARIO | {"engine": engine})
+    assert summary["victory"] + summary["draw"] + summary["defeat"] == pytest.approx(1.0)
+    assert summary["battles"] == 500
+
+def test_every_line_gets_a_summary_or_an_error():
+    summaries = run_lines([json.dumps(SCENARIO), "", "{not json", "[1, 2]", json.dumps(SCENARIO | {"engine": "gpu"}),
+                           json.dumps(SCENARIO | {"terrain": "Moon"})])
+    assert set(summaries) == {1, 3, 4, 5, 6}
+    assert summaries[1]["name"] == "forest" and "victory" in summaries[1]
+    assert summaries[3]["error"].startswith("Invalid JSON")
+    assert summaries[4]["error"] == "Scenario must be a JSON object"
+    assert "Unknown engine 'gpu'" in summaries[5]["error"]
+    assert "Unknown terrain 'Moon'" in summaries[6]["error"]
+
+def test_scenarios_use_the_given_registry():
+    registry = ScenarioRegistry(armies={"Tua": army.UnitsArmy, "Empire": army.ImperialArmy})
+    registry.register_unit(uprising_units.CrabRider).register_unit(uprising_units.Garrison1)
+    scenario = {"player": {"army": "Tua", "units": ["CrabRider"]}, "enemy": {"army": "Empire", "units": ["Garrison1"]},
+                "terrain": "Marshes", "battles": 100}
+    summaries = run_lines([json.dumps(scenario), json.dumps(SCENARIO)], registry)
+    assert "victory" in summaries[1]
+    assert "Unknown army 'UnitsArmy'" in summaries[2]["error"]
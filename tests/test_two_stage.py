@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from batched_battle import BatchedBattleEngine
+from battle_state import BattleStage, OverallBattleResult
+from two_stage import ExactArcheryEngine, TwoStageSimulator, proportional_allocation
+
+def test_archery_outcomes_are_a_distribution(battle_config):
+    archery = ExactArcheryEngine(battle_config).archery_outcomes()
+    assert len(archery.probabilities) == len(archery.batch)
+    assert archery.probabilities.sum() == pytest.approx(1.0)
+
+def test_archery_faces_are_enumerated_up_front(battle_config):
+    engine = ExactArcheryEngine(battle_config)
+    faces = engine.draw_faces(np.arange(3), engine.player_tables, BattleStage.ARHCERY, 0)
+    assert np.array_equal(faces, engine.archery_faces[True][:3])
+
+def test_allocation_spends_the_budget_with_a_minimum_per_stratum():
+    allocation = proportional_allocation(np.array([0.7, 0.2, 0.09, 0.01]), 1000, 2)
+    assert allocation.sum() == 1000
+    assert (allocation >= 2).all()
+    assert allocation[0] > allocation[1] > allocation[2] > allocation[3]
+
+@pytest.mark.parametrize("config", ["battle_config", "mountain_battle_config"])
+def test_estimate_agrees_with_plain_simulation(config, request):
+    battle_config = request.getfixturevalue(config)
+    estimate = TwoStageSimulator(battle_config, 0).estimate(20_000)
+    assert sum(estimate.outcome_probabilities.values()) == pytest.approx(1.0)
+    results = BatchedBattleEngine(battle_config, 1).run(20_000)
+    victory = results.outcome_frequencies()[OverallBattleResult.player_victory]
+    victory_error = np.sqrt(victory * (1 - victory) / len(results) + estimate.outcome_standard_errors[OverallBattleResult.player_victory] ** 2)
+    assert abs(estimate.outcome_probabilities[OverallBattleResult.player_victory] - victory) < 4 * victory_error + 1e-9
+    net_error = np.sqrt(results.net_resources.var() / len(results) + estimate.net_resources_standard_error ** 2)
+    assert abs(estimate.net_resources_mean - results.net_resources.mean()) < 4 * net_error
@@ -0,0 +1,153 @@
+from __future__ import annotations
+from collections import Counter
+from dataclasses import dataclass
+from itertools import combinations_with_replacement, product
+from math import factorial, prod
+from typing import TYPE_CHECKING
+import numpy as np
+from loguru import logger
+from batched_battle import FACE_TABLE, BLANKS, BattleBatch, BatchedBattleEngine, SideTables
+from battle_state import BattleStage, OverallBattleResult, OUTCOME_CODES
+
+if TYPE_CHECKING:
+    from battle_orchestrator import BattleConfig
+
+UNDECIDED = OUTCOME_CODES[OverallBattleResult.undecided]
+
+@dataclass
+class ArcheryOutcomes:
+    """Exact distribution of the battle state after the archery round, one entry per distinct state."""
+    batch: BattleBatch
+    probabilities: np.ndarray
+
+    @property
+    def undecided(self) -> np.ndarray:
+        return self.batch.outcome == UNDECIDED
+
+@dataclass
+class TwoStageEstimate:
+    outcome_probabilities: dict[OverallBattleResult, float]
+    outcome_standard_errors: dict[OverallBattleResult, float]
+    net_resources_mean: float
+    net_resources_standard_error: float
+    strata: int
+    clash_battles: int
+
+def side_face_enumeration(tables: SideTables, reroll_count: int) -> tuple[np.ndarray, np.ndarray]:
+    """Every distinct archery roll of a side at its initial code as face rows (dice slots then rerolls) with probabilities.
+
+    Faces giving the same result are merged and dice of one type are enumerated as multisets."""
+    types = tables.slot_types[0]
+    counts = tables.dice_counts[0][tables.initial_code]
+    per_type = []
+    for die_type in np.unique(types):
+        slots = np.flatnonzero(types == die_type)[:counts[die_type]]
+        if len(slots) == 0:
+            continue
+        distinct = Counter(tuple(face) for face in FACE_TABLE[die_type])
+        representatives = [(next(index for index in range(6) if tuple(FACE_TABLE[die_type, index]) == result), count / 6)
+                           for result, count in distinct.items()]
+        outcomes = []
+        for combination in combinations_with_replacement(range(len(representatives)), len(slots)):
+            permutations = factorial(len(slots)) // prod(factorial(number) for number in Counter(combination).values())
+            faces = [representatives[index][0] for index in combination]
+            outcomes.append((slots, faces, permutations * prod(representatives[index][1] for index in combination)))
+        per_type.append(outcomes)
+
+    rows, probabilities = [], []
+    for combination in product(*per_type):
+        faces = np.zeros(len(types) + reroll_count, dtype=np.int8)
+        for slots, type_faces, _ in combination:
+            faces[slots] = type_faces
+        probability = prod(type_probability for _, _, type_probability in combination)
+        has_blank = (FACE_TABLE[types, faces[:len(types)]][:, BLANKS] == 1).any() if len(types) else False
+        if reroll_count == 0 or not has_blank:
+            rows.append(faces)
+            probabilities.append(probability)
+            continue
+        for reroll_faces in product(range(6), repeat=reroll_count):
+            faces = faces.copy()
+            faces[len(types):] = reroll_faces
+            rows.append(faces)
+            probabilities.append(probability / 6 ** reroll_count)
+    return np.array(rows, dtype=np.int8).reshape(len(rows), len(types) + reroll_count), np.array(probabilities)
+
+class ExactArcheryEngine(BatchedBattleEngine):
+    """Plays the archery round once for every distinct roll of both sides instead of sampling it. Row r of the archery
+    round pairs player roll r // enemy rolls with enemy roll r % enemy rolls."""
+    def __init__(self, battle_config: BattleConfig, seed: int | None = None) -> None:
+        super().__init__(battle_config, seed)
+        reroll_count = self.reroll_count(BattleStage.ARHCERY)
+        player_faces, player_probabilities = side_face_enumeration(self.player_tables, reroll_count)
+        enemy_faces, enemy_probabilities = side_face_enumeration(self.enemy_tables, reroll_count)
+        rows = np.arange(len(player_faces) * len(enemy_faces))
+        self.archery_faces = {True: player_faces[rows // len(enemy_faces)], False: enemy_faces[rows % len(enemy_faces)]}
+        self.archery_probabilities = player_probabilities[rows // len(enemy_faces)] * enemy_probabilities[rows % len(enemy_faces)]
+
+    def draw_faces(self, rows: np.ndarray, tables: SideTables, stage: BattleStage, width: int) -> np.ndarray:
+        if stage == BattleStage.ARHCERY:
+            return self.archery_faces[tables is self.player_tables][rows]
+        return super().draw_faces(rows, tables, stage, width)
+
+    def archery_outcomes(self) -> ArcheryOutcomes:
+        rows = np.arange(len(self.archery_probabilities))
+        probabilities = self.archery_probabilities
+        self.batch = BattleBatch.fresh(len(rows), self.player_tables.initial_code, self.enemy_tables.initial_code)
+        self.play_round(rows, BattleStage.ARHCERY)
+
+        columns = self.batch.columns()
+        states, stratum = np.unique(np.stack(columns, axis=1).astype(np.int64), axis=0, return_inverse=True)
+        logger.debug(f"Enumerated {len(rows)} archery rolls into {len(states)} distinct post archery states")
+        state_batch = BattleBatch(*(states[:, index].astype(column.dtype) for index, column in enumerate(columns)))
+        return ArcheryOutcomes(state_batch, np.bincount(stratum.ravel(), weights=probabilities, minlength=len(states)))
+
+def proportional_allocation(probabilities: np.ndarray, budget: int, minimum: int) -> np.ndarray:
+    share = probabilities / probabilities.sum() * max(budget - minimum * len(probabilities), 0)
+    allocation = np.floor(share).astype(np.int64)
+    remainder = int(round(share.sum())) - allocation.sum()
+    allocation[np.argsort(allocation - share)[:remainder]] += 1
+    return allocation + minimum
+
+class TwoStageSimulator:
+    """Computes the archery round exactly once and spends the Monte Carlo budget on the clash stage only,
+    stratified over the post archery states in proportion to their probabilities."""
+    def __init__(self, battle_config: BattleConfig, seed: int | None = None, minimum_per_stratum: int = 2) -> None:
+        self.battle_config = battle_config
+        self.seed = seed
+        self.minimum_per_stratum = minimum_per_stratum
+        self.archery = ExactArcheryEngine(battle_config).archery_outcomes()
+
+    def estimate(self, number_of_iterations: int = 5000) -> TwoStageEstimate:
+        archery = self.archery
+        undecided = np.flatnonzero(archery.undecided)
+        decided = np.flatnonzero(~archery.undecided)
+        outcome_probabilities = np.bincount(archery.batch.outcome[decided], weights=archery.probabilities[decided],
+                                            minlength=len(OUTCOME_CODES)).astype(float)
+        outcome_variances = np.zeros(len(OUTCOME_CODES))
+        net_mean = float((archery.probabilities[decided] * archery.batch.net_resources[decided]).sum())
+        net_variance = 0.0
+        clash_battles = 0
+        if len(undecided) > 0:
+            allocation = proportional_allocation(archery.probabilities[undecided], number_of_iterations, self.minimum_per_stratum)
+            stratum = np.repeat(np.arange(len(undecided)), allocation)
+            batch = archery.batch.take(undecided[stratum])
+            results = BatchedBattleEngine(self.battle_config, self.seed).resume_clash(batch)
+            clash_battles = len(results)
+            weights = archery.probabilities[undecided]
+            for code in range(len(OUTCOME_CODES)):
+                mean, variance = stratum_moments((results.outcome == code).astype(float), stratum, allocation)
+                outcome_probabilities[code] += (weights * mean).sum()
+                outcome_variances[code] += (weights ** 2 * variance / allocation).sum()
+            mean, variance = stratum_moments(results.net_resources.astype(float), stratum, allocation)
+            net_mean += float((weights * mean).sum())
+            net_variance += float((weights ** 2 * variance / allocation).sum())
+
+        logger.info(f"Two stage estimate from {len(archery.probabilities)} archery states and {clash_battles} clash battles")
+        return TwoStageEstimate({result: float(outcome_probabilities[code]) for result, code in OUTCOME_CODES.items()},
+                                {result: float(np.sqrt(outcome_variances[code])) for result, code in OUTCOME_CODES.items()},
+                                net_mean, float(np.sqrt(net_variance)), len(archery.probabilities), clash_battles)
+
+def stratum_moments(values: np.ndarray, stratum: np.ndarray, allocation: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    mean = np.bincount(stratum, weights=values, minlength=len(allocation)) / allocation
+    squared_deviation = np.bincount(stratum, weights=(values - mean[stratum]) ** 2, minlength=len(allocation))
+    return mean, squared_deviation / np.maximum(allocation - 1, 1)
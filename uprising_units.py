@@ -15,10 +15,10 @@ class UnitTypes(StrEnum):
     no_type = "Untyped"
 
 class Unit:
-    @property
-    @abstractmethod
-    def name(self) -> str:
-        pass
+    # Set as plain class attributes by every unit type, so they can be read from the class itself.
+    name: str
+    cost: int
+    unit_type: str
 
     def __init__(self) -> None:
         self.archery_dice: list[dice.Die]
@@ -34,18 +34,6 @@ class Unit:
     def initialize_archery_dice(self) -> list[Die]:
         pass
 
-    @classmethod
-    @property
-    @abstractmethod
-    def cost(cls) -> int:
-        pass
-
-    @classmethod
-    @property
-    @abstractmethod
-    def unit_type(cls) -> int:
-        pass
-
     def __repr__(self) -> str:
         return self.name
 
@@ -59,20 +47,9 @@ class Garrison1(Unit):
     def initialize_clash_dice(self) -> None:
         self.clash_dice = [WhiteDie(), BlueDie()]
 
-    @classmethod
-    @property
-    def cost(cls) -> int:
-        return 0
-
-    @classmethod
-    @property
-    def name(cls) -> str:
-        return "Garrison1"
-    
-    @classmethod
-    @property
-    def unit_type(cls) -> str:
-        return UnitTypes.no_type
+    cost = 0
+    name = "Garrison1"
+    unit_type = UnitTypes.no_type
 
 class Garrison2(Unit):
     def __init__(self) -> None:
@@ -84,20 +61,9 @@ class Garrison2(Unit):
     def initialize_clash_dice(self) -> None:
         self.clash_dice = [WhiteDie(), BlueDie(), OrangeDie(), OrangeDie()]
 
-    @classmethod
-    @property
-    def cost(cls) -> int:
-        return 0
-
-    @classmethod
-    @property
-    def name(cls) -> str:
-        return "Garrison2"
-    
-    @classmethod
-    @property
-    def unit_type(cls) -> str:
-        return UnitTypes.no_type
+    cost = 0
+    name = "Garrison2"
+    unit_type = UnitTypes.no_type
     
 class Garrison3(Unit):
     def __init__(self) -> None:
@@ -109,20 +75,9 @@ class Garrison3(Unit):
     def initialize_clash_dice(self) -> None:
         self.clash_dice = [WhiteDie(), BlueDie(), BlueDie(), OrangeDie(), OrangeDie()]
 
-    @classmethod
-    @property
-    def cost(cls) -> int:
-        return 0
-
-    @classmethod
-    @property
-    def name(cls) -> str:
-        return "Garrison3"
-    
-    @classmethod
-    @property
-    def unit_type(cls) -> str:
-        return UnitTypes.no_type
+    cost = 0
+    name = "Garrison3"
+    unit_type = UnitTypes.no_type
 
 class Stoneshell(Unit):
     def __init__(self) -> None:
@@ -134,20 +89,9 @@ class Stoneshell(Unit):
     def initialize_clash_dice(self) -> None:
         self.clash_dice = [WhiteDie()]
 
-    @classmethod
-    @property
-    def cost(cls) -> int:
-        return 2
-
-    @classmethod
-    @property
-    def name(cls) -> str:
-        return "Stoneshell"
-    
-    @classmethod
-    @property
-    def unit_type(cls) -> str:
-        return UnitTypes.basic_warrior
+    cost = 2
+    name = "Stoneshell"
+    unit_type = UnitTypes.basic_warrior
     
 class CrabRider(Unit):
     def __init__(self) -> None:
@@ -159,20 +103,9 @@ class CrabRider(Unit):
     def initialize_clash_dice(self) -> None:
         self.clash_dice = [BlueDie()]
 
-    @classmethod
-    @property
-    def cost(cls) -> int:
-        return 2
-
-    @classmethod
-    @property
-    def name(cls) -> str:
-        return "CrabRider"
-    
-    @classmethod
-    @property
-    def unit_type(cls) -> str:
-        return UnitTypes.basic_rider
+    cost = 2
+    name = "CrabRider"
+    unit_type = UnitTypes.basic_rider
 
 class Harpooneers(Unit):
     def __init__(self) -> None:
@@ -185,20 +118,9 @@ class Harpooneers(Unit):
     def initialize_clash_dice(self) -> None:
         self.clash_dice = [dice.PurpleDie()]
 
-    @classmethod
-    @property
-    def cost(cls) -> int:
-        return 5
-
-    @classmethod
-    @property
-    def name(cls) -> str:
-        return "Harpooneers"
-    
-    @classmethod
-    @property
-    def unit_type(cls) -> str:
-        return UnitTypes.elite_warrior
+    cost = 5
+    name = "Harpooneers"
+    unit_type = UnitTypes.elite_warrior
 
 
 class ReefKing(Unit):
@@ -211,20 +133,9 @@ class ReefKing(Unit):
     def initialize_clash_dice(self) -> None:
         self.clash_dice = [dice.BlackDie()]
 
-    @classmethod
-    @property
-    def cost(cls) -> int:
-        return 9
-
-    @classmethod
-    @property
-    def name(cls) -> str:
-        return "Reef King"
-    
-    @classmethod
-    @property
-    def unit_type(cls) -> str:
-        return UnitTypes.elite_archer
+    cost = 9
+    name = "Reef King"
+    unit_type = UnitTypes.elite_archer
 
 garrison_level_1 = Garrison1()
 logger.debug(garrison_level_1.clash_dice)